@@ -0,0 +1,51 @@
+"""Compares DateTime deserialization against plain isodate parsing.
+
+    $ python benchmarks/bench_datetime.py
+
+"""
+from __future__ import print_function
+
+import timeit
+from datetime import datetime, timedelta
+
+import isodate
+
+from cosmic.types import Array, DateTime
+
+
+start = datetime(2014, 1, 1)
+# A time series with one timestamp per minute, each repeated three times
+# as in a payload with several series sharing the same time axis
+unique = [unicode((start + timedelta(minutes=i)).isoformat() + 'Z')
+          for i in range(10000)]
+payload = unique * 3
+schema = Array(DateTime)
+
+
+def with_isodate():
+    return [isodate.parse_datetime(s) for s in payload]
+
+
+def without_cache():
+    DateTime._cache.clear()
+    old, DateTime.cache_size = DateTime.cache_size, 0
+    try:
+        return schema.from_json(payload)
+    finally:
+        DateTime.cache_size = old
+
+
+def with_cache():
+    DateTime._cache.clear()
+    old, DateTime.cache_size = DateTime.cache_size, len(unique)
+    try:
+        return schema.from_json(payload)
+    finally:
+        DateTime.cache_size = old
+
+
+if __name__ == "__main__":
+    assert with_isodate() == without_cache() == with_cache()
+    for func in [with_isodate, without_cache, with_cache]:
+        t = min(timeit.repeat(func, number=1, repeat=5))
+        print("%-15s %8.1f ms" % (func.__name__, t * 1000))
@@ -3,10 +3,10 @@ import json
 import inspect
 from collections import OrderedDict
 
-from .tools import get_args, assert_is_compatible, \
-    validate_underscore_identifier
+from .tools import validate_underscore_identifier, LRUCache, ActionPlan
 from .types import *
 from .globals import cosmos
+from .exceptions import SpecError
 from . import MODEL_METHODS
 
 
@@ -65,6 +65,18 @@ class API(BaseAPI):
             "actions": OrderedDict(),
             "models": OrderedDict(),
         })
+        #: Server-side options for each action, keyed by action name. These
+        #: are passed into :meth:`action` and are not part of the spec.
+        self.action_options = {}
+        #: Response caches of the actions registered with *cache*, keyed by
+        #: action name.
+        self.response_caches = {}
+        #: :class:`~cosmic.tools.ActionPlan` of each action, keyed by action
+        #: name.
+        self.action_plans = {}
+        #: The JSON form of the spec, served by ``/spec.json``. Set by
+        #: :meth:`freeze`.
+        self.spec_json = None
 
     def run(self, port=5000, debug=False, **kwargs):
         """Simple way to run the API in development. The debug parameter gets
@@ -79,7 +91,9 @@ class API(BaseAPI):
         run_simple('127.0.0.1', port, server.wsgi_app, **kwargs)
 
 
-    def action(self, accepts=None, returns=None):
+    def action(self, accepts=None, returns=None, trusted_output=None,
+               pure=False, cache=False, cache_ttl=None, cache_size=1024,
+               max_concurrency=None, priority=None, stream_items=False):
         """A decorator for registering actions with API.
 
         The *accepts* parameter is a schema that describes the input of the
@@ -87,6 +101,33 @@ class API(BaseAPI):
         function. The name of the function becomes the name of the action and
         the docstring serves as the action's documentation.
 
+        If *trusted_output* is not None, it overrides the
+        :data:`~cosmic.http.Server.trusted_output` setting of the server for
+        this action.
+
+        Set *pure* if the result of the action only depends on its input and
+        calling it has no side effects. A :class:`~cosmic.http.Server` with
+        *coalesce* enabled will then let concurrent calls with the same input
+        share one call.
+
+        If *cache* is true, the server keeps the responses of the action for
+        up to *cache_ttl* seconds (forever if None), keyed by the validated
+        input, and answers repeated requests without calling the action.
+        Bodies that only differ in whitespace or key order share a response.
+        At most *cache_size* responses are kept. See :meth:`invalidate_cache`.
+
+        *max_concurrency* limits how many calls of the action a server
+        handles at once, and *priority* overrides the action's
+        :data:`~cosmic.http.Endpoint.priority`. Requests that wait longer than
+        :data:`~cosmic.http.Server.max_queue_time` get a ``503`` response.
+
+        If *accepts* is an :data:`~cosmic.types.Array` and *stream_items* is
+        true, the server calls the action with an iterator over the items as
+        they are read from the request and validated, instead of a list. If
+        an invalid item is reached, the iterator raises
+        :exc:`~cosmic.exceptions.ValidationError` and the client gets a
+        ``400`` response.
+
         Once registered, an action will become accessible as an attribute of
         the :data:`~cosmic.api.BaseAPI.actions` object.
 
@@ -103,12 +144,12 @@ class API(BaseAPI):
         """
 
         def wrapper(func):
+            self.assert_not_frozen()
             name = unicode(func.__name__)
             validate_underscore_identifier(name)
-            required_args, optional_args = get_args(func)
-
-            if accepts:
-                assert_is_compatible(accepts, required_args, optional_args)
+            plan = ActionPlan(func, accepts, returns)
+            if stream_items and not isinstance(accepts, Array):
+                raise SpecError("stream_items requires an Array schema")
 
             doc = inspect.getdoc(func)
             self.spec['actions'][name] = {
@@ -116,6 +157,16 @@ class API(BaseAPI):
                 "returns": returns,
                 "doc": doc,
             }
+            self.action_options[name] = {
+                "trusted_output": trusted_output,
+                "pure": pure,
+                "max_concurrency": max_concurrency,
+                "priority": priority,
+                "stream_items": stream_items,
+            }
+            self.action_plans[name] = plan
+            if cache:
+                self.response_caches[name] = LRUCache(cache_size, cache_ttl)
 
             setattr(self.actions, name, func)
 
@@ -123,6 +174,27 @@ class API(BaseAPI):
 
         return wrapper
 
+    def invalidate_cache(self, action_name=None):
+        """Empties the response cache of *action_name*, or of all actions if
+        it is None.
+        """
+        if action_name is None:
+            caches = self.response_caches.values()
+        else:
+            caches = [self.response_caches[action_name]]
+        for cache in caches:
+            cache.clear()
+
+    def cache_stats(self):
+        """Returns a dict mapping the names of cached actions to dicts with
+        their number of *hits*, *misses*, *evictions* and cached responses
+        (*size*).
+        """
+        stats = {}
+        for name, cache in self.response_caches.items():
+            stats[name] = dict(cache.stats, size=len(cache))
+        return stats
+
     def model(self, model_cls):
         """A decorator for registering a model with an API. The name of the
         model class is used as the name of the resulting model. A subclass
@@ -143,25 +215,58 @@ class API(BaseAPI):
         :data:`~cosmic.api.BaseAPI.models` object.
         """
 
+        self.assert_not_frozen()
         name = model_cls.__name__
 
         m = Object()
         m.validate_patch = model_cls.validate_patch
+        m.trusted_output = model_cls.trusted_output
+        m.max_concurrency = model_cls.max_concurrency
+        m.priority = model_cls.priority
+        m.accepts_fields = model_cls.accepts_fields
+        m.get_by_ids = model_cls.get_by_ids
+        m.count = model_cls.count
 
         methods = {}
         for method in MODEL_METHODS:
             methods[method] = method in model_cls.methods
             setattr(m, method, getattr(model_cls, method))
 
-        self.spec['models'][unicode(name)] = {
+        model_spec = {
             "properties": OrderedDict(model_cls.properties),
             "links": OrderedDict(model_cls.links),
             "query_fields": OrderedDict(model_cls.query_fields),
             "list_metadata": OrderedDict(model_cls.list_metadata),
             "methods": methods,
         }
-        APISpec.assemble(self.spec)
+        # Models registered earlier have been checked already
+        APISpec.validate_model(name, model_spec)
+        self.spec['models'][unicode(name)] = model_spec
         setattr(self.models, name, m)
 
         return model_cls
 
+    def freeze(self):
+        """Checks the spec as a whole and builds its JSON form once, so that
+        ``/spec.json`` doesn't serialize it on every request. Links to other
+        models of this API are checked here, since a model may link to one
+        that is registered after it. Call this once all actions and models
+        are registered; registering more raises
+        :exc:`~cosmic.exceptions.SpecError`.
+        """
+        APISpec.assemble(self.spec)
+        for model_name, model_spec in self.spec['models'].items():
+            for link_name, link in model_spec['links'].items():
+                target = link['model']
+                if (target.api_name == self.spec['name'] and
+                        target.model_name not in self.spec['models']):
+                    raise SpecError("Link '%s' of %s points to a missing "
+                                    "model: %s" % (link_name, model_name,
+                                                   target.full_name))
+        self.spec_json = APISpec.to_json(self.spec)
+
+    def assert_not_frozen(self):
+        if self.spec_json is not None:
+            raise SpecError("Cannot register with a frozen API: %s" %
+                            self.spec['name'])
+
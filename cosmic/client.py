@@ -1,5 +1,9 @@
 import json
 import copy
+import threading
+from collections import MutableMapping, OrderedDict
+from contextlib import contextmanager
+from multiprocessing.pool import ThreadPool
 
 import requests
 from requests.sessions import Session
@@ -10,21 +14,123 @@ from werkzeug.wrappers import Response
 
 from .api import BaseAPI, Object
 from .types import *
-from .globals import cosmos
+from .types import native_binary
+from .globals import cosmos, deadline, time_remaining, ContextVar
+from .exceptions import SpecError, DeadlineExceeded, NotFound, \
+    RemoteHTTPError
+from .formats import get_format
 from .http import CreateEndpoint, DeleteEndpoint, GetByIdEndpoint, \
-    GetListEndpoint, UpdateEndpoint, ActionEndpoint, SpecEndpoint
+    GetByIdsEndpoint, GetListEndpoint, UpdateEndpoint, ActionEndpoint, \
+    SpecEndpoint, CountEndpoint, StreamListEndpoint, get_mimetype, \
+    DEADLINE_HEADER
 
 
 class BaseAPIClient(BaseAPI):
+    #: Mimetype of the :class:`~cosmic.formats.Format` used for request
+    #: bodies and asked for in the Accept header. Servers that don't support
+    #: it keep responding with JSON.
+    wire_format = "application/json"
+    #: Seconds each call may take, including the server's work. Calls made
+    #: within a :func:`~cosmic.globals.deadline` get the smaller of the two.
+    timeout = None
+    #: Most ids fetched by one bulk request of a :meth:`loader`
+    loader_batch_size = 100
+    #: Number of concurrent ``get_by_id`` requests a :meth:`loader` makes
+    #: for servers that don't support bulk reads
+    loader_concurrency = 8
 
     def __init__(self, *args, **kwargs):
         super(BaseAPIClient, self).__init__(*args, **kwargs)
+        self._loader = ContextVar('cosmic.client.loader')
+        self._readers = {}
+        self._bulk_readers = {}
+        self._bulk_supported = {}
         self._generate_handler_objects()
 
+    @contextmanager
+    def loader(self):
+        """Within this context, :meth:`get_by_id` calls without extra
+        arguments return a :class:`LazyRepresentation` instead of making a
+        request. The first time one of them is used, the ids requested from
+        its model so far are fetched together through
+        :class:`~cosmic.http.GetByIdsEndpoint`, so a loop over
+        ``get_by_id`` costs one request instead of one per id:
+
+        .. code:: python
+
+            with client.loader():
+                cities = [client.models.City.get_by_id(id) for id in ids]
+                names = [city["name"] for city in cities]
+
+        Each id is fetched once per context, later calls reuse the result.
+        Missing objects raise :exc:`~cosmic.exceptions.NotFound` when their
+        representation is used. Servers without bulk reads get concurrent
+        ``get_by_id`` requests instead.
+        """
+        loader = Loader(self)
+        token = self._loader.set(loader)
+        try:
+            yield loader
+        finally:
+            self._loader.reset(token)
+
+    def fetch_many(self, model_name, ids):
+        """Returns a dict of the representations of the objects of
+        *model_name* with the given *ids* that exist.
+        """
+        found = {}
+        if self._bulk_supported.get(model_name, True):
+            get_by_ids = self._bulk_readers[model_name]
+            try:
+                for i in range(0, len(ids), self.loader_batch_size):
+                    found.update(get_by_ids(ids[i:i + self.loader_batch_size]))
+                return found
+            except RemoteHTTPError as err:
+                if err.code not in (404, 405):
+                    raise
+                # Servers before bulk reads take "_bulk" for an id
+                self._bulk_supported[model_name] = False
+
+        get_by_id = self._readers[model_name]
+        remaining = time_remaining()
+
+        def fetch(id):
+            with deadline(remaining):
+                try:
+                    return id, get_by_id(id)
+                except NotFound:
+                    return id, None
+
+        if self.loader_concurrency > 1 and len(ids) > 1:
+            pool = ThreadPool(min(self.loader_concurrency, len(ids)))
+            try:
+                results = pool.map(fetch, ids)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [fetch(id) for id in ids]
+        return dict((id, rep) for id, rep in results if rep is not None)
+
     def call(self, endpoint, *args, **kwargs):
-        req = self.build_request(endpoint, *args, **kwargs)
-        res = self.make_request(endpoint, req)
-        return self.parse_response(endpoint, res)
+        with deadline(self.timeout):
+            budget = None
+            remaining = time_remaining()
+            if remaining is not None:
+                # The server gets the remaining time as a relative value,
+                # so that clock skew between the two doesn't matter. Less
+                # than a millisecond is sent as no time at all.
+                budget = "%.3f" % remaining
+                if float(budget) <= 0:
+                    raise DeadlineExceeded()
+            with native_binary(endpoint.request_format.native_binary):
+                req = self.build_request(endpoint, *args, **kwargs)
+            if budget is not None:
+                req.headers[DEADLINE_HEADER] = budget
+            res = self.make_request(endpoint, req)
+        fmt = get_format(get_mimetype(res.headers))
+        with native_binary(fmt is not None and fmt.native_binary):
+            return self.parse_response(endpoint, res)
 
     def build_request(self, endpoint, *args, **kwargs):
         return endpoint.build_request(*args, **kwargs)
@@ -39,23 +145,145 @@ class BaseAPIClient(BaseAPI):
         from functools import partial
 
         spec = self.spec
+        fmt = get_format(self.wire_format)
+        if fmt is None:
+            raise SpecError("Unknown wire format: %s" % self.wire_format)
+
+        def bind(endpoint):
+            endpoint.request_format = endpoint.response_format = fmt
+            return partial(self.call, endpoint)
 
         for name, action in spec["actions"].items():
-            setattr(self.actions, name,
-                    partial(self.call, ActionEndpoint(spec, name)))
+            setattr(self.actions, name, bind(ActionEndpoint(spec, name)))
 
         for name, modeldef in spec["models"].items():
             m = Object()
-            m.create = partial(self.call, CreateEndpoint(spec, name))
-            m.update = partial(self.call, UpdateEndpoint(spec, name))
-            m.delete = partial(self.call, DeleteEndpoint(spec, name))
-            m.get_list = partial(self.call, GetListEndpoint(spec, name))
-            m.get_by_id = partial(self.call, GetByIdEndpoint(spec, name))
+            m.create = bind(CreateEndpoint(spec, name))
+            m.update = bind(UpdateEndpoint(spec, name))
+            m.delete = bind(DeleteEndpoint(spec, name))
+            m.get_list = self._streaming(
+                bind(GetListEndpoint(spec, name)),
+                bind(StreamListEndpoint(spec, name)))
+            m.count = bind(CountEndpoint(spec, name))
+            m.get_by_ids = bind(GetByIdsEndpoint(spec, name))
+            m.get_by_id = self._loading(
+                name, bind(GetByIdEndpoint(spec, name)))
             m.validate_patch = lambda patch: None
+            self._readers[name] = m.get_by_id.get_by_id
+            self._bulk_readers[name] = m.get_by_ids
 
             setattr(self.models, name, m)
 
 
+    def _streaming(self, get_list, stream_list):
+        # get_list(stream=True) returns a ListStream read as it arrives
+        def get(stream=False, **query):
+            if stream:
+                return stream_list(**query)
+            return get_list(**query)
+        return get
+
+    def _loading(self, model_name, get_by_id):
+        # Defers plain get_by_id calls to the current loader, if any
+        def load(id, **kwargs):
+            loader = self._loader.get(None)
+            if loader is None or kwargs:
+                return get_by_id(id, **kwargs)
+            return loader.load(model_name, id)
+        load.get_by_id = get_by_id
+        return load
+
+
+class Loader(object):
+    """Collects the ids requested through a
+    :meth:`~BaseAPIClient.loader` context and keeps the fetched
+    representations for its duration.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.RLock()
+        # Ids to fetch by model name, in order of request
+        self.pending = {}
+        # Representations by model name and id, None for missing objects
+        self.results = {}
+
+    def load(self, model_name, id):
+        with self.lock:
+            key = (model_name, id)
+            if key not in self.results:
+                self.pending.setdefault(model_name, OrderedDict())[id] = True
+        return LazyRepresentation(self, model_name, id)
+
+    def get(self, model_name, id):
+        """Returns the representation of an object, fetching it along with
+        the other pending ids of its model if needed.
+        """
+        with self.lock:
+            key = (model_name, id)
+            if key not in self.results:
+                self.load(model_name, id)
+                self.flush(model_name)
+            rep = self.results[key]
+        if rep is None:
+            raise NotFound
+        return rep
+
+    def flush(self, model_name=None):
+        """Fetches the pending ids of *model_name*, or of all models."""
+        with self.lock:
+            if model_name is None:
+                model_names = list(self.pending.keys())
+            else:
+                model_names = [model_name]
+            for name in model_names:
+                ids = list(self.pending.pop(name, {}))
+                if not ids:
+                    continue
+                found = self.client.fetch_many(name, ids)
+                for id in ids:
+                    self.results[name, id] = found.get(id)
+
+
+class LazyRepresentation(MutableMapping):
+    """Stands in for the representation returned by ``get_by_id`` inside a
+    :meth:`~BaseAPIClient.loader` context. It behaves like the
+    representation dict, which is fetched the first time it is used.
+    """
+
+    def __init__(self, loader, model_name, id):
+        self.loader = loader
+        self.model_name = model_name
+        self.id = id
+        self._rep = None
+
+    @property
+    def rep(self):
+        if self._rep is None:
+            self._rep = self.loader.get(self.model_name, self.id)
+        return self._rep
+
+    def __getitem__(self, key):
+        return self.rep[key]
+
+    def __setitem__(self, key, value):
+        self.rep[key] = value
+
+    def __delitem__(self, key):
+        del self.rep[key]
+
+    def __iter__(self):
+        return iter(self.rep)
+
+    def __len__(self):
+        return len(self.rep)
+
+    def __repr__(self):
+        if self._rep is None:
+            return "<LazyRepresentation %s %s>" % (self.model_name, self.id)
+        return repr(self._rep)
+
+
 class APIClient(BaseAPIClient):
     verify = True
     base_url = None
@@ -68,18 +296,24 @@ class APIClient(BaseAPIClient):
     def make_request(self, endpoint, request):
         request.url = self.base_url + request.url
         prepared = self.session.prepare_request(request)
-        return self.session.send(prepared,
-                                 stream=False,
-                                 timeout=None,
-                                 verify=self.verify,
-                                 cert=None,
-                                 proxies={},
-                                 allow_redirects=True)
+        timeout = request.headers.get(DEADLINE_HEADER)
+        try:
+            return self.session.send(prepared,
+                                     stream=endpoint.stream_response,
+                                     timeout=timeout and float(timeout),
+                                     verify=self.verify,
+                                     cert=None,
+                                     proxies={},
+                                     allow_redirects=True)
+        except requests.Timeout:
+            raise DeadlineExceeded()
 
 
 class WsgiAPIClient(BaseAPIClient):
     wsgi_app = None
     server_cosmos = None
+    # Requests swap the global cosmos, so they can't run concurrently
+    loader_concurrency = 1
 
     def __init__(self, *args, **kwargs):
         self.client = WerkzeugTestClient(self.wsgi_app, response_wrapper=Response)
@@ -87,10 +321,17 @@ class WsgiAPIClient(BaseAPIClient):
         super(WsgiAPIClient, self).__init__(*args, spec=spec, **kwargs)
 
     def make_request(self, endpoint, request):
+        data = request.data
+        if hasattr(data, 'read'):
+            data = data.read()
+        elif not isinstance(data, (bytes, unicode)):
+            data = b"".join(data)
         kwargs = {
             "method": request.method,
-            "data": request.data,
-            "headers": request.headers
+            "data": data,
+            "headers": request.headers,
+            # Streamed responses must be read while server_cosmos is in place
+            "buffered": True,
         }
         # Content-Type should be provided as kwarg because otherwise we can't
         # access request.mimetype
@@ -108,6 +349,7 @@ class WsgiAPIClient(BaseAPIClient):
         resp._content = r.data
         resp.headers = CaseInsensitiveDict(r.headers)
         resp.status_code = r.status_code
+        resp.request = request
 
         return resp
 
@@ -134,7 +376,7 @@ class ClientLoggingMixin(object):
         for key in sorted(res.headers.keys()):
             headers.append((key.title(), res.headers[key]))
         saved_resp = {
-            "data": res.text,
+            "data": None if endpoint.stream_response else res.text,
             "headers": headers,
             "status_code": res.status_code
         }
@@ -33,6 +33,16 @@ class RemoteHTTPError(HTTPError):
     pass
 
 
+class DeadlineExceeded(HTTPError):
+    """Raised by clients when the deadline of a call (see
+    :func:`cosmic.globals.deadline`) passes before a response arrives. If
+    raised by a handler, the server responds with ``504``.
+    """
+
+    def __init__(self, message="Deadline Exceeded"):
+        super(DeadlineExceeded, self).__init__(504, message)
+
+
 class ThreadLocalMissing(Exception):
     """Raised when trying to access a value inside
     :class:`cosmic.globals.ThreadLocalDict` without creating a thread-local
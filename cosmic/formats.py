@@ -0,0 +1,224 @@
+import re
+import json
+import codecs
+from collections import OrderedDict
+
+from .exceptions import SpecError
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+__all__ = ['Format', 'JSONFormat', 'MsgPackFormat', 'formats',
+           'register_format', 'get_format', 'iter_json_array']
+
+
+class Format(object):
+    """Describes how JSON-like data is encoded in request and response
+    bodies. Subclass it and pass an instance to :func:`register_format` to
+    make the server accept the new mimetype.
+    """
+    #: The mimetype used for the Content-Type and Accept headers
+    mimetype = None
+    #: If true, :data:`~cosmic.types.Binary` values are put into the
+    #: payload as byte strings instead of base64-encoded strings.
+    native_binary = False
+
+    def dumps(self, datum):
+        raise NotImplementedError()
+
+    def loads(self, data, charset=None):
+        """Decodes a request or response body. Raises
+        :exc:`~cosmic.exceptions.SpecError` if the data can't be decoded.
+        """
+        raise NotImplementedError()
+
+
+class JSONFormat(Format):
+    mimetype = "application/json"
+
+    def dumps(self, datum):
+        return json.dumps(datum)
+
+    def loads(self, data, charset=None):
+        if charset is not None and charset.lower() != "utf-8":
+            raise SpecError('Content-Type charset must be "utf-8" got %s instead' % charset)
+        try:
+            data = data.decode('utf-8')
+        except UnicodeDecodeError:
+            raise SpecError("Unicode Decode Error")
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise SpecError("Invalid JSON")
+
+
+_whitespace = re.compile(r'[ \t\n\r]*')
+# Characters that may continue a number cut off at the end of a chunk
+_number_tail = re.compile(r'[0-9.eE+\-]*')
+_decoder = json.JSONDecoder()
+# The C scanner of Python 2 doesn't say where nested values fail, so the
+# pure Python one is used to locate errors
+_locating_decoder = json.JSONDecoder()
+_locating_decoder.parse_string = json.decoder.py_scanstring
+_locating_decoder.scan_once = json.scanner.py_make_scanner(_locating_decoder)
+_error_position = re.compile(r'\(char (\d+)')
+# Longest text that may be cut off at the end of a chunk before the
+# decoder can tell, like "-Infinity" or a surrogate pair of escapes
+_max_partial_token = 12
+
+
+class _JSONReader(object):
+    """Decodes JSON values one at a time from a byte stream, keeping only
+    the text that hasn't been consumed yet in memory.
+    """
+
+    def __init__(self, stream, chunk_size):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buf = u""
+        self.pos = 0
+        self.eof = False
+
+    def more(self, size=None):
+        """Reads another chunk into the buffer. Returns False at the end of
+        the stream.
+        """
+        if self.eof:
+            return False
+        chunk = self.stream.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+        try:
+            text = self.decoder.decode(chunk, final=self.eof)
+        except UnicodeDecodeError:
+            raise SpecError("Unicode Decode Error")
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def char(self, consume=True):
+        """Returns the next non-whitespace character, or an empty string at
+        the end of the stream. Unless *consume* is false, the character is
+        skipped over.
+        """
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf) or not self.more():
+                break
+        c = self.buf[self.pos:self.pos + 1]
+        if consume:
+            self.pos += len(c)
+        return c
+
+    def value(self):
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Read as much again as is pending, so that a large value
+                # isn't rescanned once per chunk
+                if not self.truncated() or not self.more(
+                        max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise SpecError("Invalid JSON")
+                continue
+            if (not self.eof and
+                    _number_tail.match(self.buf, end).end() == len(self.buf)):
+                self.more()
+                continue
+            self.pos = end
+            return value
+
+    def truncated(self):
+        """Whether the value at the current position fails to decode because
+        the buffer ends too early, rather than because it is invalid.
+        """
+        try:
+            _locating_decoder.raw_decode(self.buf, self.pos)
+        except ValueError as err:
+            message = str(err)
+            if message.startswith("Unterminated string"):
+                return True
+            pos = getattr(err, 'pos', None)
+            if pos is None:
+                match = _error_position.search(message)
+                pos = int(match.group(1)) if match else self.pos
+            return len(self.buf) - pos <= _max_partial_token
+        return True
+
+
+def iter_json_array(stream, chunk_size=65536):
+    """Yields the items of the JSON array read from *stream*, a file-like
+    object of UTF-8 encoded bytes, as soon as each of them has been read.
+    The stream is read *chunk_size* bytes at a time, so the whole body is
+    never held in memory. Raises :exc:`~cosmic.exceptions.SpecError` where
+    the data stops being a valid JSON array.
+    """
+    reader = _JSONReader(stream, chunk_size)
+    if reader.char() != u"[":
+        raise SpecError("Expected JSON array")
+    if reader.char(consume=False) == u"]":
+        reader.char()
+    else:
+        while True:
+            yield reader.value()
+            c = reader.char()
+            if c == u"]":
+                break
+            if c != u",":
+                raise SpecError("Invalid JSON")
+    if reader.char() != u"":
+        raise SpecError("Invalid JSON")
+
+
+def _unicode_keys(pairs):
+    # Byte string keys come from Python 2 peers, where str is packed as bin
+    return dict((k.decode('utf-8') if isinstance(k, bytes) else k, v)
+                for k, v in pairs)
+
+
+class MsgPackFormat(Format):
+    """`MessagePack <http://msgpack.org/>`_, available when the *msgpack*
+    package is installed. Binary data travels as MessagePack *bin* values.
+    """
+    mimetype = "application/msgpack"
+    native_binary = True
+
+    def dumps(self, datum):
+        return msgpack.packb(datum, use_bin_type=True)
+
+    def loads(self, data, charset=None):
+        try:
+            return msgpack.unpackb(data, raw=False,
+                                   object_pairs_hook=_unicode_keys)
+        except (ValueError, TypeError, msgpack.UnpackException):
+            raise SpecError("Invalid MessagePack")
+
+
+#: Registered formats keyed by mimetype, in order of preference. JSON is
+#: always first, so it is used whenever the client doesn't ask for anything
+#: else.
+formats = OrderedDict()
+
+
+def register_format(fmt):
+    """Makes servers accept and clients request *fmt*, a
+    :class:`Format` instance, under its mimetype.
+    """
+    formats[fmt.mimetype] = fmt
+
+
+def get_format(mimetype):
+    """Returns the registered :class:`Format` for *mimetype*, or None."""
+    return formats.get(mimetype)
+
+
+json_format = JSONFormat()
+register_format(json_format)
+
+if msgpack is not None:
+    register_format(MsgPackFormat())
@@ -1,16 +1,61 @@
+import time
+from threading import Lock
 from contextlib import contextmanager
 from collections import MutableMapping
 from werkzeug.local import get_ident
 
 from cosmic.exceptions import ThreadLocalMissing
 
-__all__ = ['thread_local', 'SwappableDict', 'ThreadLocalDict']
+__all__ = ['thread_local', 'SwappableDict', 'ThreadLocalDict', 'deadline',
+           'time_remaining']
 
 storage = {}
 
+_missing = object()
+
+
+class IdentContextVar(object):
+    """A stand-in for :class:`contextvars.ContextVar` on interpreters that
+    don't have it. Values are keyed on the current greenlet if greenlet is
+    installed, otherwise on the current thread.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def get(self, default=_missing):
+        try:
+            return storage[get_ident(), self][0]
+        except KeyError:
+            if default is _missing:
+                raise LookupError(self)
+            return default
+
+    def set(self, value):
+        key = (get_ident(), self)
+        token = (key, storage.get(key, _missing))
+        storage[key] = (value,)
+        return token
+
+    def reset(self, token):
+        key, old = token
+        if old is _missing:
+            del storage[key]
+        else:
+            storage[key] = old
+
+
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = IdentContextVar
+
+
+_local = ContextVar('cosmic.globals.thread_local')
+
 
 @contextmanager
-def thread_local():
+def thread_local(local=None):
     """A context manager for safely creating and deleting the thread-local
     necessary for :class:`~cosmic.globals.ThreadLocalDict`.
 
@@ -22,22 +67,90 @@ def thread_local():
             # g is only accessible within this context
             g['foo'] = 1
 
+    The storage is backed by a :class:`contextvars.ContextVar` where
+    available, so it is isolated between asyncio tasks and greenlets as well
+    as threads. Nesting this context manager creates a fresh storage that is
+    discarded on exit, restoring the outer one. Passing the storage of
+    another context as *local* (see :func:`current_thread_local`) enters it
+    again, e.g. from code that runs after that context has been left.
+    """
+    if local is None:
+        local = {}
+    token = _local.set(local)
+    try:
+        yield local
+    finally:
+        _local.reset(token)
+
+
+def current_thread_local():
+    """Returns the storage of the current :func:`thread_local` context, or
+    None outside of one.
     """
-    ident = get_ident()
-    storage[ident] = local = {}
-    yield local
-    del storage[ident]
+    return _local.get(None)
 
 
 @contextmanager
 def ensure_thread_local():
-    if get_ident() in storage:
+    if _local.get(None) is not None:
         yield
     else:
         with thread_local():
             yield
 
 
+try:
+    monotonic = time.monotonic
+except AttributeError:
+    _last_time = [0.0]
+    _last_time_lock = Lock()
+
+    def monotonic():
+        """Like :func:`time.time`, but never goes backwards. Used to measure
+        intervals where :func:`time.monotonic` is missing.
+        """
+        with _last_time_lock:
+            now = _last_time[0] = max(_last_time[0], time.time())
+            return now
+
+
+_deadline = ContextVar('cosmic.globals.deadline')
+
+
+@contextmanager
+def deadline(seconds):
+    """A context manager that gives the code inside it *seconds* to finish.
+    Client calls made within it time out when the deadline passes and pass
+    the remaining time on to the server, where it applies to the handler and
+    any calls it makes in turn. Nested deadlines can only shorten the outer
+    one. A *seconds* value of None leaves the current deadline in place.
+
+    .. code::
+
+        with deadline(2.5):
+            quotes.actions.price("ACME")
+    """
+    new = None if seconds is None else time.time() + seconds
+    current = _deadline.get(None)
+    if current is not None and (new is None or current < new):
+        new = current
+    token = _deadline.set(new)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_remaining():
+    """Returns the number of seconds left until the current
+    :func:`deadline`, which may be negative, or None if there is none.
+    """
+    current = _deadline.get(None)
+    if current is None:
+        return None
+    return current - time.time()
+
+
 def thread_local_middleware(app):
     """To put your entire application in a :func:`~cosmic.globals.thread_local`
     context, you must put it at the entry point of your application's thread.
@@ -116,18 +229,21 @@ class ThreadLocalDict(SwappableDict):
         pass
 
     def __repr__(self):
-        if get_ident() in storage:
+        if _local.get(None) is not None:
             return repr(self.data)
         else:
             return '<unbound ThreadLocalDict>'
 
     @property
     def data(self):
+        local = _local.get(None)
+        if local is None:
+            raise ThreadLocalMissing()
         try:
-            local = storage[get_ident()]
+            return local[id(self)]
         except KeyError:
-            raise ThreadLocalMissing()
-        return local.setdefault(id(self), {})
+            data = local[id(self)] = {}
+            return data
 
 
 cosmos = SwappableDict()
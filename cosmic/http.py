@@ -1,22 +1,38 @@
+import os
+import io
+import sys
 import json
+import heapq
+import mmap
+import logging
+import itertools
+import tempfile
+import threading
 
 import requests
 from werkzeug.exceptions import NotFound as WerkzeugNotFound
 from werkzeug.wrappers import Request, Response
+from werkzeug.wsgi import wrap_file, ClosingIterator
 from werkzeug.routing import Rule
 from werkzeug.routing import Map as RuleMap
+from werkzeug.urls import url_decode, url_encode, url_parse
+from werkzeug.datastructures import MultiDict
 
 from .types import *
-from .tools import get_args, string_to_json, args_to_datum, deserialize_json, \
-    serialize_json
+from .tools import string_to_json, args_to_datum, \
+    serialize_json, trusted_serializer, ActionPlan
 from .exceptions import *
-from .globals import ensure_thread_local
+from .globals import ensure_thread_local, deadline, time_remaining, \
+    monotonic, thread_local, current_thread_local
+from .formats import formats, get_format, json_format, iter_json_array
+from .types import native_binary
 
 
 class Server(object):
     url_map = RuleMap([
         Rule('/spec.json', endpoint='spec', methods=['GET']),
         Rule('/actions/<action>', endpoint='action', methods=['POST']),
+        Rule('/<model>/_bulk', endpoint='get_by_ids', methods=['GET']),
         Rule('/<model>/<id>', endpoint='get_by_id', methods=['GET']),
         Rule('/<model>/<id>', endpoint='update', methods=['PUT']),
         Rule('/<model>/<id>', endpoint='delete', methods=['DELETE']),
@@ -24,9 +40,40 @@ class Server(object):
         Rule('/<model>', endpoint='get_list', methods=['GET']),
     ])
 
-    def __init__(self, api, debug=False):
+    def __init__(self, api, debug=False, trusted_output=False,
+                 output_sample_rate=None, coalesce=False,
+                 max_concurrency=None, max_queue_time=1.0, retry_after=1):
         self.api = api
         self.debug = debug
+        #: If true, responses are serialized with
+        #: :func:`~cosmic.tools.trusted_serializer` instead of a full walk
+        #: of the handler output. Actions and models may override this with
+        #: their own *trusted_output* option. Ignored in debug mode.
+        self.trusted_output = trusted_output
+        #: If set to *N*, one in *N* trusted responses is also serialized in
+        #: full and the two are compared, see
+        #: :meth:`trusted_output_mismatch_hook`.
+        self.output_sample_rate = output_sample_rate
+        self._sample_counter = itertools.count(1)
+        #: If true, concurrent identical reads share one handler call and
+        #: one response, see :meth:`coalesce_key`.
+        self.coalesce = coalesce
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        #: If set, at most this many requests are handled at once. Waiting
+        #: requests are admitted in order of
+        #: :data:`~cosmic.http.Endpoint.priority`.
+        self.max_concurrency = max_concurrency
+        #: Seconds a request may wait for admission before it is rejected
+        #: with a ``503`` response.
+        self.max_queue_time = max_queue_time
+        #: Value of the ``Retry-After`` header of ``503`` responses.
+        self.retry_after = retry_after
+        self._admission = None
+        if max_concurrency:
+            self._admission = Admission(max_concurrency)
+        self._bulkheads = {}
+        self._bulkheads_lock = threading.Lock()
 
     def dispatch_request(self, request):
         adapter = self.url_map.bind_to_environ(request.environ)
@@ -35,8 +82,9 @@ class Server(object):
         except WerkzeugNotFound:
             return error_response("Not Found", 404)
 
+        bulkhead = None
         if endpoint_name == 'spec':
-            endpoint = SpecEndpoint(self.api.spec)
+            endpoint = SpecEndpoint(self.api.spec, self.api.spec_json)
 
         elif endpoint_name == 'action':
             action_name = values.pop('action')
@@ -45,17 +93,32 @@ class Server(object):
             endpoint = ActionEndpoint(
                 self.api.spec,
                 action_name,
-                getattr(self.api.actions, action_name))
+                plan=self.api.action_plans[action_name])
+            options = self.api.action_options.get(action_name, {})
+            endpoint.trusted_output = self.is_trusted(
+                options.get('trusted_output'))
+            endpoint.pure = options.get('pure', False)
+            endpoint.stream_items = options.get('stream_items', False)
+            endpoint.response_cache = self.api.response_caches.get(action_name)
+            if options.get('priority') is not None:
+                endpoint.priority = options['priority']
+            bulkhead = self.bulkhead(('action', action_name),
+                                     options.get('max_concurrency'))
         else:
             model_name = values.pop('model')
             if model_name not in self.api.spec['models'].keys():
                 return error_response("Not Found", 404)
             model_spec = self.api.spec['models'][model_name]
-            if not model_spec['methods'][endpoint_name]:
+            # Bulk reads are allowed wherever reads by id are
+            method = endpoint_name
+            if endpoint_name == 'get_by_ids':
+                method = 'get_by_id'
+            if not model_spec['methods'][method]:
                 return error_response("Method Not Allowed", 405)
             model_obj = getattr(self.api.models, model_name)
             endpoints = {
                 'get_by_id': GetByIdEndpoint,
+                'get_by_ids': GetByIdsEndpoint,
                 'create': CreateEndpoint,
                 'update': UpdateEndpoint,
                 'delete': DeleteEndpoint,
@@ -67,41 +130,233 @@ class Server(object):
                 "func": getattr(model_obj, endpoint_name),
             }
             endpoint = endpoints[endpoint_name](**args)
-
+            endpoint.trusted_output = self.is_trusted(model_obj.trusted_output)
+            endpoint.accepts_fields = model_obj.accepts_fields
+            endpoint.models = self.api.models
+            endpoint.count = model_obj.count
+            if endpoint_name in model_obj.priority:
+                endpoint.priority = model_obj.priority[endpoint_name]
+            bulkhead = self.bulkhead((model_name, endpoint_name),
+                                     model_obj.max_concurrency.get(endpoint_name))
+
+        admitted = []
         try:
-            return self.view(endpoint, request, **values)
+            for gate in (bulkhead, self._admission):
+                if gate is None:
+                    continue
+                wait = self.max_queue_time
+                remaining = time_remaining()
+                if remaining is not None:
+                    if remaining <= 0:
+                        raise DeadlineExceeded()
+                    wait = remaining if wait is None else min(wait, remaining)
+                if not gate.acquire(endpoint.priority, wait):
+                    return self.overloaded_response(endpoint)
+                admitted.append(gate)
+            response = self.view(endpoint, request, **values)
+            if response.direct_passthrough and admitted:
+                # Streamed bodies are produced as they are sent, so the
+                # slots are held until the server closes the body
+                response.response = ClosingIterator(
+                    response.response, [gate.release for gate in admitted])
+                admitted = []
+            return response
         except HTTPError as err:
             return error_response(err.message, err.code)
+        finally:
+            for gate in admitted:
+                gate.release()
 
     def wsgi_app(self, environ, start_response):
         with ensure_thread_local():
             request = Request(environ)
-            if self.debug:
-                response = self.dispatch_request(request)
-            else:
-                try:
+            with deadline(self.request_timeout(request)):
+                if self.debug:
                     response = self.dispatch_request(request)
-                except Exception as exc:
-                    response = self.unhandled_exception_hook(exc, request)
+                else:
+                    try:
+                        response = self.dispatch_request(request)
+                    except Exception as exc:
+                        response = self.unhandled_exception_hook(exc, request)
 
             return response(environ, start_response)
 
     def unhandled_exception_hook(self, exc, request):
         return error_response("Internal Server Error", 500)
 
+    def request_timeout(self, request):
+        """Returns the number of seconds the client is willing to wait for
+        the response, as sent in the ``X-Request-Timeout`` header, or None.
+        The request is handled within a :func:`~cosmic.globals.deadline` of
+        that many seconds.
+        """
+        try:
+            return float(request.headers[DEADLINE_HEADER])
+        except (KeyError, ValueError):
+            return None
+
+    def overloaded_response(self, endpoint):
+        """Returned when a request waited longer than
+        :data:`max_queue_time` for admission.
+        """
+        response = error_response("Service Unavailable", 503)
+        response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+    def bulkhead(self, key, limit):
+        """Returns the :class:`Admission` limiting the endpoint identified by
+        *key* to *limit* concurrent requests, or None if *limit* is None.
+        """
+        if not limit:
+            return None
+        with self._bulkheads_lock:
+            gate = self._bulkheads.get(key)
+            if gate is None:
+                gate = self._bulkheads[key] = Admission(limit)
+            return gate
+
+    def trusted_output_mismatch_hook(self, endpoint, trusted, full):
+        """Called when a sampled trusted response differs from the fully
+        serialized one. The full response is sent to the client either way.
+        """
+        logger.warning("Trusted output mismatch in %s %s",
+                       endpoint.method, endpoint.url)
+
+    def is_trusted(self, override=None):
+        if self.debug:
+            return False
+        if override is not None:
+            return override
+        return self.trusted_output
+
     def view(self, endpoint, request, **url_args):
+        endpoint.negotiate(request)
         try:
-            func_input = self.parse_request(endpoint, request, **url_args)
+            with native_binary(endpoint.request_format.native_binary):
+                func_input = self.parse_request(endpoint, request, **url_args)
         except ValidationError as err:
             return error_response(str(err), 400)
+        except CacheHit as hit:
+            return hit.response
 
+        # Don't start work the client has already given up on
+        remaining = time_remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded()
+
+        key = self.coalesce and self.coalesce_key(endpoint, request)
+        if key:
+            response = self.coalesced(key, self.execute, endpoint, func_input)
+        else:
+            response = self.execute(endpoint, func_input)
+
+        if (endpoint.cache_key is not None and
+                response.status_code in (200, 204) and
+                not response.direct_passthrough):
+            endpoint.response_cache.put(endpoint.cache_key, (
+                response.get_data(), response.status,
+                response.headers.to_wsgi_list()))
+        return response
+
+    def execute(self, endpoint, func_input):
         func_output = endpoint.handler(**func_input)
-        return self.build_response(endpoint,
-                                   func_input=func_input,
-                                   func_output=func_output)
+        sample = (endpoint.trusted_output and self.output_sample_rate and
+                  next(self._sample_counter) % self.output_sample_rate == 0)
+        if sample:
+            # The output is serialized twice, so iterators are read first
+            func_output = endpoint.materialize(func_output)
+        with native_binary(endpoint.response_format.native_binary):
+            response = self.build_response(endpoint,
+                                           func_input=func_input,
+                                           func_output=func_output)
+
+            if sample and not response.direct_passthrough:
+                response = self.check_trusted_output(
+                    endpoint, response, func_input, func_output)
+        return response
+
+    def coalesce_key(self, endpoint, request):
+        """Returns a key identifying the response to *request*, or None if
+        it must not be shared with other requests. By default, model reads
+        and actions registered with ``pure=True`` are keyed by URL, query
+        string or body and by the negotiated response format.
+
+        Requests are only coalesced after :meth:`parse_request`, so checks
+        done there still apply to every request. If responses depend on who
+        is asking, override this method to add the user to the key.
+        """
+        key = endpoint.coalesce_key(request)
+        if key is None:
+            return None
+        return (endpoint.response_format.mimetype,
+                endpoint.trusted_output) + key
+
+    def coalesced(self, key, func, *args):
+        """Calls *func* unless a call for the same *key* is in progress, in
+        which case it waits for that call and returns a copy of its response
+        (or raises its exception).
+        """
+        with self._flights_lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.exc_info is not None:
+                raise flight.exc_info[0], flight.exc_info[1], flight.exc_info[2]
+            if flight.response is None:
+                return func(*args)
+            body, status, headers = flight.response
+            return Response(body, status, headers)
+
+        try:
+            response = func(*args)
+            # Streamed responses can only be sent once
+            if not response.direct_passthrough:
+                flight.response = (response.get_data(), response.status,
+                                   response.headers.to_wsgi_list())
+            return response
+        except Exception:
+            flight.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def check_trusted_output(self, endpoint, response, func_input,
+                             func_output):
+        endpoint.trusted_output = False
+        try:
+            full = self.build_response(endpoint,
+                                       func_input=func_input,
+                                       func_output=func_output)
+        except Exception:
+            logger.exception("Full serialization failed in %s %s",
+                             endpoint.method, endpoint.url)
+            return response
+        finally:
+            endpoint.trusted_output = True
+
+        if not same_response_body(response, full):
+            self.trusted_output_mismatch_hook(endpoint, response, full)
+        return full
 
     def parse_request(self, endpoint, request, **url_args):
-        return endpoint.parse_request(request, **url_args)
+        func_input = endpoint.parse_request(request, **url_args)
+        if endpoint.response_cache is not None and not endpoint.stream_request:
+            # Requests with equal payloads share a response, however the
+            # bodies were encoded
+            endpoint.cache_key = (
+                endpoint.response_format.mimetype, endpoint.trusted_output,
+                endpoint.send_raw, endpoint.canonical_payload())
+            cached = endpoint.response_cache.get(endpoint.cache_key)
+            if cached is not None:
+                body, status, headers = cached
+                raise CacheHit(Response(body, status, headers))
+        return func_input
 
     def build_response(self, endpoint, func_input, func_output):
         return endpoint.build_response(func_input=func_input,
@@ -111,6 +366,95 @@ class Server(object):
 
 
 
+logger = logging.getLogger(__name__)
+
+#: Carries the client's remaining time budget in seconds
+DEADLINE_HEADER = "X-Request-Timeout"
+#: Carries the number of matching objects in count mode of get_list
+COUNT_HEADER = "X-Total-Count"
+#: Mimetype of streamed lists, see :class:`GetListEndpoint`
+NDJSON = "application/x-ndjson"
+
+
+class Admission(object):
+    """Lets at most *limit* requests in at a time. Waiting requests are
+    admitted by priority (lower values first), then in order of arrival.
+    Admitted and rejected requests are counted in :attr:`stats`.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.waiting = []
+        self.condition = threading.Condition()
+        self._counter = itertools.count()
+        self.stats = {"admitted": 0, "rejected": 0}
+
+    def acquire(self, priority=0, timeout=None):
+        """Waits up to *timeout* seconds for a slot. Returns True if one was
+        acquired, False otherwise.
+        """
+        with self.condition:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.stats["admitted"] += 1
+                return True
+            entry = (priority, next(self._counter))
+            heapq.heappush(self.waiting, entry)
+            deadline = None if timeout is None else monotonic() + timeout
+            while True:
+                if self.waiting[0] == entry and self.active < self.limit:
+                    heapq.heappop(self.waiting)
+                    self.active += 1
+                    self.stats["admitted"] += 1
+                    self.condition.notify_all()
+                    return True
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        self.waiting.remove(entry)
+                        heapq.heapify(self.waiting)
+                        self.stats["rejected"] += 1
+                        self.condition.notify_all()
+                        return False
+                self.condition.wait(remaining)
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify_all()
+
+
+class CacheHit(Exception):
+    """Raised by :meth:`Server.parse_request` to answer a request from the
+    response cache of an action, skipping the rest of the request.
+    """
+
+    def __init__(self, response):
+        self.response = response
+
+
+class Flight(object):
+    """A handler call in progress that other requests are waiting for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.exc_info = None
+
+
+def same_response_body(a, b):
+    if a.status_code != b.status_code:
+        return False
+    if a.get_data() == b.get_data():
+        return True
+    fmt = get_format(a.mimetype)
+    if fmt is None or a.mimetype != b.mimetype:
+        return False
+    return fmt.loads(a.get_data()) == fmt.loads(b.get_data())
+
+
 def error_response(message, code):
     body = json.dumps({"error": message})
     return Response(body, code, {"Content-Type": "application/json"})
@@ -120,19 +464,138 @@ def get_payload_from_http_message(req):
     bytes = req.data
     if not bytes:
         return None
-    if req.mimetype != "application/json":
-        raise SpecError('Content-Type must be "application/json" got "%s" instead' % req.mimetype)
-    charset = req.mimetype_params.get("charset", "utf-8")
-    if charset.lower() != "utf-8":
-        raise SpecError('Content-Type charset must be "utf-8" got %s instead' % charset)
+    fmt = get_format(req.mimetype)
+    if fmt is None:
+        raise SpecError('Content-Type must be %s got "%s" instead' % (
+            " or ".join('"%s"' % m for m in formats.keys()), req.mimetype))
+    charset = req.mimetype_params.get("charset")
+    return Box(fmt.loads(bytes, charset))
+
+
+class FileResponse(Response):
+    """A response whose body is read from a file-like object. The file is
+    handed to the WSGI server's ``wsgi.file_wrapper`` if it provides one, so
+    that the server may use ``sendfile`` or similar.
+    """
+
+    def __init__(self, file, *args, **kwargs):
+        kwargs['direct_passthrough'] = True
+        super(FileResponse, self).__init__(None, *args, **kwargs)
+        self.file = file
+
+    def get_app_iter(self, environ):
+        if environ["REQUEST_METHOD"] == "HEAD":
+            self.file.close()
+            return ()
+        return wrap_file(environ, self.file, STREAM_CHUNK_SIZE)
+
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class MappedFile(object):
+    """A read-only file-like object over a memory-mapped file. Slicing and
+    :func:`len` work as on the underlying :class:`mmap.mmap`, which is
+    available as :attr:`mmap`.
+    """
+
+    def __init__(self, mapped):
+        self.mmap = mapped
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.mmap) - self.mmap.tell()
+        return self.mmap.read(size)
+
+    def seek(self, offset, whence=0):
+        self.mmap.seek(offset, whence)
+
+    def tell(self):
+        return self.mmap.tell()
+
+    def close(self):
+        self.mmap.close()
+
+    def __len__(self):
+        return len(self.mmap)
+
+    def __getitem__(self, key):
+        return self.mmap[key]
+
+
+def spool_stream(stream):
+    """Copies a stream into a temporary file in constant memory and returns
+    a tuple of a :class:`MappedFile` over the file and its size.
+    """
+    with tempfile.TemporaryFile() as f:
+        while True:
+            chunk = stream.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                break
+            f.write(chunk)
+        f.flush()
+        size = f.tell()
+        if size == 0:
+            return io.BytesIO(b""), 0
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return MappedFile(mapped), size
+
+
+def stream_size(f):
+    if isinstance(f, (mmap.mmap, MappedFile)):
+        return len(f) - f.tell()
     try:
-        data = bytes.decode('utf-8')
-    except UnicodeDecodeError:
-        raise SpecError("Unicode Decode Error")
+        return os.fstat(f.fileno()).st_size - f.tell()
+    except (AttributeError, IOError, OSError, io.UnsupportedOperation):
+        pass
     try:
-        return Box(json.loads(data))
-    except ValueError:
-        raise SpecError("Invalid JSON")
+        pos = f.tell()
+        f.seek(0, 2)
+        end = f.tell()
+        f.seek(pos)
+        return end - pos
+    except (AttributeError, IOError, OSError, io.UnsupportedOperation):
+        return None
+
+
+def iter_memoryview(view):
+    for i in range(0, len(view), STREAM_CHUNK_SIZE):
+        yield view[i:i + STREAM_CHUNK_SIZE].tobytes()
+
+
+def raw_response(data):
+    headers = {"Content-Type": "application/octet-stream"}
+    if hasattr(data, 'read'):
+        size = stream_size(data)
+        if size is not None:
+            headers["Content-Length"] = str(size)
+        return FileResponse(data, 200, headers)
+    if isinstance(data, bytes):
+        return Response(data, 200, headers)
+    if isinstance(data, memoryview):
+        headers["Content-Length"] = str(len(data))
+        data = iter_memoryview(data)
+    return Response(data, 200, headers, direct_passthrough=True)
+
+
+def prefers_minimal(request):
+    """Whether the request carries a ``Prefer: return=minimal`` header, as
+    defined by RFC 7240.
+    """
+    for value in request.headers.getlist('Prefer'):
+        for preference in value.split(','):
+            token = preference.split(';')[0].replace(' ', '').lower()
+            if token == 'return=minimal':
+                return True
+    return False
+
+
+#: Sent with responses that leave out the representation
+MINIMAL_HEADERS = {"Preference-Applied": "return=minimal"}
+
+
+def get_mimetype(headers):
+    return headers.get("Content-Type", "").split(";")[0].strip().lower()
 
 
 def reverse_werkzeug_url(url, values):
@@ -155,6 +618,55 @@ class Endpoint(object):
 
     acceptable_exceptions = []
 
+    trusted_output = False
+
+    raw_request = False
+    raw_response = False
+    stream_request = False
+    stream_response = False
+
+    request_format = json_format
+    response_format = json_format
+
+    response_cache = None
+    cache_key = None
+
+    #: Admission priority when the server is at capacity, lower values are
+    #: admitted first. Cheap reads default to 0, writes and actions to 1 and
+    #: lists to 2.
+    priority = 1
+
+    def negotiate(self, request):
+        """Picks the :class:`~cosmic.formats.Format` of the request body
+        according to its Content-Type and that of the response according to
+        the Accept header. JSON is used unless the client asks otherwise.
+        """
+        fmt = get_format(request.mimetype)
+        if fmt is not None:
+            self.request_format = fmt
+        best = request.accept_mimetypes.best_match(formats.keys())
+        if best is not None:
+            self.response_format = formats[best]
+
+    def payload_response(self, datum, code=200, headers=None):
+        fmt = self.response_format
+        h = {"Content-Type": fmt.mimetype}
+        if headers:
+            h.update(headers)
+        return Response(fmt.dumps(datum), code, h)
+
+    def coalesce_key(self, request):
+        """Returns a key under which concurrent identical requests to this
+        endpoint share one handler call (see
+        :data:`~cosmic.http.Server.coalesce`), or None if they must not.
+        """
+        return None
+
+    def serialize_output(self, schema, datum):
+        if self.trusted_output:
+            return trusted_serializer(schema)(datum)
+        return schema.to_json(datum)
+
     def handler(self, *args, **kwargs):
         if not self.acceptable_exceptions:
             return self.func(*args, **kwargs)
@@ -169,12 +681,20 @@ class Endpoint(object):
             'url_args': url_args,
             'headers': request.headers
         }
-        try:
-            req['json'] = get_payload_from_http_message(request)
-        except SpecError as e:
-            raise HTTPError(code=400, message=e.args[0])
-
-        is_empty = request.data == ""
+        if self.raw_request and request.mimetype == "application/octet-stream":
+            req['json'] = None
+            if self.stream_request:
+                req['data'], size = spool_stream(request.stream)
+                is_empty = size == 0
+            else:
+                req['data'] = request.get_data()
+                is_empty = req['data'] == ""
+        else:
+            try:
+                req['json'] = get_payload_from_http_message(request)
+            except SpecError as e:
+                raise HTTPError(code=400, message=e.args[0])
+            is_empty = request.data == ""
 
         if ((self.request_must_be_empty == True and not is_empty) or
                 (is_empty and self.request_can_be_empty == False)):
@@ -188,7 +708,14 @@ class Endpoint(object):
     def build_response(self, func_input, func_output):
         raise NotImplementedError()
 
-    def build_request(self, data=None, url_args=None, headers=None, query=None):
+    def materialize(self, func_output):
+        """Returns *func_output* with any iterators in it read into lists,
+        so that it can be serialized more than once.
+        """
+        return func_output
+
+    def build_request(self, data=None, url_args=None, headers=None, query=None,
+                      raw=None):
 
         if url_args is None:
             url_args = {}
@@ -197,12 +724,22 @@ class Endpoint(object):
         if query is None:
             query = {}
 
-        if data is not None:
-            headers["Content-Type"] = "application/json"
-            string_data = json.dumps(data.datum)
+        if raw is not None:
+            headers["Content-Type"] = "application/octet-stream"
+            string_data = raw
+        elif data is not None:
+            headers["Content-Type"] = self.request_format.mimetype
+            string_data = self.request_format.dumps(data.datum)
         else:
             string_data = ""
 
+        if self.raw_response:
+            headers["Accept"] = "application/octet-stream, %s;q=0.5" % \
+                self.response_format.mimetype
+        elif self.response_format is not json_format:
+            headers["Accept"] = "%s, application/json;q=0.5" % \
+                self.response_format.mimetype
+
         url = reverse_werkzeug_url(self.url, url_args)
 
         if self.query_schema is not None and query:
@@ -218,7 +755,11 @@ class Endpoint(object):
 
     def parse_response(self, res):
 
-        is_empty = res.text == ""
+        if self.stream_response:
+            # Reading the content would defeat streaming
+            is_empty = res.headers.get("Content-Length") == "0"
+        else:
+            is_empty = res.content == ""
         if ((self.response_must_be_empty == True and not is_empty) or
                 (is_empty and self.response_can_be_empty == False)):
             raise SpecError("Invalid response")
@@ -228,10 +769,25 @@ class Endpoint(object):
             'headers': res.headers
         }
 
-        try:
-            r['json'] = string_to_json(res.text)
-        except ValueError:
-            raise SpecError("Unparseable response")
+        mimetype = get_mimetype(res.headers)
+        fmt = get_format(mimetype)
+        if mimetype == "application/octet-stream":
+            r['json'] = None
+            if self.stream_response and res.raw is not None:
+                res.raw.decode_content = True
+                r['data'] = res.raw
+            else:
+                r['data'] = res.content
+        elif fmt is not None:
+            try:
+                r['json'] = Box(fmt.loads(res.content)) if not is_empty else None
+            except SpecError:
+                raise SpecError("Unparseable response")
+        else:
+            try:
+                r['json'] = string_to_json(res.text)
+            except ValueError:
+                raise SpecError("Unparseable response")
 
         if r['code'] not in self.acceptable_response_codes:
             message = None
@@ -257,10 +813,12 @@ class SpecEndpoint(Endpoint):
     """
     method = "GET"
     acceptable_response_codes = [200]
+    priority = 0
 
-    def __init__(self, api_spec=None):
+    def __init__(self, api_spec=None, spec_json=None):
         self.url = '/spec.json'
         self.api_spec = api_spec
+        self.spec_json = spec_json
 
     def parse_request(self, req, **url_args):
         return {}
@@ -276,8 +834,9 @@ class SpecEndpoint(Endpoint):
         return APISpec.from_json(res['json'].datum)
 
     def build_response(self, func_input, func_output):
-        body = json.dumps(APISpec.to_json(func_output))
-        return Response(body, 200, {"Content-Type": "application/json"})
+        if self.spec_json is not None:
+            return self.payload_response(self.spec_json)
+        return self.payload_response(APISpec.to_json(func_output))
 
 
 class ActionEndpoint(Endpoint):
@@ -294,58 +853,346 @@ class ActionEndpoint(Endpoint):
             has no return value.
         :ContentType: ``application/json`` if body is not empty.
 
+    If the action accepts :data:`~cosmic.types.Binary` or
+    :class:`~cosmic.types.Stream`, the request body may also be the raw
+    bytes, sent as ``application/octet-stream``. If the action returns one of
+    these types and the client prefers ``application/octet-stream`` in its
+    *Accept* header, the raw bytes are returned instead of a JSON string.
+
+    If the action accepts an :data:`~cosmic.types.Array`, a JSON body is
+    read and validated one item at a time (see
+    :func:`~cosmic.formats.iter_json_array`), and the request fails with
+    ``400`` at the first invalid item without reading the rest of it.
+
     """
 
     method = "POST"
     acceptable_response_codes = [200, 204]
 
-    def __init__(self, api_spec, action_name, func=None):
-        self.func = func
+    def __init__(self, api_spec, action_name, func=None, plan=None):
+        if plan is None:
+            action_spec = api_spec['actions'][action_name]
+            plan = ActionPlan(func, action_spec.get('accepts', None),
+                              action_spec.get('returns', None))
+        self.plan = plan
+        self.func = plan.func
         self.action_name = action_name
-        self.action_spec = api_spec['actions'][action_name]
-        self.accepts = self.action_spec.get('accepts', None)
-        self.returns = self.action_spec.get('returns', None)
+        self.accepts = plan.accepts
+        self.returns = plan.returns
         self.url = "/actions/%s" % action_name
+        self.raw_request = plan.raw_request
+        self.raw_response = plan.raw_response
+        self.stream_request = plan.stream_request
+        self.stream_response = plan.stream_response
+        self.send_raw = False
+        self.pure = False
+        self.stream_items = False
+        self.item_error = None
+        self.payload = None
 
     def build_request(self, *args, **kwargs):
         packed = args_to_datum(*args, **kwargs)
+        if self.raw_request and packed is not None:
+            return super(ActionEndpoint, self).build_request(raw=packed)
         data = serialize_json(self.accepts, packed)
         return super(ActionEndpoint, self).build_request(data=data)
 
+    def negotiate(self, request):
+        super(ActionEndpoint, self).negotiate(request)
+        if self.raw_response:
+            self.send_raw = request.accept_mimetypes.best_match(
+                formats.keys() + ["application/octet-stream"]
+            ) == "application/octet-stream"
+
+    def coalesce_key(self, request):
+        if not self.pure or self.stream_request:
+            return None
+        return (request.path, request.mimetype, request.get_data(),
+                self.send_raw)
+
+    def reads_items(self, request):
+        return (isinstance(self.accepts, Array) and
+                bool(request.content_length) and
+                request.mimetype == json_format.mimetype and
+                request.mimetype_params.get("charset", "utf-8").lower() ==
+                "utf-8")
+
+    def iter_items(self, request):
+        if self.pure:
+            # The body is needed again to key the response
+            stream = io.BytesIO(request.get_data())
+        else:
+            stream = request.stream
+        try:
+            items = iter_json_array(stream, STREAM_CHUNK_SIZE)
+            for i, item in enumerate(items):
+                try:
+                    yield self.accepts.param.from_json(item)
+                except ValidationError as e:
+                    e.stack.append(i)
+                    self.item_error = e
+                    raise
+        except SpecError as e:
+            raise HTTPError(code=400, message=e.args[0])
+
     def parse_request(self, req, **url_args):
-        req = super(ActionEndpoint, self).parse_request(req, **url_args)
-        data = deserialize_json(self.accepts, req['json'])
-        kwargs = {}
-        if data is not None:
-            required_args, optional_args = get_args(self.func)
-            # If only one argument, take the whole object
-            if len(required_args + optional_args) == 1:
-                kwargs = {required_args[0]: data}
+        if self.reads_items(req):
+            data = self.iter_items(req)
+            if self.stream_items and self.response_cache is not None:
+                # All items are needed to key the response
+                self.payload = list(data)
+                data = iter(self.payload)
+            elif not self.stream_items:
+                data = list(data)
+        else:
+            req = super(ActionEndpoint, self).parse_request(req, **url_args)
+            if 'data' in req:
+                data = req['data']
             else:
-                kwargs = data
-        return kwargs
+                data = self.plan.deserialize(req['json'])
+        if self.payload is None:
+            self.payload = data
+        return self.plan.bind(data)
+
+    def canonical_payload(self):
+        """Returns the validated request payload as JSON with sorted keys,
+        which is the same for all requests with equal payloads.
+        """
+        if self.payload is None:
+            return None
+        with native_binary(False):
+            datum = self.accepts.to_json(self.payload)
+        return json.dumps(datum, sort_keys=True, separators=(',', ':'))
+
+    def handler(self, *args, **kwargs):
+        try:
+            return super(ActionEndpoint, self).handler(*args, **kwargs)
+        except ValidationError as e:
+            # An invalid item of a streamed request is the client's fault
+            if e is not self.item_error:
+                raise
+            raise HTTPError(code=400, message=str(e))
 
     def parse_response(self, res):
         res = super(ActionEndpoint, self).parse_response(res)
+        if self.returns and 'data' in res:
+            if self.returns is Stream and not hasattr(res['data'], 'read'):
+                return io.BytesIO(res['data'])
+            return res['data']
         if self.returns and res['json']:
             return self.returns.from_json(res['json'].datum)
         else:
             return None
 
     def build_response(self, func_input, func_output):
-        data = serialize_json(self.returns, func_output)
+        if self.send_raw and func_output is not None:
+            return raw_response(func_output)
+        data = self.plan.serialize(func_output, trusted=self.trusted_output)
         if data is None:
             return Response("", 204, {})
         else:
-            body = json.dumps(data.datum)
-            return Response(body, 200, {"Content-Type": "application/json"})
+            return self.payload_response(data.datum)
+
+
+def encode_names(**params):
+    """Returns a query string with each list of names in *params* joined by
+    commas, skipping None values.
+    """
+    return url_encode(dict((key, ",".join(names))
+                           for key, names in params.items()
+                           if names is not None), sort=True)
+
+
+def decode_names(args, key):
+    """Returns a sorted tuple of the comma-separated names in the *key*
+    parameters of *args*, or None if there are none.
+    """
+    values = args.getlist(key)
+    if not values:
+        return None
+    return tuple(sorted(set(name for value in values
+                            for name in value.split(',') if name)))
+
 
+def response_query(res):
+    # Query parameters of the request that *res* answers
+    request = getattr(res, 'request', None)
+    if request is None:
+        return MultiDict()
+    return url_decode(url_parse(request.url).query)
 
-class GetByIdEndpoint(Endpoint):
+
+class ProjectionMixin(object):
+    """Lets clients ask for some of the properties and links of a model
+    with a ``fields`` query parameter holding comma-separated names, e.g.
+    ``?fields=name,country``. The response only includes those fields and
+    the ``self`` link. Models that set
+    :data:`~cosmic.models.BaseModel.accepts_fields` also get them as a
+    *fields* keyword argument, so that storage can skip the others.
+    """
+    #: Sorted tuple of the requested field names, or None for all fields
+    fields = None
+    #: Whether the handler takes a *fields* argument
+    accepts_fields = False
+
+    def parse_fields(self, args):
+        fields = decode_names(args, 'fields')
+        if fields is None:
+            return None
+        for name in fields:
+            if name not in self.model_spec['properties'] and \
+                    name not in self.model_spec['links']:
+                raise HTTPError(code=400, message="Unknown field: %s" % name)
+        # Links to embed are returned along with the requested fields
+        embed = decode_names(args, 'embed')
+        if embed is not None:
+            fields = tuple(sorted(set(fields + embed)))
+        return fields
+
+    def representation(self, fields=None):
+        schema = Representation(Model(self.full_model_name))
+        if fields is not None:
+            schema = schema.project(fields)
+        return schema
+
+    def parse_projected(self, rep_schema, datum):
+        """Parses a representation with :meth:`parse_embedded`. Servers that
+        predate field projection ignore ``fields`` and send every field, so
+        a representation with fields beyond *rep_schema* is parsed with the
+        full schema and then projected.
+        """
+        fields = rep_schema.fields
+        if fields is not None and isinstance(datum, dict):
+            names = set(datum) | set(datum.get("_links") or {})
+            if names - set(fields) - set(["_links", "_embedded", "self"]):
+                id, rep = self.parse_embedded(self.representation(), datum)
+                return id, dict((name, value) for name, value in rep.items()
+                                if name in fields)
+        return self.parse_embedded(rep_schema, datum)
+
+
+class EmbedMixin(object):
+    """Lets clients ask for the objects behind some links of a model with an
+    ``embed`` query parameter holding comma-separated link names, e.g.
+    ``?embed=country``. Following HAL, the linked representations are
+    returned in the ``_embedded`` object of each representation:
+
+    .. code::
+
+        {
+            "_links": {
+                "self": {"href": "/City/0"},
+                "country": {"href": "/Country/3"}
+            },
+            "_embedded": {
+                "country": {
+                    "_links": {"self": {"href": "/Country/3"}},
+                    "name": "Canada"
+                }
+            },
+            "name": "Toronto"
+        }
+
+    Once the handler returns, the linked objects are fetched with one
+    :meth:`~cosmic.models.BaseModel.get_by_ids` call per linked model, for
+    all the distinct ids at once. Only links to models of the same API that
+    support ``get_by_id`` can be embedded. Embedded links are returned even
+    if *fields* leaves them out.
+
+    On the client, the ids of embedded links are :class:`EmbeddedLink`
+    strings that carry the linked representation.
+    """
+    #: Sorted tuple of the link names to embed, or None
+    embed = None
+    #: The API's :data:`~cosmic.api.BaseAPI.models`, set by the server
+    models = None
+
+    def parse_embed(self, args):
+        embed = decode_names(args, 'embed')
+        for name in embed or ():
+            link = self.model_spec['links'].get(name)
+            if link is None:
+                raise HTTPError(code=400, message="Unknown link: %s" % name)
+            model = link['model']
+            if model.api_name != self.api_spec['name'] or \
+                    not self.api_spec['models'][model.model_name]['methods']['get_by_id']:
+                raise HTTPError(code=400, message="Cannot embed %s" % name)
+        return embed
+
+    def fetch_embedded(self, reps):
+        """Returns a dict mapping the names of the linked models to dicts of
+        the linked representations by id.
+        """
+        ids = {}
+        for name in self.embed:
+            model = self.model_spec['links'][name]['model']
+            wanted = ids.setdefault(model.model_name, set())
+            for rep in reps:
+                if rep.get(name) is not None:
+                    wanted.add(rep[name])
+        embedded = {}
+        for model_name, wanted in ids.items():
+            embedded[model_name] = {}
+            if wanted:
+                model_obj = getattr(self.models, model_name)
+                embedded[model_name] = dict(model_obj.get_by_ids(sorted(wanted)))
+        return embedded
+
+    def embed_output(self, d, rep, embedded, serialized):
+        """Adds the linked representations of *rep* to its serialized form
+        *d*. Each linked object is serialized once and kept in *serialized*.
+        """
+        links = {}
+        for name in self.embed:
+            model = self.model_spec['links'][name]['model']
+            id = rep.get(name)
+            if id is None or id not in embedded[model.model_name]:
+                continue
+            key = (model.model_name, id)
+            if key not in serialized:
+                serialized[key] = self.serialize_output(
+                    Representation(model),
+                    (id, embedded[model.model_name][id]))
+            links[name] = serialized[key]
+        if links:
+            d["_embedded"] = links
+        return d
+
+    def parse_embedded(self, rep_schema, datum):
+        """Parses a representation that may have an ``_embedded`` object,
+        returning embedded link ids as :class:`EmbeddedLink` strings.
+        """
+        datum = dict(datum)
+        embedded = datum.pop("_embedded", None)
+        id, rep = rep_schema.from_json(datum)
+        for name, linked in (embedded or {}).items():
+            link = self.model_spec['links'].get(name)
+            if link is None or rep.get(name) is None:
+                continue
+            _, linked_rep = Representation(link['model']).from_json(linked)
+            rep[name] = EmbeddedLink(rep[name], linked_rep)
+        return id, rep
+
+
+class EmbeddedLink(unicode):
+    """The id of an embedded link, as returned by clients (see
+    :class:`EmbedMixin`). It is equal to the plain id and holds the
+    representation of the linked object in :attr:`rep`.
+    """
+
+    def __new__(cls, id, rep=None):
+        self = unicode.__new__(cls, id)
+        self.rep = rep
+        return self
+
+
+class GetByIdEndpoint(ProjectionMixin, EmbedMixin, Endpoint):
     """
     :Request:
         :Method: ``GET``
         :URL: ``/<model>/<id>`` where *model* is the model name.
+        :Query: Optional *fields* and *embed*, see :class:`ProjectionMixin`
+            and :class:`EmbedMixin`.
     :Response:
         :Code: ``200`` or ``404`` if object is not found.
         :Body: The object representation as a JSON-encoded string.
@@ -354,23 +1201,44 @@ class GetByIdEndpoint(Endpoint):
     """
     method = "GET"
     acceptable_response_codes = [404, 200]
+    priority = 0
     response_can_be_empty = True
     request_must_be_empty = True
     acceptable_exceptions = [NotFound]
 
     def __init__(self, api_spec, model_name, func=None):
+        self.api_spec = api_spec
         self.model_name = model_name
         self.full_model_name = "{}.{}".format(api_spec['name'], model_name)
+        self.model_spec = api_spec['models'][model_name]
         self.func = func
         self.url = "/%s/<id>" % model_name
 
-    def build_request(self, id):
-        return super(GetByIdEndpoint, self).build_request(
+    def build_request(self, id, fields=None, embed=None):
+        req = super(GetByIdEndpoint, self).build_request(
             url_args={'id': id})
+        query = encode_names(fields=fields, embed=embed)
+        if query:
+            req.url += "?" + query
+        return req
+
+    def coalesce_key(self, request):
+        return (self.method, request.path, request.query_string)
 
     def parse_request(self, req, **url_args):
+        self.fields = self.parse_fields(req.args)
+        self.embed = self.parse_embed(req.args)
         req = super(GetByIdEndpoint, self).parse_request(req, **url_args)
-        return {'id': req['url_args']['id']}
+        func_input = {'id': req['url_args']['id']}
+        if self.fields is not None and self.accepts_fields:
+            func_input['fields'] = self.fields
+        return func_input
+
+    def handler(self, **func_input):
+        func_output = super(GetByIdEndpoint, self).handler(**func_input)
+        if self.embed and func_output.exception is None:
+            self.embedded = self.fetch_embedded([func_output.value])
+        return func_output
 
     def build_response(self, func_input, func_output):
         if func_output.exception is not None:
@@ -378,18 +1246,112 @@ class GetByIdEndpoint(Endpoint):
         else:
             id = func_input['id']
             rep = func_output.value
-            body = json.dumps(Representation(Model(self.full_model_name)).to_json((id, rep)))
-            return Response(body, 200, {"Content-Type": "application/json"})
+            d = self.serialize_output(self.representation(self.fields),
+                                      (id, rep))
+            if self.embed:
+                d = self.embed_output(d, rep, self.embedded, {})
+            return self.payload_response(d)
 
     def parse_response(self, res):
+        fields = self.parse_fields(response_query(res))
         res = super(GetByIdEndpoint, self).parse_response(res)
         if res['code'] == 404:
             raise NotFound
         if res['code'] == 200:
-            (id, rep) = Representation(Model(self.full_model_name)).from_json(res['json'].datum)
+            (id, rep) = self.parse_projected(self.representation(fields),
+                                             res['json'].datum)
             return rep
 
 
+class GetByIdsEndpoint(Endpoint):
+    """
+    :Request:
+        :Method: ``GET``
+        :URL: ``/<model>/_bulk?id=<id>&id=<id>...`` where *model* is the
+            model name.
+    :Response:
+        :Code: ``200``
+        :ContentType: ``application/json``
+        :Body:
+
+            The representations of the objects that exist, in the same
+            form as the body of :class:`GetListEndpoint`:
+
+            .. code::
+
+                {
+                    "_links": {
+                        "self": {"href": <self>}
+                    },
+                    "_embedded": {
+                        <model>: [<repr>*]
+                    }
+                }
+
+    Served with :meth:`~cosmic.models.BaseModel.get_by_ids` for models that
+    support ``get_by_id``. Used by :meth:`~cosmic.client.BaseAPIClient.loader`
+    to fetch many objects in one request.
+    """
+    method = "GET"
+    acceptable_response_codes = [200]
+    # Older servers answer with an empty 404, which should surface as a
+    # RemoteHTTPError
+    response_can_be_empty = True
+    request_must_be_empty = True
+    priority = 2
+
+    def __init__(self, api_spec, model_name, func=None):
+        self.model_name = model_name
+        self.full_model_name = "{}.{}".format(api_spec['name'], model_name)
+        self.func = func
+        self.url = "/%s/_bulk" % model_name
+
+    def build_request(self, ids):
+        req = super(GetByIdsEndpoint, self).build_request()
+        req.url += "?" + url_encode([('id', id) for id in ids])
+        return req
+
+    def coalesce_key(self, request):
+        return (self.method, request.path, request.query_string)
+
+    def parse_request(self, req, **url_args):
+        super(GetByIdsEndpoint, self).parse_request(req, **url_args)
+        ids = []
+        seen = set()
+        for id in req.args.getlist('id'):
+            if id not in seen:
+                seen.add(id)
+                ids.append(id)
+        return {'ids': ids}
+
+    def build_response(self, func_input, func_output):
+        rep_schema = Representation(Model(self.full_model_name))
+        if self.trusted_output:
+            serialize = trusted_serializer(rep_schema)
+        else:
+            serialize = rep_schema.to_json
+        self_link = "/%s/_bulk" % self.model_name
+        if func_input['ids']:
+            self_link += "?" + url_encode([('id', id)
+                                           for id in func_input['ids']])
+        return self.payload_response({
+            "_links": {
+                "self": {"href": self_link}
+            },
+            "_embedded": {
+                self.model_name: [serialize(inst) for inst in func_output]
+            }
+        })
+
+    def parse_response(self, res):
+        res = super(GetByIdsEndpoint, self).parse_response(res)
+        if res['json'] is None:
+            raise SpecError("Invalid response")
+        rep_schema = Representation(Model(self.full_model_name))
+        return [rep_schema.from_json(jrep)
+                for jrep in res['json'].datum["_embedded"][self.model_name]]
+
+
 class UpdateEndpoint(Endpoint):
     """
     :Request:
@@ -397,17 +1359,24 @@ class UpdateEndpoint(Endpoint):
         :URL: ``/<model>/<id>`` where *model* is the model name.
         :Body: A corresponding model patch as a JSON-encoded string.
         :ContentType: ``application/json``
+        :Headers: ``Prefer: return=minimal`` to skip the response body.
     :Response:
-        :Code: ``200`` or ``404`` if object is not found.
-        :Body: New model representation as a JSON-encoded string.
+        :Code: ``200``, ``204`` if the client prefers a minimal response or
+            ``404`` if object is not found.
+        :Body: New model representation as a JSON-encoded string, empty for
+            ``204``.
         :ContentType: ``application/json``
 
+    On the client, ``update(id, return_representation=False, **patch)`` asks
+    for a minimal response and returns None if the server honors it.
     """
     method = "PUT"
-    acceptable_response_codes = [200, 404]
-    response_can_be_empty = False
+    acceptable_response_codes = [200, 204, 404]
+    response_can_be_empty = True
     request_can_be_empty = False
     acceptable_exceptions = [NotFound]
+    #: Whether the client sent ``Prefer: return=minimal``
+    minimal = False
 
     def __init__(self, api_spec, model_name, func=None):
         self.model_name = model_name
@@ -415,12 +1384,16 @@ class UpdateEndpoint(Endpoint):
         self.func = func
         self.url = "/%s/<id>" % model_name
 
-    def build_request(self, id, **patch):
+    def build_request(self, id, return_representation=True, **patch):
+        headers = {}
+        if not return_representation:
+            headers["Prefer"] = "return=minimal"
         return super(UpdateEndpoint, self).build_request(
             data=Box(Patch(Model(self.full_model_name)).to_json((id, patch))),
-            url_args={'id': id})
+            url_args={'id': id}, headers=headers)
 
     def parse_request(self, req, **url_args):
+        self.minimal = prefers_minimal(req)
         req = super(UpdateEndpoint, self).parse_request(req, **url_args)
         id, rep = Patch(Model(self.full_model_name)).from_json(req['json'].datum)
         rep['id'] = req['url_args']['id']
@@ -429,16 +1402,22 @@ class UpdateEndpoint(Endpoint):
     def build_response(self, func_input, func_output):
         if func_output.exception is not None:
             return Response("", 404, {})
+        elif self.minimal:
+            return Response("", 204, MINIMAL_HEADERS)
         else:
             id = func_input['id']
             rep = func_output.value
-            body = json.dumps(Representation(Model(self.full_model_name)).to_json((id, rep)))
-            return Response(body, 200, {"Content-Type": "application/json"})
+            return self.payload_response(self.serialize_output(
+                Representation(Model(self.full_model_name)), (id, rep)))
 
     def parse_response(self, res):
         res = super(UpdateEndpoint, self).parse_response(res)
         if res['code'] == 200:
+            if res['json'] is None:
+                raise SpecError("Invalid response")
             return Representation(Model(self.full_model_name)).from_json(res['json'].datum)[1]
+        if res['code'] == 204:
+            return None
         if res['code'] == 404:
             raise NotFound
 
@@ -450,16 +1429,24 @@ class CreateEndpoint(Endpoint):
         :URL: ``/<model>`` where *model* is the model name.
         :Body: Corresponding model patch as a JSON-encoded string.
         :ContentType: ``application/json``
+        :Headers: ``Prefer: return=minimal`` to skip the response body.
     :Response:
         :Code: ``201``
-        :Body: New model representation as a JSON-encoded string.
+        :Body: New model representation as a JSON-encoded string, empty if
+            the client prefers a minimal response.
         :ContentType: ``application/json``
+        :Headers: ``Location`` of the new object.
 
+    On the client, ``create(return_representation=False, **patch)`` asks for
+    a minimal response and returns the new id along with None in place of
+    the representation if the server honors it.
     """
     method = "POST"
     acceptable_response_codes = [201]
-    response_can_be_empty = False
+    response_can_be_empty = True
     request_can_be_empty = False
+    #: Whether the client sent ``Prefer: return=minimal``
+    minimal = False
 
     def __init__(self, api_spec, model_name, func=None):
         self.model_name = model_name
@@ -467,26 +1454,38 @@ class CreateEndpoint(Endpoint):
         self.func = func
         self.url = "/%s" % model_name
 
-    def build_request(self, **patch):
+    def build_request(self, return_representation=True, **patch):
+        headers = {}
+        if not return_representation:
+            headers["Prefer"] = "return=minimal"
         return super(CreateEndpoint, self).build_request(
-            data=Box(Patch(Model(self.full_model_name)).to_json((None, patch))))
+            data=Box(Patch(Model(self.full_model_name)).to_json((None, patch))),
+            headers=headers)
 
     def parse_request(self, req, **url_args):
+        self.minimal = prefers_minimal(req)
         req = super(CreateEndpoint, self).parse_request(req, **url_args)
         id, rep = Patch(Model(self.full_model_name)).from_json(req['json'].datum)
         return rep
 
     def parse_response(self, res):
+        location = res.headers.get("Location")
         res = super(CreateEndpoint, self).parse_response(res)
+        if res['json'] is None:
+            if location is None:
+                raise SpecError("Invalid response")
+            return Link(Model(self.full_model_name)).from_json(location), None
         return Representation(Model(self.full_model_name)).from_json(res['json'].datum)
 
     def build_response(self, func_input, func_output):
-        body = json.dumps(Representation(Model(self.full_model_name)).to_json(func_output))
         href = "/%s/%s" % (self.model_name, func_output[0])
-        return Response(body, 201, {
-            "Location": href,
-            "Content-Type": "application/json"
-        })
+        if self.minimal:
+            headers = {"Location": href}
+            headers.update(MINIMAL_HEADERS)
+            return Response("", 201, headers)
+        return self.payload_response(self.serialize_output(
+            Representation(Model(self.full_model_name)), func_output),
+            201, {"Location": href})
 
 
 class DeleteEndpoint(Endpoint):
@@ -533,12 +1532,33 @@ class DeleteEndpoint(Endpoint):
             return Response("", 204, {})
 
 
-class GetListEndpoint(Endpoint):
+_query_schemas = {}
+
+
+def query_schema(query_fields):
+    """Returns a :class:`~cosmic.types.URLParams` for the *query_fields* of
+    a model spec. It is made once per spec, so its compiled fields and cache
+    of parsed query strings are shared by all requests to the model.
+    """
+    try:
+        return _query_schemas[id(query_fields)][1]
+    except KeyError:
+        pass
+    schema = URLParams(query_fields)
+    _query_schemas[id(query_fields)] = (query_fields, schema)
+    return schema
+
+
+class GetListEndpoint(ProjectionMixin, EmbedMixin, Endpoint):
     """
     :Request:
         :Method: ``GET``
         :URL: ``/<model>`` where *model* is the model name.
         :Query: Query parameters serialized by the model's *query_schema*
+            and optional *fields* and *embed*, see :class:`ProjectionMixin`
+            and :class:`EmbedMixin`. With ``count_only=true``, or for
+            ``HEAD`` requests, only the number of matching objects is
+            returned, see :meth:`~cosmic.models.BaseModel.count`.
     :Response:
         :Code: ``200``
         :ContentType: ``application/json``
@@ -565,13 +1585,42 @@ class GetListEndpoint(Endpoint):
             defined according to
             :data:`~cosmic.models.BaseModel.list_metadata`.
 
+            In count mode, the body is ``{"count": <count>}``.
+
+            If the client accepts ``application/x-ndjson``, the response is
+            streamed with one *repr* per line, followed by a line with the
+            *self* link and *metadata*:
+
+            .. code::
+
+                <repr>
+                <repr>
+                {"_links": {"self": {"href": <self>}}, <metadata>*}
+
+            The final line is always sent, so its absence means that the
+            response was cut short.
+        :Headers: ``X-Total-Count`` in count mode.
+
     """
     method = "GET"
     acceptable_response_codes = [200]
     response_can_be_empty = False
     request_must_be_empty = True
+    priority = 2
+    #: Whether only the number of matching objects was asked for
+    count_only = False
+    #: The model's :meth:`~cosmic.models.BaseModel.count`, set by the server
+    count = None
+    #: Whether the response is streamed as NDJSON
+    ndjson = False
+
+    def negotiate(self, request):
+        super(GetListEndpoint, self).negotiate(request)
+        self.ndjson = request.accept_mimetypes.best_match(
+            formats.keys() + [NDJSON]) == NDJSON
 
     def __init__(self, api_spec, model_name, func=None):
+        self.api_spec = api_spec
         self.model_name = model_name
         self.full_model_name = "{}.{}".format(api_spec['name'], model_name)
         self.model_spec = api_spec['models'][model_name]
@@ -579,22 +1628,58 @@ class GetListEndpoint(Endpoint):
         self.func = func
         self.query_schema = None
         if self.model_spec['query_fields']:
-            self.query_schema = URLParams(self.model_spec['query_fields'])
+            self.query_schema = query_schema(self.model_spec['query_fields'])
         self.url = "/%s" % model_name
 
-    def build_request(self, **query):
-        return super(GetListEndpoint, self).build_request(query=query)
+    def build_request(self, fields=None, embed=None, **query):
+        req = super(GetListEndpoint, self).build_request(query=query)
+        names = encode_names(fields=fields, embed=embed)
+        if names:
+            req.url += ("&" if "?" in req.url else "?") + names
+        return req
+
+    def coalesce_key(self, request):
+        return (request.method, request.path, request.query_string,
+                self.ndjson)
 
     def parse_request(self, req, **url_args):
+        self.fields = self.parse_fields(req.args)
+        self.embed = self.parse_embed(req.args)
+        self.count_only = req.method == "HEAD" or \
+            req.args.get('count_only') == 'true'
         req = super(GetListEndpoint, self).parse_request(req, **url_args)
-        return req.get('query', {})
+        func_input = req.get('query', {})
+        if self.fields is not None and self.accepts_fields:
+            func_input['fields'] = self.fields
+        return func_input
+
+    def handler(self, **func_input):
+        if self.count_only:
+            func_input.pop('fields', None)
+            return self.count(**func_input)
+        func_output = super(GetListEndpoint, self).handler(**func_input)
+        if self.embed:
+            # The list is read twice, so generators can't be streamed
+            func_output = self.materialize(func_output)
+            l = func_output[0] if self.list_metadata else func_output
+            self.embedded = self.fetch_embedded([rep for id, rep in l])
+        return func_output
+
+    def materialize(self, func_output):
+        if self.count_only:
+            return func_output
+        if self.list_metadata:
+            return (list(func_output[0]), func_output[1])
+        return list(func_output)
 
     def parse_response(self, res):
+        rep_schema = self.representation(
+            self.parse_fields(response_query(res)))
         res = super(GetListEndpoint, self).parse_response(res)
         j = res['json'].datum
         l = []
         for jrep in j["_embedded"][self.model_name]:
-            l.append(Representation(Model(self.full_model_name)).from_json(jrep))
+            l.append(self.parse_projected(rep_schema, jrep))
 
         if self.list_metadata:
             meta = j.copy()
@@ -605,29 +1690,169 @@ class GetListEndpoint(Endpoint):
         return l
 
     def build_response(self, func_input, func_output):
+        if self.count_only:
+            return self.payload_response({"count": func_output}, 200, {
+                COUNT_HEADER: str(func_output)})
+        func_input = dict(func_input)
+        func_input.pop('fields', None)
         self_link = "/%s" % self.model_name
+        query = []
         if self.query_schema and func_input:
-            self_link += '?' + self.query_schema.to_json(func_input)
+            query.append(self.query_schema.to_json(func_input))
+        names = encode_names(fields=self.fields, embed=self.embed)
+        if names:
+            query.append(names)
+        if query:
+            self_link += '?' + '&'.join(query)
 
         body = {
             "_links": {
                 "self": {"href": self_link}
             },
-            "_embedded": {}
         }
 
         if self.list_metadata:
             l, meta = func_output
-            meta = Struct(self.list_metadata).to_json(meta)
+            meta = self.serialize_output(Struct(self.list_metadata), meta)
             body.update(meta)
         else:
             l = func_output
 
-        body["_embedded"][self.model_name] = []
-        for inst in l:
-            jrep = Representation(Model(self.full_model_name)).to_json(inst)
-            body["_embedded"][self.model_name].append(jrep)
+        rep_schema = self.representation(self.fields)
+        if self.trusted_output:
+            serialize = trusted_serializer(rep_schema)
+        else:
+            serialize = rep_schema.to_json
+        if self.embed:
+            serialize_rep = serialize
+            serialized = {}
+
+            def serialize(inst):
+                return self.embed_output(serialize_rep(inst), inst[1],
+                                         self.embedded, serialized)
+
+        if self.ndjson:
+            return self.ndjson_response(l, serialize, body)
+        body["_embedded"] = {
+            self.model_name: [serialize(inst) for inst in l]
+        }
+        return self.payload_response(body, 200)
+
+    def ndjson_response(self, l, serialize, final):
+        # Representations are serialized as the response is sent
+        def lines():
+            for inst in l:
+                yield json.dumps(serialize(inst)) + "\n"
+            yield json.dumps(final) + "\n"
+
+        return Response(iter_in_request_context(lines()), 200,
+                        {"Content-Type": NDJSON}, direct_passthrough=True)
+
+
+def iter_in_request_context(items, binary=False):
+    """Wraps the iterator of a streamed response body. The body is sent
+    after :meth:`Server.wsgi_app` has left the thread-local storage and
+    deadline of the request, so each item is produced after entering them
+    again, along with :func:`~cosmic.types.native_binary` set to *binary*.
+    """
+    local = current_thread_local()
+    remaining = time_remaining()
+    expires = None if remaining is None else monotonic() + remaining
+
+    def wrapped(items):
+        left = None
+        while True:
+            if expires is not None:
+                left = expires - monotonic()
+            with thread_local(local), deadline(left), \
+                    native_binary(binary):
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+            yield item
+
+    return wrapped(iter(items))
+
+
+class CountEndpoint(GetListEndpoint):
+    """The client side of the count mode of :class:`GetListEndpoint`, which
+    sends a ``HEAD`` request and returns the ``X-Total-Count`` header.
+    """
+    method = "HEAD"
+    response_can_be_empty = True
+
+    def build_request(self, **query):
+        return super(GetListEndpoint, self).build_request(query=query)
+
+    def parse_response(self, res):
+        res = super(GetListEndpoint, self).parse_response(res)
+        try:
+            return int(res['headers'][COUNT_HEADER])
+        except (KeyError, ValueError):
+            raise SpecError("Invalid response")
+
+
+class StreamListEndpoint(GetListEndpoint):
+    """The client side of the NDJSON form of :class:`GetListEndpoint`.
+    Returns a :class:`ListStream` that parses representations as they are
+    read from the response.
+    """
+    stream_response = True
+
+    def build_request(self, **query):
+        req = super(StreamListEndpoint, self).build_request(**query)
+        req.headers["Accept"] = "%s, application/json;q=0.5" % NDJSON
+        return req
+
+    def parse_response(self, res):
+        if get_mimetype(res.headers) != NDJSON or res.status_code != 200:
+            # Errors, and servers without NDJSON support, send a whole body
+            ret = super(StreamListEndpoint, self).parse_response(res)
+            if self.list_metadata:
+                return ListStream(iter(ret[0]), ret[1])
+            return ListStream(iter(ret))
+        stream = ListStream(None)
+        stream.items = self.iter_lines(res, stream)
+        return stream
+
+    def iter_lines(self, res, stream):
+        rep_schema = self.representation(
+            self.parse_fields(response_query(res)))
+        if res.raw is not None:
+            lines = res.iter_lines()
+        else:
+            lines = res.content.splitlines()
+        for line in lines:
+            if not line:
+                continue
+            try:
+                datum = json.loads(line)
+                href = datum["_links"]["self"]["href"]
+            except (ValueError, TypeError, KeyError):
+                raise SpecError("Unparseable response")
+            if href.split("?")[0] == self.url:
+                # The final line holds the metadata
+                if self.list_metadata:
+                    del datum["_links"]
+                    stream.meta = Struct(self.list_metadata).from_json(datum)
+                return
+            yield self.parse_projected(rep_schema, datum)
+        raise SpecError("Incomplete response")
+
+
+class ListStream(object):
+    """An iterator over the ``(id, rep)`` tuples of a list streamed by
+    :class:`StreamListEndpoint`. The list metadata is available in
+    :attr:`meta` once all items have been read.
+    """
 
-        return Response(json.dumps(body), 200, {"Content-Type": "application/json"})
+    def __init__(self, items, meta=None):
+        self.items = items
+        self.meta = meta
 
+    def __iter__(self):
+        return self
 
+    def next(self):
+        return next(self.items)
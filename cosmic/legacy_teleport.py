@@ -1,6 +1,10 @@
+import re
 import json
 import base64
+import datetime
+import weakref
 import isodate
+from isodate.isotzinfo import build_tzinfo
 
 try:
     from collections import OrderedDict
@@ -56,6 +60,77 @@ class UnknownTypeValidationError(ValidationError):
 
 
 
+def freeze(param):
+    """Returns a hashable value that is equal for structurally equal schema
+    params. Dicts become tuples of items (sorted, unless ordered), lists become
+    tuples, schemas are left as they are since they hash by structure.
+    """
+    if isinstance(param, OrderedDict):
+        return tuple((k, freeze(v)) for k, v in param.items())
+    if isinstance(param, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in param.items()))
+    if isinstance(param, list):
+        return tuple(freeze(v) for v in param)
+    return param
+
+
+class StructuralSchema(object):
+    """Makes parametrized serializers compare and hash by type and param so
+    that they can be used as cache keys. The param must not be mutated once
+    the serializer has been hashed.
+    """
+    #: Whether equal instances may be shared by :func:`intern_schema`.
+    #: Serializers whose behavior depends on more than type and param,
+    #: e.g. on the current cosmos, set this to False.
+    internable = True
+
+    def schema_key(self):
+        return (type(self), freeze(self.param))
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return False
+        return self is other or self.schema_key() == other.schema_key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(self.schema_key())
+            return self._hash
+
+
+#: Parametrized schemas returned by ``Schema.from_json``, keyed by structure
+_interned = weakref.WeakValueDictionary()
+
+
+def _internable(value):
+    if isinstance(value, StructuralSchema):
+        return value.internable and _internable(freeze(value.param))
+    if isinstance(value, tuple):
+        return all(_internable(v) for v in value)
+    return True
+
+
+def intern_schema(schema):
+    """Returns a previously seen parametrized schema equal to *schema*, or
+    remembers *schema* and returns it. Keeps one copy of each schema that a
+    spec repeats. Schemas that are not :attr:`~StructuralSchema.internable`,
+    or contain such schemas, are returned as they are.
+    """
+    if not _internable(schema):
+        return schema
+    key = schema.schema_key()
+    existing = _interned.get(key)
+    if existing is not None:
+        return existing
+    _interned[key] = schema
+    return schema
+
+
 class BasicWrapper(object):
     param_schema = None
 
@@ -79,7 +154,7 @@ class BasicWrapper(object):
 
 
 
-class ParametrizedWrapper(object):
+class ParametrizedWrapper(StructuralSchema):
 
     def from_json(self, datum):
         datum = self.schema.from_json(datum)
@@ -110,7 +185,7 @@ class BasicPrimitive(object):
 
 
 
-class ParametrizedPrimitive(object):
+class ParametrizedPrimitive(StructuralSchema):
 
     def __init__(self, param):
         self.param = param
@@ -130,7 +205,12 @@ class Box(object):
         self.datum = datum
 
     def __hash__(self):
-        return hash(json.dumps(self.datum))
+        # The datum is not expected to change once the box is hashed
+        try:
+            return self._hash
+        except AttributeError:
+            self._hash = hash(json.dumps(self.datum, sort_keys=True))
+            return self._hash
 
     def __eq__(self, datum):
         return self.datum == datum
@@ -138,6 +218,11 @@ class Box(object):
 
 
 
+_canonical_datetime = re.compile(
+    r'^(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?'
+    r'(Z|([+-])(\d\d):(\d\d))?$')
+
+
 def standard_types(type_getter=None, include=None):
     """
     :param type_getter: A function that, given a custom type name, returns the
@@ -216,7 +301,7 @@ def standard_types(type_getter=None, include=None):
             # Deserialize or instantiate
             if serializer.param_schema != None:
                 param = serializer.param_schema.from_json(datum["param"])
-                return serializer(param)
+                return intern_schema(serializer(param))
             else:
                 return serializer
 
@@ -324,19 +409,62 @@ def standard_types(type_getter=None, include=None):
                 >>> DateTime.to_json(datetime.now())
                 u'2013-10-18T01:58:24.904349'
 
+        Parsed values are kept in a cache of up to :data:`cache_size`
+        entries, which pays off when a payload repeats the same timestamps.
+        Set it to 0 to disable the cache.
         """
         schema = String
+        cache_size = 1024
+        _cache = {}
+        _tz_cache = {}
 
         @classmethod
         def assemble(cls, datum):
             """Parse *datum* as an ISO 8601-encoded time and return a
             :class:`datetime` object. If the string is invalid, raise a
             :exc:`ValidationError`.
+
+            The canonical ``YYYY-MM-DDTHH:MM:SS[.ffffff][Z|+HH:MM]`` forms
+            are parsed directly, everything else is handed to
+            :func:`isodate.parse_datetime`.
             """
+            cache = cls._cache
             try:
-                return isodate.parse_datetime(datum)
+                return cache[datum]
+            except KeyError:
+                pass
+            try:
+                m = _canonical_datetime.match(datum)
+                if m is None:
+                    ret = isodate.parse_datetime(datum)
+                else:
+                    ret = cls._build(*m.groups())
             except (ValueError, isodate.isoerror.ISO8601Error) as e:
                 raise ValidationError(e.args[0], datum)
+            if cls.cache_size:
+                if len(cache) >= cls.cache_size:
+                    cache.clear()
+                cache[datum] = ret
+            return ret
+
+        @classmethod
+        def _build(cls, year, month, day, hour, minute, second, fraction,
+                   tzname, tzsign, tzhour, tzmin):
+            if fraction is None:
+                microsecond = 0
+            else:
+                microsecond = int(fraction.ljust(6, '0'))
+            tzinfo = None
+            if tzname is not None:
+                try:
+                    tzinfo = cls._tz_cache[tzname]
+                except KeyError:
+                    tzinfo = build_tzinfo(tzname, tzsign,
+                                          int(tzhour or 0), int(tzmin or 0))
+                    cls._tz_cache[tzname] = tzinfo
+            return datetime.datetime(int(year), int(month), int(day),
+                                     int(hour), int(minute), int(second),
+                                     microsecond, tzinfo)
 
         @classmethod
         def disassemble(cls, datum):
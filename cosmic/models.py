@@ -1,3 +1,5 @@
+from .exceptions import NotFound
+
 __all__ = ['BaseModel']
 
 
@@ -38,6 +40,23 @@ class BaseModel(object):
     #: :func:`~cosmic.types.required_link` and
     #: :func:`~cosmic.types.optional_link` to specify them.
     links = []
+    #: If not None, overrides the
+    #: :data:`~cosmic.http.Server.trusted_output` setting of the server for
+    #: this model's endpoints.
+    trusted_output = None
+    #: Maps method names to the number of calls a server handles at once,
+    #: e.g. ``{'get_list': 4}``. Methods not listed are not limited.
+    max_concurrency = {}
+    #: Maps method names to admission priorities that override the
+    #: :data:`~cosmic.http.Endpoint.priority` of their endpoints.
+    priority = {}
+    #: If true, :meth:`get_by_id` and :meth:`get_list` are passed a *fields*
+    #: keyword argument when the client asks for some fields only (see
+    #: :class:`~cosmic.http.ProjectionMixin`). It is a sorted tuple of
+    #: property and link names; other fields may be left out of the returned
+    #: representations. Without this, the handlers are called as usual and
+    #: the extra fields are dropped from the response.
+    accepts_fields = False
 
     @classmethod
     def get_by_id(cls, id):
@@ -48,6 +67,25 @@ class BaseModel(object):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def get_by_ids(cls, ids):
+        """
+        :param ids: A list of distinct ids.
+        :return: A list of tuples of ids and representations of the objects
+            that exist.
+
+        Used to fetch linked objects for the *embed* query parameter (see
+        :class:`~cosmic.http.EmbedMixin`). The default implementation calls
+        :meth:`get_by_id` for each id; override it to fetch them at once.
+        """
+        ret = []
+        for id in ids:
+            try:
+                ret.append((id, cls.get_by_id(id)))
+            except NotFound:
+                pass
+        return ret
+
     @classmethod
     def get_list(cls, **kwargs):
         """
@@ -62,6 +100,23 @@ class BaseModel(object):
         """
         raise NotImplementedError()
 
+    @classmethod
+    def count(cls, **kwargs):
+        """
+        :param kwargs: Defined by \
+            :data:`~cosmic.models.BaseModel.query_fields`
+        :return: The number of objects :meth:`get_list` would return.
+
+        Serves ``HEAD`` requests and ``count_only`` queries of
+        :class:`~cosmic.http.GetListEndpoint`. The default implementation
+        counts the result of :meth:`get_list`; override it if the storage
+        can count without loading the objects.
+        """
+        l = cls.get_list(**kwargs)
+        if cls.list_metadata:
+            l = l[0]
+        return len(l)
+
     @classmethod
     def create(cls, **valid_patch):
         """
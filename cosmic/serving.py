@@ -0,0 +1,344 @@
+"""A pre-forking HTTP server for running Cosmic APIs in production.
+
+The master process binds the listening socket, builds the
+:class:`~cosmic.http.Server` and warms its caches, then forks the workers so
+that they share this memory copy-on-write. Each worker accepts connections
+on the shared socket and handles requests in a pool of threads. The master
+replaces workers that exit, which they do after *max_requests* requests or
+when their memory use reaches *max_memory*. On SIGTERM or SIGINT, workers
+stop accepting connections and finish the requests in progress.
+
+From the command line::
+
+    $ cosmic serve words:words --workers 4 --port 8000
+"""
+import os
+import sys
+import time
+import errno
+import select
+import signal
+import stat
+import socket
+import logging
+import argparse
+import resource
+import threading
+import tempfile
+import importlib
+from Queue import Queue
+from SocketServer import ThreadingMixIn
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler, make_server
+
+
+__all__ = ['serve', 'bind_socket', 'make_fd_server', 'warm_up', 'main']
+
+logger = logging.getLogger(__name__)
+
+
+def bind_socket(host='127.0.0.1', port=0):
+    """Returns a listening socket. With the default *port* of 0 the OS picks
+    a free port. A *host* of the form ``unix:///path/to/socket`` binds a UNIX
+    socket instead. A socket file left behind by a server that is gone is
+    replaced, but if another server still listens on it, :exc:`socket.error`
+    is raised.
+    """
+    if host.startswith('unix://'):
+        path = host[len('unix://'):]
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+            except socket.error as e:
+                if e.errno != errno.ECONNREFUSED:
+                    raise
+                os.unlink(path)
+            else:
+                raise socket.error(errno.EADDRINUSE,
+                                   "Address already in use: %s" % path)
+            finally:
+                probe.close()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(path)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+    sock.listen(128)
+    return sock
+
+
+def make_fd_server(host, app, fd, server_class=None, **kwargs):
+    """Creates a Werkzeug server that accepts connections on the listening
+    socket *fd*, as bound by :func:`bind_socket`. Extra arguments are passed
+    to *server_class*, which defaults to Werkzeug's
+    :func:`~werkzeug.serving.make_server`.
+    """
+    # Werkzeug binds a throwaway socket to the address even when given an
+    # fd, unlinking an existing UNIX socket file first. Point it elsewhere so
+    # that the shared socket stays reachable.
+    scratch = None
+    if host.startswith('unix://'):
+        scratch = os.path.join(tempfile.mkdtemp(), 'scratch.sock')
+        host = 'unix://' + scratch
+    try:
+        if server_class is None:
+            return make_server(host, 0, app, fd=fd, **kwargs)
+        return server_class(host, app, fd, **kwargs)
+    finally:
+        if scratch is not None:
+            if os.path.exists(scratch):
+                os.unlink(scratch)
+            os.rmdir(os.path.dirname(scratch))
+
+
+def warm_up(server):
+    """Builds the caches that are otherwise filled by the first requests, so
+    that workers share them after the fork: the spec served by
+    ``/spec.json`` (by freezing the API, see :meth:`~cosmic.api.API.freeze`),
+    the query schemas and trusted serializers of all models and the trusted
+    serializers of all actions (see :func:`~cosmic.tools.trusted_serializer`).
+    """
+    from .types import Representation, Model
+    from .tools import trusted_serializer
+    from .http import query_schema
+
+    api = server.api
+    if api.spec_json is None:
+        api.freeze()
+    for name, model_spec in api.spec['models'].items():
+        full_name = "{}.{}".format(api.spec['name'], name)
+        trusted_serializer(Representation(Model(full_name)))
+        if model_spec['query_fields']:
+            query_schema(model_spec['query_fields'])
+    for plan in api.action_plans.values():
+        plan.trusted
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    # Lets clients reuse connections for responses with a Content-Length
+    protocol_version = "HTTP/1.1"
+
+    def run_wsgi(self):
+        self.server.count_request()
+        return WSGIRequestHandler.run_wsgi(self)
+
+    def end_headers(self):
+        # Tell the client not to reuse the connection of a stopping worker
+        if self.server.stopping and not self.close_connection:
+            self.close_connection = 1
+            self.send_header("Connection", "close")
+        WSGIRequestHandler.end_headers(self)
+
+
+class PooledWSGIServer(ThreadingMixIn, BaseWSGIServer):
+    """A Werkzeug server that handles connections in a fixed pool of
+    *threads* and stops once :attr:`stopping` is set, after the queued
+    connections are done.
+    """
+    daemon_threads = True
+    # Wake up regularly to check whether the worker should stop
+    timeout = 0.5
+
+    def __init__(self, host, app, fd, threads=4, keep_alive=5,
+                 max_requests=None, max_memory=None):
+        handler = type('Handler', (KeepAliveRequestHandler,),
+                       {'timeout': keep_alive})
+        BaseWSGIServer.__init__(self, host, 0, app, handler=handler, fd=fd)
+        if not isinstance(self.socket, socket.socket):
+            # On Python 2, socket.fromfd returns the bare _socket object,
+            # whose connections can't be read through makefile() once they
+            # have a timeout
+            self.socket = socket.socket(_sock=self.socket)
+        self.max_requests = max_requests
+        self.max_memory = max_memory
+        self.requests = 0
+        self.requests_lock = threading.Lock()
+        self.stopping = False
+        self.queue = Queue()
+        for i in range(threads):
+            t = threading.Thread(target=self.work)
+            t.daemon = True
+            t.start()
+
+    def process_request(self, request, client_address):
+        self.queue.put((request, client_address))
+
+    def work(self):
+        while True:
+            request, client_address = self.queue.get()
+            try:
+                self.process_request_thread(request, client_address)
+            finally:
+                self.queue.task_done()
+
+    def count_request(self):
+        with self.requests_lock:
+            self.requests += 1
+            requests = self.requests
+        if self.max_requests and requests >= self.max_requests:
+            self.stopping = True
+        if self.max_memory and memory_usage() >= self.max_memory:
+            self.stopping = True
+
+    def serve_until_stopped(self):
+        while not self.stopping:
+            try:
+                self.handle_request()
+            except (select.error, socket.error) as e:
+                if e.args[0] != errno.EINTR:
+                    raise
+        self.queue.join()
+
+
+def memory_usage():
+    """Current resident memory of the current process in bytes. Where
+    ``/proc`` is not available, the peak resident memory is returned
+    instead.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError, IndexError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on OS X and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak
+    return peak * 1024
+
+
+def _run_worker(server, sock, host, threads, keep_alive, max_requests,
+                max_memory):
+    httpd = make_fd_server(host, server.wsgi_app, sock.fileno(),
+                           server_class=PooledWSGIServer, threads=threads,
+                           keep_alive=keep_alive, max_requests=max_requests,
+                           max_memory=max_memory)
+
+    def stop(signum, frame):
+        httpd.stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    httpd.serve_until_stopped()
+
+
+def _spawn(server, sock, host, options):
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _run_worker(server, sock, host, **options)
+        except Exception:
+            logger.exception("Worker failed")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def serve(api, host='127.0.0.1', port=8000, workers=None, threads=4,
+          keep_alive=5, max_requests=None, max_memory=None,
+          graceful_timeout=30, sock=None, **server_options):
+    """Serves *api* from *workers* forked processes (by default one per CPU)
+    until the process receives SIGTERM or SIGINT.
+
+    :param threads: Number of threads handling requests in each worker.
+    :param keep_alive: Seconds an idle keep-alive connection is kept open.
+    :param max_requests: Replace a worker after it handled this many requests.
+    :param max_memory: Replace a worker once its resident memory reaches this
+        many bytes.
+    :param graceful_timeout: Seconds to wait for workers to finish their
+        requests on shutdown before killing them.
+    :param sock: A listening socket to use instead of binding *host* and
+        *port*, see :func:`bind_socket`.
+
+    Other keyword arguments are passed to :class:`~cosmic.http.Server`.
+    """
+    from .http import Server
+
+    if sock is None:
+        sock = bind_socket(host, port)
+    if workers is None:
+        import multiprocessing
+        workers = multiprocessing.cpu_count()
+    server = Server(api, **server_options)
+    warm_up(server)
+
+    options = {
+        "threads": threads,
+        "keep_alive": keep_alive,
+        "max_requests": max_requests,
+        "max_memory": max_memory,
+    }
+    state = {"running": True}
+
+    def stop(signum, frame):
+        state["running"] = False
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    pids = set()
+    for i in range(workers):
+        pids.add(_spawn(server, sock, host, options))
+
+    while state["running"]:
+        try:
+            pid, status = os.wait()
+        except OSError as e:
+            if e.errno != errno.EINTR:
+                raise
+            continue
+        pids.discard(pid)
+        if state["running"]:
+            pids.add(_spawn(server, sock, host, options))
+
+    for pid in pids:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.time() + graceful_timeout
+    while pids and time.time() < deadline:
+        for pid in list(pids):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                pids.discard(pid)
+        time.sleep(0.05)
+    for pid in pids:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    sock.close()
+
+
+def import_api(path):
+    """Imports an API given as ``"module:attribute"``."""
+    module_name, _, attr = path.partition(':')
+    if not attr:
+        raise ValueError('Expected "module:api", got "%s"' % path)
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="cosmic")
+    commands = parser.add_subparsers(dest="command")
+    p = commands.add_parser("serve", help="Serve an API with pre-forked workers")
+    p.add_argument("api", help='The API to serve, as "module:attribute"')
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8000)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--threads", type=int, default=4)
+    p.add_argument("--keep-alive", type=float, default=5)
+    p.add_argument("--max-requests", type=int, default=None)
+    p.add_argument("--max-memory", type=int, default=None,
+                   help="Worker memory limit in megabytes")
+    p.add_argument("--graceful-timeout", type=float, default=30)
+    p.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, os.getcwd())
+    logging.basicConfig(level=logging.INFO)
+    max_memory = args.max_memory and args.max_memory * 1024 * 1024
+    serve(import_api(args.api), host=args.host, port=args.port,
+          workers=args.workers, threads=args.threads,
+          keep_alive=args.keep_alive, max_requests=args.max_requests,
+          max_memory=max_memory, graceful_timeout=args.graceful_timeout,
+          debug=args.debug)
@@ -0,0 +1,314 @@
+import os
+import json
+import sqlite3
+import threading
+
+from .models import BaseModel
+from .exceptions import NotFound, SpecError
+from .types import Integer, Float, String, Boolean
+
+
+__all__ = ['SQLiteModel']
+
+
+# Columns for these types store the native value, all others store JSON
+_column_types = {
+    Integer: "INTEGER",
+    Float: "REAL",
+    String: "TEXT",
+    Boolean: "INTEGER",
+}
+
+_local = threading.local()
+
+
+def _quote(name):
+    return '"%s"' % name
+
+
+# Databases that are private to the connection opening them
+_private_databases = (":memory:", "")
+
+
+class SQLiteModelType(type):
+    """Checks that the query fields of an :class:`SQLiteModel` are named
+    after its properties or links, and that its database can be shared by
+    connections, when the class is defined.
+    """
+
+    def __init__(cls, name, bases, attrs):
+        super(SQLiteModelType, cls).__init__(name, bases, attrs)
+        if cls.database in _private_databases:
+            raise SpecError("%s.database must be a file, as each thread "
+                            "opens a connection of its own" % name)
+        columns = set(name for name, _ in cls.properties + cls.links)
+        for field, _ in cls.query_fields:
+            if field not in columns:
+                raise SpecError("Query field of %s is not a property or "
+                                "link: %s" % (name, field))
+
+
+class SQLiteModel(BaseModel):
+    """A model stored in an SQLite table with one column per property and
+    link, plus an ``id`` column. Link columns hold the id of the linked
+    object. Properties of types other than Integer, Float, String and Boolean
+    are stored as JSON text.
+
+    The table and an index for every query field are created on first use.
+    :meth:`get_list` turns its arguments into a ``WHERE`` clause, so query
+    fields must be named after properties or links, or
+    :exc:`~cosmic.exceptions.SpecError` is raised when the class is defined.
+
+    Each thread gets its own connection to :data:`database`, kept open for
+    later calls and reopened in processes forked after it was opened. SQL
+    statements are built once per model and reused, so the sqlite3 module
+    can serve them from its prepared statement cache. When a client asks for
+    some fields only, only their columns are selected.
+    """
+    __metaclass__ = SQLiteModelType
+    accepts_fields = True
+    #: Path to the SQLite database file. In-memory databases are rejected,
+    #: since every connection to one would see a database of its own.
+    database = None
+    #: Name of the table, defaults to the class name
+    table_name = None
+    #: Size of the per-connection prepared statement cache
+    cached_statements = 256
+    #: Number of ids looked up per statement in :meth:`get_by_ids`
+    batch_size = 100
+
+    @classmethod
+    def get_by_id(cls, id, fields=None):
+        row = cls._execute(("get_by_id", (), fields),
+                           cls._row_id(id)).fetchone()
+        if row is None:
+            raise NotFound
+        return cls._decode_row(row, fields)[1]
+
+    @classmethod
+    def get_by_ids(cls, ids):
+        row_ids = []
+        for id in ids:
+            try:
+                row_ids.append(int(id))
+            except ValueError:
+                pass
+        ret = []
+        # Fixed batch sizes keep the number of distinct statements low and
+        # stay below SQLite's limit on parameters
+        for i in range(0, len(row_ids), cls.batch_size):
+            batch = row_ids[i:i + cls.batch_size]
+            batch += [None] * (cls.batch_size - len(batch))
+            cursor = cls._execute("get_by_ids", *batch)
+            ret.extend(cls._decode_row(row) for row in cursor)
+        return ret
+
+    @classmethod
+    def get_list(cls, fields=None, **kwargs):
+        query, args = cls._query(kwargs)
+        cursor = cls._execute(("get_list", query, fields), *args)
+        return [cls._decode_row(row, fields) for row in cursor]
+
+    @classmethod
+    def count(cls, **kwargs):
+        query, args = cls._query(kwargs)
+        return cls._execute(("count", query), *args).fetchone()[0]
+
+    @classmethod
+    def create(cls, **patch):
+        fields = tuple(sorted(patch.keys()))
+        columns = cls._columns()
+        args = [columns[name][1](patch[name]) for name in fields]
+        with cls._connection() as conn:
+            cursor = conn.execute(cls._sql(("create", fields)), args)
+        return str(cursor.lastrowid), patch
+
+    @classmethod
+    def update(cls, id, **patch):
+        row_id = cls._row_id(id)
+        fields = tuple(sorted(patch.keys()))
+        columns = cls._columns()
+        args = [columns[name][1](patch[name]) for name in fields]
+        with cls._connection() as conn:
+            if fields:
+                conn.execute(cls._sql(("update", fields)), args + [row_id])
+            row = conn.execute(cls._sql("get_by_id"), [row_id]).fetchone()
+        if row is None:
+            raise NotFound
+        return cls._decode_row(row)[1]
+
+    @classmethod
+    def delete(cls, id):
+        with cls._connection() as conn:
+            cursor = conn.execute(cls._sql("delete"), [cls._row_id(id)])
+        if cursor.rowcount == 0:
+            raise NotFound
+
+    @classmethod
+    def _query(cls, kwargs):
+        # The sorted query fields and their encoded values
+        query = tuple(sorted(kwargs.keys()))
+        columns = cls._columns()
+        return query, [columns[name][1](kwargs[name]) for name in query]
+
+    @classmethod
+    def _row_id(cls, id):
+        try:
+            return int(id)
+        except ValueError:
+            raise NotFound
+
+    @classmethod
+    def _table(cls):
+        return cls.table_name or cls.__name__
+
+    @classmethod
+    def _columns(cls):
+        """Returns an ordered list of column names and a dict mapping each
+        name to a tuple of SQL type, encoder and decoder.
+        """
+        if '_column_cache' in cls.__dict__:
+            return cls._column_cache
+
+        def identity(value):
+            return value
+
+        def boolean(value):
+            return None if value is None else bool(value)
+
+        def json_codec(schema):
+            def encode(value):
+                if value is None:
+                    return None
+                return json.dumps(schema.to_json(value))
+
+            def decode(value):
+                if value is None:
+                    return None
+                return schema.from_json(json.loads(value))
+            return encode, decode
+
+        columns = {}
+        for name, field in cls.properties:
+            schema = field['schema']
+            if schema is Boolean:
+                columns[name] = ("INTEGER", identity, boolean)
+            elif schema in _column_types:
+                columns[name] = (_column_types[schema], identity, identity)
+            else:
+                columns[name] = ("TEXT",) + json_codec(schema)
+        for name, link in cls.links:
+            columns[name] = ("TEXT", identity, identity)
+        cls._column_order = [name for name, _ in cls.properties] + \
+            [name for name, _ in cls.links]
+        cls._column_cache = columns
+        return columns
+
+    @classmethod
+    def _selected(cls, fields):
+        # Columns holding *fields*, in table order
+        if fields is None:
+            return cls._column_order
+        return [name for name in cls._column_order if name in fields]
+
+    @classmethod
+    def _decode_row(cls, row, fields=None):
+        columns = cls._columns()
+        rep = {}
+        for name, value in zip(cls._selected(fields), row[1:]):
+            if value is not None:
+                rep[name] = columns[name][2](value)
+        return str(row[0]), rep
+
+    @classmethod
+    def _sql(cls, key):
+        if '_sql_cache' not in cls.__dict__:
+            cls._sql_cache = {}
+        try:
+            return cls._sql_cache[key]
+        except KeyError:
+            pass
+
+        cls._columns()
+        table = _quote(cls._table())
+        # Keys are a statement kind, optionally followed by the fields it
+        # sets or filters on and, for selects, the fields to return
+        if not isinstance(key, tuple):
+            key = (key,)
+        kind, fields, selected = (key + ((), None))[:3]
+        select = "SELECT %s FROM %s" % (
+            ", ".join(_quote(c) for c in ["id"] + cls._selected(selected)),
+            table)
+        if kind == "get_by_id":
+            sql = select + " WHERE id = ?"
+        elif kind == "get_by_ids":
+            sql = select + " WHERE id IN (%s)" % ", ".join(
+                "?" for i in range(cls.batch_size))
+        elif kind == "get_list":
+            sql = select
+            if fields:
+                sql += " WHERE " + " AND ".join(
+                    "%s = ?" % _quote(f) for f in fields)
+            sql += " ORDER BY id"
+        elif kind == "count":
+            sql = "SELECT COUNT(*) FROM %s" % table
+            if fields:
+                sql += " WHERE " + " AND ".join(
+                    "%s = ?" % _quote(f) for f in fields)
+        elif kind == "create":
+            if fields:
+                sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+                    table, ", ".join(_quote(f) for f in fields),
+                    ", ".join("?" for f in fields))
+            else:
+                sql = "INSERT INTO %s DEFAULT VALUES" % table
+        elif kind == "update":
+            sql = "UPDATE %s SET %s WHERE id = ?" % (
+                table, ", ".join("%s = ?" % _quote(f) for f in fields))
+        elif kind == "delete":
+            sql = "DELETE FROM %s WHERE id = ?" % table
+        cls._sql_cache[key] = sql
+        return sql
+
+    @classmethod
+    def _execute(cls, key, *args):
+        return cls._connection().execute(cls._sql(key), args)
+
+    @classmethod
+    def _connection(cls):
+        if cls.database is None:
+            raise RuntimeError("%s.database is not set" % cls.__name__)
+        if cls.database in _private_databases:
+            raise SpecError("%s.database must be a file" % cls.__name__)
+        # Connections must not be shared with a parent process
+        if getattr(_local, 'pid', None) != os.getpid():
+            _local.pid = os.getpid()
+            _local.connections = {}
+        try:
+            conn, created = _local.connections[cls.database]
+        except KeyError:
+            conn = sqlite3.connect(cls.database,
+                                   cached_statements=cls.cached_statements)
+            # Tables created through this connection
+            created = set()
+            _local.connections[cls.database] = (conn, created)
+        if cls._table() not in created:
+            cls._create_table(conn)
+            created.add(cls._table())
+        return conn
+
+    @classmethod
+    def _create_table(cls, conn):
+        columns = cls._columns()
+        table = cls._table()
+        defs = ["id INTEGER PRIMARY KEY AUTOINCREMENT"]
+        for name in cls._column_order:
+            defs.append("%s %s" % (_quote(name), columns[name][0]))
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (
+                _quote(table), ", ".join(defs)))
+            for name, field in cls.query_fields:
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS %s ON %s (%s)" % (
+                        _quote("%s_%s" % (table, name)),
+                        _quote(table), _quote(name)))
@@ -1,71 +1,348 @@
+import copy
+import time
+import bisect
+import atexit
+import socket
+import threading
+from collections import MutableMapping
 from multiprocessing import Process
 from contextlib import contextmanager
 
 from .models import BaseModel
 from .exceptions import NotFound
 from .globals import SwappableDict, cosmos
+from .serving import bind_socket, make_fd_server
 
 
-db = SwappableDict()
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+
+class Table(MutableMapping):
+    """An in-memory table of representations keyed by id, used by
+    :class:`DBModel`. Ids are kept in sorted order and *index_fields* get a
+    hash index mapping each value to the set of ids that have it. Values that
+    can't be hashed, like lists, are left out of the indexes and matched by
+    scanning the rows instead. New ids are
+    generated from a counter that starts after the largest numeric id.
+
+    All methods are safe to call from multiple threads. Rows must be changed
+    through the table (not by mutating the stored dicts) to keep the indexes
+    correct.
+    """
+
+    def __init__(self, rows=None, index_fields=()):
+        self.lock = threading.RLock()
+        self.rows = {}
+        self.ids = []
+        self.indexes = dict((field, {}) for field in index_fields)
+        self.next_id = 0
+        for id, rep in sorted((rows or {}).items()):
+            self[id] = rep
+
+    def __getitem__(self, id):
+        return self.rows[id]
+
+    def __setitem__(self, id, rep):
+        with self.lock:
+            if id in self.rows:
+                self._unindex(id, self.rows[id])
+            else:
+                bisect.insort(self.ids, id)
+            self.rows[id] = rep
+            self._index(id, rep)
+            if isinstance(id, basestring) and id.isdigit():
+                self.next_id = max(self.next_id, int(id) + 1)
+
+    def __delitem__(self, id):
+        with self.lock:
+            rep = self.rows.pop(id)
+            self._unindex(id, rep)
+            del self.ids[bisect.bisect_left(self.ids, id)]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(list(self.ids))
+
+    def __repr__(self):
+        return repr(self.rows)
+
+    def __deepcopy__(self, memo):
+        with self.lock:
+            rows = copy.deepcopy(self.rows, memo)
+        return Table(rows, self.indexes.keys())
+
+    def insert(self, rep):
+        """Stores *rep* under a newly generated id and returns the id."""
+        with self.lock:
+            id = str(self.next_id)
+            self[id] = rep
+            return id
+
+    def update_row(self, id, patch):
+        with self.lock:
+            rep = self.rows[id]
+            self._unindex(id, rep)
+            rep.update(patch)
+            self._index(id, rep)
+            return rep
+
+    def select(self, **kwargs):
+        """Returns a list of ``(id, rep)`` tuples ordered by id, for the rows
+        whose values match *kwargs*.
+        """
+        with self.lock:
+            if not kwargs:
+                return [(id, self.rows[id]) for id in self.ids]
+            indexed = [f for f in kwargs
+                       if f in self.indexes and _hashable(kwargs[f])]
+            if indexed:
+                candidates = min(
+                    (self.indexes[f].get(kwargs[f], ()) for f in indexed),
+                    key=len)
+                ids = sorted(candidates)
+            else:
+                ids = self.ids
+            ret = []
+            for id in ids:
+                rep = self.rows[id]
+                for key, val in kwargs.items():
+                    if key not in rep or rep[key] != val:
+                        break
+                else:
+                    ret.append((id, rep))
+            return ret
+
+    def _index(self, id, rep):
+        for field, index in self.indexes.items():
+            if field in rep and _hashable(rep[field]):
+                index.setdefault(rep[field], set()).add(id)
+
+    def _unindex(self, id, rep):
+        for field, index in self.indexes.items():
+            if field in rep and _hashable(rep[field]):
+                ids = index.get(rep[field])
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del index[rep[field]]
+
+
+class Database(SwappableDict):
+    """A :class:`~cosmic.globals.SwappableDict` of tables keyed by table
+    name. Plain dicts of rows put into it (e.g. by ``db.swap``) are left
+    alone: the first time a table is asked for, a :class:`Table` holding a
+    copy of the rows is made, and it stands in for the dict until the data
+    is swapped out.
+    """
+
+    def __init__(self, data=None):
+        super(Database, self).__init__(data)
+        self.tables = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        rows = self.data.get(name)
+        entry = self.tables.get(name)
+        if entry is not None and entry[0] is rows:
+            return entry[1]
+        return self.data[name]
+
+    def table(self, name, index_fields=()):
+        """Returns the :class:`Table` for *name*, making it from the rows
+        stored under *name* if needed.
+        """
+        rows = self.data.get(name)
+        if isinstance(rows, Table):
+            return rows
+        entry = self.tables.get(name)
+        if entry is not None and entry[0] is rows:
+            return entry[1]
+        with self.lock:
+            entry = self.tables.get(name)
+            if entry is None or entry[0] is not rows:
+                entry = (rows, Table(copy.deepcopy(rows), index_fields))
+                self.tables[name] = entry
+            return entry[1]
+
+    @contextmanager
+    def swap(self, new):
+        tables = self.tables
+        self.tables = {}
+        try:
+            with super(Database, self).swap(new):
+                yield
+        finally:
+            self.tables = tables
+
+
+db = Database()
 
 
 class DBModel(BaseModel):
+    #: Fields of the representation to build hash indexes on. Defaults to the
+    #: names of :data:`~cosmic.models.BaseModel.query_fields`.
+    index_fields = None
+
+    @classmethod
+    def get_table(cls):
+        """Returns the :class:`Table` for *table_name* from :data:`db`. A
+        plain dict of rows found there (e.g. one passed to ``db.swap``) is
+        copied into a table, see :class:`Database`.
+        """
+        index_fields = cls.index_fields
+        if index_fields is None:
+            index_fields = [name for name, field in cls.query_fields]
+        return db.table(cls.table_name, index_fields)
+
     @classmethod
     def get_by_id(cls, id):
         try:
-            return db[cls.table_name][id]
+            return cls.get_table()[id]
         except KeyError:
             raise NotFound
 
+    @classmethod
+    def get_by_ids(cls, ids):
+        table = cls.get_table()
+        with table.lock:
+            return [(id, table[id]) for id in ids if id in table]
+
     @classmethod
     def get_list(cls, **kwargs):
-        if not kwargs:
-            return sorted(db[cls.table_name].items())
-        ret = []
-        for id, rep in db[cls.table_name].items():
-            keep = True
-            for key, val in kwargs.items():
-                if rep[key] != val:
-                    keep = False
-                    break
-            if keep:
-                ret.append((id, rep))
-        return sorted(ret)
+        return cls.get_table().select(**kwargs)
 
     @classmethod
     def create(cls, **patch):
-        id = str(len(db[cls.table_name]))
-        db[cls.table_name][id] = patch
+        id = cls.get_table().insert(patch)
         return id, patch
 
     @classmethod
     def update(cls, id, **patch):
-        rep = db[cls.table_name][id]
-        rep.update(patch)
-        return rep
+        return cls.get_table().update_row(id, patch)
 
     @classmethod
     def delete(cls, id):
-        if id not in db[cls.table_name]:
+        try:
+            del cls.get_table()[id]
+        except KeyError:
             raise NotFound
-        del db[cls.table_name][id]
 
 
-@contextmanager
-def served_api(api, port, **kwargs):
-    from time import sleep
+def _serve(api, host, fd, debug, kwargs):
+    from .http import Server
+
+    server = make_fd_server(host, Server(api, debug=debug).wsgi_app, fd,
+                            **kwargs)
+    server.serve_forever()
+
+
+def wait_until_ready(sock, process, timeout=10):
+    """Requests the spec from the server listening on *sock* until it
+    responds, or raises :exc:`RuntimeError` if *process* exits or *timeout*
+    seconds pass first. Since the socket is bound before the server starts,
+    connections queue up instead of failing and the first request is usually
+    answered as soon as the server accepts it.
+    """
+    deadline = time.time() + timeout
+    while True:
+        if not process.is_alive():
+            raise RuntimeError("Server exited with code %s" % process.exitcode)
+        probe = socket.socket(sock.family, socket.SOCK_STREAM)
+        probe.settimeout(max(deadline - time.time(), 0.01))
+        try:
+            probe.connect(sock.getsockname())
+            probe.sendall(b"GET /spec.json HTTP/1.0\r\n\r\n")
+            if probe.recv(12).startswith(b"HTTP/"):
+                return
+        except socket.error:
+            pass
+        finally:
+            probe.close()
+        if time.time() > deadline:
+            raise RuntimeError("Server did not start in %s seconds" % timeout)
+        time.sleep(0.01)
+
 
-    p = Process(target=api.run, args=(port,), kwargs=kwargs)
-    p.start()
-    sleep(0.1)
+def _start(api, host, port, debug, kwargs):
+    sock = bind_socket(host, port)
+    process = Process(target=_serve,
+                      args=(api, host, sock.fileno(), debug, kwargs))
+    process.daemon = True
+    process.start()
+    if sock.family == socket.AF_INET:
+        url = 'http://%s:%s' % sock.getsockname()
+    else:
+        url = host
+    return sock, process, url
 
+
+def _stop(server):
+    sock, process, url = server
+    process.terminate()
+    process.join()
+    sock.close()
+
+
+_shared_servers = {}
+
+
+@atexit.register
+def _stop_shared_servers():
+    for server in _shared_servers.values():
+        _stop(server)
+    _shared_servers.clear()
+
+
+@contextmanager
+def served_apis(apis, host='127.0.0.1', port=0, debug=False, shared=False,
+                **kwargs):
+    """Serves each API in *apis* from its own process and yields a list of
+    their base URLs once they all respond. Sockets are bound before forking,
+    on a free port unless *port* is given.
+
+    Extra keyword arguments (e.g. *threaded*) are passed to Werkzeug's
+    :func:`~werkzeug.serving.make_server`. If *shared* is true, the servers
+    are kept running after the block exits and reused by later calls with the
+    same arguments, until the interpreter exits.
+    """
+    servers = []
+    started = []
+    ready = False
     try:
+        for api in apis:
+            key = (api, host, port, debug, tuple(sorted(kwargs.items())))
+            if shared and key in _shared_servers:
+                servers.append(_shared_servers[key])
+                continue
+            server = _start(api, host, port, debug, kwargs)
+            started.append((key, server))
+            servers.append(server)
+        for key, (sock, process, url) in started:
+            wait_until_ready(sock, process)
+        ready = True
+        if shared:
+            _shared_servers.update(started)
+
         with cosmos.swap({}):
-            yield
-    except Exception as e:
-        raise e
+            yield [url for sock, process, url in servers]
     finally:
-        p.terminate()
+        if not (shared and ready):
+            for key, server in started:
+                _stop(server)
+
+
+@contextmanager
+def served_api(api, port=0, **kwargs):
+    """Like :func:`served_apis` for a single API, yields its base URL."""
+    with served_apis([api], port=port, **kwargs) as urls:
+        yield urls[0]
 
 
 class WildcardClass(object):
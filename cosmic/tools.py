@@ -1,16 +1,21 @@
 from __future__ import unicode_literals
 
 import re
+import time
 import inspect
 import json
+import threading
+from collections import OrderedDict
 
 from .exceptions import SpecError
 from .types import *
+from .types import BaseRepresentation
 
 
 __all__ = ['get_args', 'args_to_datum', 'assert_is_compatible',
            'deserialize_json', 'serialize_json', 'string_to_json',
-           'validate_underscore_identifier', 'is_string_type']
+           'validate_underscore_identifier', 'is_string_type',
+           'trusted_serializer', 'LRUCache', 'ActionPlan']
 
 
 def get_args(func):
@@ -85,12 +90,14 @@ def deserialize_json(schema, datum):
     return None
 
 
-def serialize_json(schema, datum):
+def serialize_json(schema, datum, trusted=False):
     if schema is not None and datum is None:
         raise ValidationError("Expected data, found None")
     if datum is not None and schema is None:
         raise ValidationError("Expected None, found data")
     if schema is not None and datum is not None:
+        if trusted:
+            return Box(trusted_serializer(schema)(datum))
         return Box(schema.to_json(datum))
     return None
 
@@ -111,9 +118,219 @@ def validate_underscore_identifier(id):
         raise SpecError("Identifier cannot have consecutive underscores: %s" % id)
 
 
+class ActionPlan(object):
+    """Everything about calling an action that can be worked out when it is
+    registered with :meth:`~cosmic.api.API.action`: which argument takes
+    the payload, how the payload and the return value are (de)serialized and
+    whether they travel as raw bytes. Raises
+    :exc:`~cosmic.exceptions.SpecError` if *func* can't accept what
+    *accepts* describes.
+
+    Clients make plans without a *func*, which only describe the payloads.
+    The trusted serializer of *returns* is compiled on first use, as models
+    it refers to may be registered after the action.
+    """
+
+    def __init__(self, func=None, accepts=None, returns=None):
+        self.func = func
+        self.accepts = accepts
+        self.returns = returns
+        self.raw_request = accepts in (Binary, Stream)
+        self.raw_response = returns in (Binary, Stream)
+        self.stream_request = accepts is Stream
+        self.stream_response = returns is Stream
+        self.argument = None
+        self._trusted = None
+        if func is None:
+            return
+        required_args, optional_args = get_args(func)
+        if accepts:
+            assert_is_compatible(accepts, required_args, optional_args)
+        args = required_args + optional_args
+        # If only one argument, it takes the whole payload
+        if len(args) == 1:
+            self.argument = args[0]
+
+    def bind(self, data):
+        """Returns the keyword arguments for calling the action with the
+        deserialized payload *data*.
+        """
+        if data is None:
+            return {}
+        if self.argument is not None:
+            return {self.argument: data}
+        return data
+
+    def deserialize(self, box):
+        """Validates a JSON payload, which is None if the body was empty."""
+        return deserialize_json(self.accepts, box)
+
+    @property
+    def trusted(self):
+        """The :func:`trusted_serializer` of *returns*, or None."""
+        if self._trusted is None and self.returns is not None:
+            self._trusted = trusted_serializer(self.returns)
+        return self._trusted
+
+    def serialize(self, datum, trusted=False):
+        if trusted and self.returns is not None and datum is not None:
+            return Box(self.trusted(datum))
+        return serialize_json(self.returns, datum)
+
+
 def is_string_type(serializer):
     if Schema.to_json(serializer)['type'] == 'String':
         return True
     if hasattr(serializer, 'schema'):
         return is_string_type(serializer.schema)
     return False
+
+
+_trusted_cache = {}
+
+
+def trusted_serializer(schema):
+    """Returns a function that turns native data into JSON like
+    ``schema.to_json`` does, except that the data is assumed to be well-formed.
+    Subtrees made of plain JSON types (:data:`Integer`, :data:`Float`,
+    :data:`String` and :data:`Boolean`) are passed through without being
+    walked, unknown struct fields are not looked for and link URLs are built
+    directly.
+
+    Compiled serializers are cached for the lifetime of the schema, so this
+    should only be called with schemas held by an API spec.
+    """
+    fields = None
+    if isinstance(schema, BaseRepresentation):
+        owner = schema.param.model_spec
+        fields = schema.fields
+    elif isinstance(schema, Struct):
+        owner = schema.param
+    else:
+        owner = schema
+    try:
+        return _trusted_cache[id(owner), fields][1]
+    except KeyError:
+        pass
+    func = _compile_trusted(schema)
+    if func is None:
+        func = _passthrough
+    _trusted_cache[id(owner), fields] = (owner, func)
+    return func
+
+
+def _passthrough(datum):
+    return datum
+
+
+def _compile_trusted(schema):
+    # Returns None if the JSON form of the schema is identical to its native
+    # form
+    if schema in (Integer, Float, String, Boolean):
+        return None
+    if schema is JSON:
+        return lambda datum: datum.datum
+    if isinstance(schema, Array):
+        item = _compile_trusted(schema.param)
+        if item is None:
+            return list
+        return lambda datum: [item(i) for i in datum]
+    if isinstance(schema, Map):
+        value = _compile_trusted(schema.param)
+        if value is None:
+            return dict
+        return lambda datum: dict((k, value(v)) for k, v in datum.items())
+    if isinstance(schema, Struct):
+        return _compile_trusted_fields(schema.param.items())
+    if isinstance(schema, BaseRepresentation):
+        return _compile_trusted_representation(schema)
+    return schema.to_json
+
+
+def _compile_trusted_fields(fields):
+    fields = [(name, _compile_trusted(field['schema']))
+              for name, field in fields]
+
+    def serialize(datum):
+        ret = {}
+        for name, func in fields:
+            value = datum.get(name)
+            if value is not None:
+                if func is None:
+                    ret[name] = value
+                else:
+                    ret[name] = func(value)
+        return ret
+
+    return serialize
+
+
+def _compile_trusted_representation(schema):
+    self_url = "/%s/%%s" % schema.param.model_name
+    links = [(name, "/%s/%%s" % link['model'].model_name)
+             for name, link in schema.field_items('links')]
+    props = _compile_trusted_fields(schema.field_items('properties'))
+
+    def serialize(datum):
+        (id, rep) = datum
+        d = props(rep)
+        hrefs = {}
+        if id is not None:
+            hrefs["self"] = {"href": self_url % id}
+        for name, url in links:
+            value = rep.get(name)
+            if value is not None:
+                hrefs[name] = {"href": url % value}
+        if hrefs:
+            d["_links"] = hrefs
+        return d
+
+    return serialize
+
+
+class LRUCache(object):
+    """A thread-safe mapping that holds at most *size* items, dropping the
+    least recently used ones first. If *ttl* is given, items expire after
+    that many seconds. Hits, misses and evictions are counted in
+    :attr:`stats`.
+    """
+
+    def __init__(self, size=1024, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key):
+        """Returns the value stored under *key* or None."""
+        with self.lock:
+            try:
+                expires, value = self.items.pop(key)
+            except KeyError:
+                self.stats["misses"] += 1
+                return None
+            if expires is not None and expires < time.time():
+                self.stats["misses"] += 1
+                return None
+            self.items[key] = (expires, value)
+            self.stats["hits"] += 1
+            return value
+
+    def put(self, key, value):
+        expires = None
+        if self.ttl is not None:
+            expires = time.time() + self.ttl
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = (expires, value)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+    def __len__(self):
+        return len(self.items)
@@ -1,33 +1,28 @@
+import io
 import json
 from collections import OrderedDict
+from contextlib import contextmanager
 
 from werkzeug.urls import url_decode, url_encode
 from werkzeug.datastructures import MultiDict
 from .legacy_teleport import standard_types, ParametrizedWrapper, BasicWrapper, \
     required, optional, Box, ValidationError
 
-from .globals import cosmos
+from .globals import cosmos, ContextVar
 
 __all__ = ['Integer', 'Float', 'Boolean', 'String', 'Binary', 'DateTime',
            'JSON', 'Array', 'Map', 'OrderedMap', 'Struct', 'Schema', 'Model',
-           'Link', 'Representation', 'Patch', 'APISpec', 'URLParams',
+           'Link', 'Representation', 'Patch', 'APISpec', 'URLParams', 'Stream',
            'Box', 'required', 'optional', 'required_link', 'optional_link',
            'ValidationError']
 
 
+#: Cosmic types by type name, filled in at the bottom of this module
+type_registry = {}
+
+
 def getter(name):
-    if name == "cosmic.APISpec":
-        return APISpec
-    elif name == "cosmic.Model":
-        return Model
-    elif name == "cosmic.Link":
-        return Link
-    elif name == "cosmic.Representation":
-        return Representation
-    elif name == "cosmic.Patch":
-        return Patch
-    else:
-        raise KeyError()
+    return type_registry[name]
 
 # Explicit definitions for static analyzers
 Integer = None
@@ -42,7 +37,47 @@ Map = None
 OrderedMap = None
 Struct = None
 Schema = None
-globals().update(standard_types(getter))
+builtin_types = standard_types(getter)
+globals().update(builtin_types)
+
+
+_native_binary = ContextVar('cosmic.types.native_binary')
+
+
+@contextmanager
+def native_binary(enabled=True):
+    """Within this context, :data:`Binary` leaves byte strings as they are
+    instead of base64-encoding them in :meth:`to_json` and decoding them in
+    :meth:`from_json`. Used for wire formats that can carry binary data.
+    """
+    token = _native_binary.set(enabled)
+    try:
+        yield
+    finally:
+        _native_binary.reset(token)
+
+
+_Base64Binary = builtin_types['Binary']
+
+
+class Binary(_Base64Binary):
+    __doc__ = _Base64Binary.__doc__
+    type_name = "Binary"
+
+    @staticmethod
+    def from_json(datum):
+        if isinstance(datum, bytes) and _native_binary.get(False):
+            return datum
+        return _Base64Binary.from_json(datum)
+
+    @staticmethod
+    def to_json(datum):
+        if _native_binary.get(False):
+            return datum
+        return _Base64Binary.to_json(datum)
+
+# Make Schema.from_json find this class for "Binary"
+builtin_types['Binary'] = Binary
 
 
 def required_link(name, model, doc=None):
@@ -64,6 +99,15 @@ class Model(BasicWrapper):
         self.full_name = full_name
         self.api_name, self.model_name = full_name.split('.', 1)
 
+    def __eq__(self, other):
+        return type(other) is Model and self.full_name == other.full_name
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.full_name)
+
     @property
     def model_spec(self):
         try:
@@ -84,6 +128,37 @@ class Model(BasicWrapper):
         return '{}.{}'.format(datum.api_name, datum.model_name)
 
 
+class Stream(BasicWrapper):
+    """A Teleport type for binary payloads too large to hold in memory. Its
+    native form is a file-like object; on output, a :class:`memoryview` or an
+    iterator of byte strings is also accepted. Its JSON form is the same as
+    that of :data:`Binary`.
+
+    When used as the *accepts* or *returns* schema of an action, the data is
+    sent as a raw ``application/octet-stream`` body. On the server, the
+    request body is spooled to a temporary file and handed to the action as
+    a memory-mapped :class:`~cosmic.http.MappedFile`, and returned file
+    objects are passed to the WSGI server's file wrapper. On the client, the
+    result is a file-like object reading from the open connection.
+    """
+    type_name = "cosmic.Stream"
+    schema = Binary
+
+    @classmethod
+    def assemble(cls, datum):
+        return io.BytesIO(datum)
+
+    @classmethod
+    def disassemble(cls, datum):
+        if hasattr(datum, 'read'):
+            return datum.read()
+        if isinstance(datum, memoryview):
+            return datum.tobytes()
+        if isinstance(datum, bytes):
+            return datum
+        return b"".join(datum)
+
+
 def link_in_href(model):
     return Struct([
         required(u"href", Link(model))
@@ -123,11 +198,35 @@ class Link(ParametrizedWrapper):
 
 class BaseRepresentation(ParametrizedWrapper):
     param_schema = Model
+    # The schema is built from the model spec of the current cosmos
+    internable = False
 
-    def __init__(self, param):
+    def __init__(self, param, fields=None):
         self.param = param
+        #: If not None, a tuple of the names of the only properties and
+        #: links that are serialized, see :meth:`project`.
+        self.fields = fields
         self._lazy_schema = None
 
+    def schema_key(self):
+        return super(BaseRepresentation, self).schema_key() + (self.fields,)
+
+    def project(self, fields):
+        """Returns a schema of the same type that only includes the
+        properties and links named in *fields*, along with the ``self``
+        link.
+        """
+        return type(self)(self.param, tuple(sorted(fields)))
+
+    def field_items(self, kind):
+        """Returns the ``(name, field)`` pairs of the model's *kind* (either
+        ``'properties'`` or ``'links'``) included in this schema.
+        """
+        items = self.param.model_spec[kind].items()
+        if self.fields is None:
+            return items
+        return [(name, field) for name, field in items if name in self.fields]
+
     @property
     def schema(self):
         if self._lazy_schema is None:
@@ -140,7 +239,7 @@ class BaseRepresentation(ParametrizedWrapper):
                     ])
                 })
             ]
-            for name, link in self.param.model_spec['links'].items():
+            for name, link in self.field_items('links'):
                 is_required = False
                 if not self.all_fields_optional:
                     is_required = link["required"]
@@ -155,7 +254,7 @@ class BaseRepresentation(ParametrizedWrapper):
             props = [
                 optional("_links", Struct(links)),
             ]
-            for name, field in self.param.model_spec['properties'].items():
+            for name, field in self.field_items('properties'):
                 is_required = False
                 if not self.all_fields_optional:
                     is_required = field["required"]
@@ -189,7 +288,7 @@ class BaseRepresentation(ParametrizedWrapper):
         links = {}
         if id is not None:
             links["self"] = {'href': id}
-        for name, link in self.param.model_spec['links'].items():
+        for name, link in self.field_items('links'):
             value = rep.get(name, None)
             if value != None:
                 links[name] = {
@@ -198,7 +297,7 @@ class BaseRepresentation(ParametrizedWrapper):
         d = {}
         if links:
             d["_links"] = links
-        for name in self.param.model_spec['properties'].keys():
+        for name, field in self.field_items('properties'):
             value = rep.get(name, None)
             if value != None:
                 d[name] = value
@@ -266,11 +365,19 @@ class URLParams(ParametrizedWrapper):
 
     """
     schema = String
+    #: The number of query strings whose parsed values are kept by
+    #: :meth:`from_multi_dict`. Only queries made of scalar values
+    #: (:data:`Integer`, :data:`Float`, :data:`Boolean`, :data:`String`,
+    #: :data:`DateTime` and :data:`Binary`) are cached. Set it to 0 to
+    #: disable the cache.
+    cache_size = 256
 
     def __init__(self, param):
         if type(param) == list:
             param = OrderedDict(param)
         self.param = param
+        self._fields = None
+        self._cache = {}
 
     def assemble(self, datum):
         # Use Werkzeug to turn URL params into a dict
@@ -279,32 +386,65 @@ class URLParams(ParametrizedWrapper):
     def disassemble(self, datum):
         return url_encode(self.to_multi_dict(datum))
 
+    def compile_fields(self):
+        """Returns a list of tuples of name, required flag, schema, whether
+        the value is sent unquoted and whether the parsed value is immutable
+        for each field, worked out on the first call only.
+        """
+        if self._fields is None:
+            from .tools import is_string_type
+            scalars = (Integer, Float, Boolean, String, DateTime, Binary)
+            self._fields = [
+                (name, field['required'], field['schema'],
+                 is_string_type(field['schema']), field['schema'] in scalars)
+                for name, field in self.param.items()]
+        return self._fields
+
     def from_multi_dict(self, md):
-        from .tools import is_string_type
-        # Where only a single param was
-        md = md.to_dict(flat=False)
+        fields = self.compile_fields()
+        present = []
+        missing = []
+        for field in fields:
+            name = field[0]
+            values = md.getlist(name)
+            if len(values) > 1:
+                raise ValidationError("Repeating query parameters not allowed: %s" % name)
+            if values:
+                present.append((field, values[0]))
+            elif field[1]:
+                missing.append(name)
+        if missing:
+            raise ValidationError("Missing fields", missing)
+
+        key = tuple((field[0], value) for field, value in present)
+        try:
+            return dict(self._cache[key])
+        except KeyError:
+            pass
         ret = {}
-        for name, field in self.param.items():
-            if name in md.keys():
-                if len(md[name]) > 1:
-                    raise ValidationError("Repeating query parameters not allowed: %s" % name)
-                if is_string_type(field['schema']):
-                    ret[name] = md[name][0]
-                else:
-                    ret[name] = json.loads(md[name][0])
-        return Struct(self.param).from_json(ret)
+        for (name, required, schema, unquoted, scalar), value in present:
+            if not unquoted:
+                value = json.loads(value)
+            try:
+                ret[name] = schema.from_json(value)
+            except ValidationError as e:
+                e.stack.append(name)
+                raise
+
+        if self.cache_size and all(field[4] for field, _ in present):
+            if len(self._cache) >= self.cache_size:
+                self._cache.clear()
+            self._cache[key] = ret
+            ret = dict(ret)
+        return ret
 
     def to_multi_dict(self, datum):
-        from .tools import is_string_type
-
-        d = Struct(self.param).to_json(datum)
         md = MultiDict()
-        for name, field in self.param.items():
-            if name in d.keys():
-                if is_string_type(field['schema']):
-                    md[name] = d[name]
-                else:
-                    md[name] = json.dumps(d[name])
+        for name, required, schema, unquoted, scalar in self.compile_fields():
+            value = datum.get(name)
+            if value is not None:
+                value = schema.to_json(value)
+                md[name] = value if unquoted else json.dumps(value)
         return md
 
 
@@ -400,22 +540,32 @@ class APISpec(BasicWrapper):
 
     @classmethod
     def assemble(cls, datum):
-        from .tools import validate_underscore_identifier
-
         for model_name, model_spec in datum['models'].items():
-            link_names = set(model_spec['links'].keys())
-            field_names = set(model_spec['properties'].keys())
+            cls.validate_model(model_name, model_spec)
+        return datum
+
+    @staticmethod
+    def validate_model(model_name, model_spec):
+        """Checks the field and link names of a single model, raising
+        :exc:`ValidationError` if they are invalid. Used by
+        :meth:`~cosmic.api.API.model` to check each model once as it is
+        registered.
+        """
+        from .tools import validate_underscore_identifier
 
-            if link_names & field_names:
-                raise ValidationError(
-                    "Model cannot contain a field and link with the same name: {}".format(model_name))
+        link_names = set(model_spec['links'].keys())
+        field_names = set(model_spec['properties'].keys())
 
-            for name in link_names | field_names:
-                validate_underscore_identifier(name)
+        if link_names & field_names:
+            raise ValidationError(
+                "Model cannot contain a field and link with the same name: {}".format(model_name))
 
-            if 'id' in link_names | field_names:
-                raise ValidationError("'id' is a reserved name.")
+        for name in link_names | field_names:
+            validate_underscore_identifier(name)
 
-        return datum
+        if 'id' in link_names | field_names:
+            raise ValidationError("'id' is a reserved name.")
 
 
+type_registry.update((cls.type_name, cls) for cls in [
+    APISpec, Model, Link, Representation, Patch, Stream])
@@ -7,7 +7,7 @@ from werkzeug.test import Client as TestClient
 from cosmic.http import Server
 from cosmic.globals import cosmos
 from cosmic.client import APIClient, ClientLoggingMixin
-from cosmic.testing import served_api, Wildcard
+from cosmic.testing import served_api, served_apis, Wildcard
 from cosmic.types import *
 from words import words
 
@@ -34,10 +34,10 @@ class TestWords(TestCase):
 class TestWordsSystem(TestCase):
 
     def test_single_thread(self):
-        with served_api(words, 5003):
+        with served_api(words) as url:
 
             class WordsClient(APIClient):
-                base_url = 'http://127.0.0.1:5003'
+                base_url = url
 
             c = WordsClient()
             p = Process(target=c.actions.lock_thread, args=(1,))
@@ -46,10 +46,10 @@ class TestWordsSystem(TestCase):
             p.terminate()
 
     def test_multi_thread(self):
-        with served_api(words, 5002, threaded=True):
+        with served_api(words, threaded=True) as url:
 
             class WordsClient(APIClient):
-                base_url = 'http://127.0.0.1:5002'
+                base_url = url
 
             c = WordsClient()
             p = Process(target=c.actions.lock_thread, args=(1,))
@@ -58,19 +58,19 @@ class TestWordsSystem(TestCase):
             p.terminate()
 
     def test_system(self):
-        with served_api(words, 5000):
+        with served_api(words) as url:
 
             class WordsClient(APIClient):
-                base_url = 'http://127.0.0.1:5000'
+                base_url = url
 
             c = WordsClient()
             self.assertEqual(APISpec.to_json(c.spec), APISpec.to_json(words.spec))
 
     def test_logging(self):
-        with served_api(words, 5001):
+        with served_api(words) as url:
 
             class WordsClient(ClientLoggingMixin, APIClient):
-                base_url = 'http://127.0.0.1:5001'
+                base_url = url
 
             c = WordsClient()
             c.actions.pluralize('pencil')
@@ -91,7 +91,30 @@ class TestWordsSystem(TestCase):
                 ]
             })
 
+    def test_several_servers(self):
+        with served_apis([words, words]) as urls:
+            self.assertNotEqual(urls[0], urls[1])
 
+            class WordsClient(APIClient):
+                base_url = urls[1]
+
+            self.assertEqual(WordsClient().actions.pluralize('cat'), 'cats')
 
+    def test_shared_server(self):
+        with served_apis([words], shared=True) as urls:
+            pass
+        with served_apis([words], shared=True) as again:
+            self.assertEqual(again, urls)
+
+            class WordsClient(APIClient):
+                base_url = urls[0]
 
+            self.assertEqual(WordsClient().actions.pluralize('cat'), 'cats')
 
+    def test_unix_socket(self):
+        import os
+        import tempfile
+        path = os.path.join(tempfile.mkdtemp(), 'words.sock')
+        with served_api(words, host='unix://' + path) as url:
+            self.assertEqual(url, 'unix://' + path)
+            self.assertTrue(os.path.exists(path))
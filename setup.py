@@ -54,6 +54,12 @@ setup(
         'requests>=2.2.0',
         'isodate>=0.5.1',
     ],
+    entry_points={
+        'console_scripts': ['cosmic = cosmic.serving:main'],
+    },
+    extras_require={
+        'msgpack': ['msgpack>=0.6.0'],
+    },
     classifiers=[
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: MIT License',
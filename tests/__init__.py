@@ -0,0 +1,55 @@
+from unittest2 import TestCase
+
+from werkzeug.wrappers import Response
+from werkzeug.test import Client as TestClient
+
+from cosmic.http import Server
+from cosmic.client import WsgiAPIClient
+from cosmic.globals import cosmos
+
+
+class ServerTestCase(TestCase):
+    """Serves the API built by :meth:`make_api` within a cosmos of its own,
+    available as :attr:`cosmos`. :attr:`client` is a Werkzeug test client
+    for the server. If :attr:`uses_remote` is set, :attr:`remote` is a
+    :class:`WsgiAPIClient` for it, registered in :attr:`remote_cosmos`.
+    """
+    #: Keyword arguments for :class:`Server`
+    server_options = {}
+    #: Whether to make :attr:`remote`
+    uses_remote = False
+    #: Attributes of the client class of :attr:`remote`
+    client_options = {}
+
+    def setUp(self):
+        self.cosmos = {}
+        with cosmos.swap(self.cosmos):
+            self.api = self.make_api()
+            self.server = self.make_server(self.api)
+        self.app = self.server.wsgi_app
+        self.client = TestClient(self.app, response_wrapper=Response)
+        self.remote_cosmos = {}
+        if self.uses_remote:
+            with cosmos.swap(self.remote_cosmos):
+                self.remote = self.make_remote(self.app)
+
+    def make_api(self):
+        raise NotImplementedError
+
+    def make_server(self, api):
+        return Server(api, **self.server_options)
+
+    def make_remote(self, app, base=WsgiAPIClient):
+        """Returns a client of the WSGI *app*, which serves the API of
+        :attr:`cosmos`. Call it within the cosmos the client should register
+        its API in.
+        """
+        attrs = dict(self.client_options,
+                     wsgi_app=staticmethod(app),
+                     server_cosmos=self.cosmos)
+        return type('RemoteClient', (base,), attrs)()
+
+    def request(self, *args, **kwargs):
+        """Makes a request with :attr:`client` within :attr:`cosmos`."""
+        with cosmos.swap(self.cosmos):
+            return self.client.open(*args, **kwargs)
@@ -1,5 +1,5 @@
 import json
-from unittest2 import TestCase
+from unittest2 import TestCase, skipIf
 
 from werkzeug.wrappers import Response
 from werkzeug.test import Client as TestClient
@@ -9,6 +9,7 @@ from cosmic.http import Server
 from cosmic.models import BaseModel
 from cosmic.globals import cosmos
 from cosmic.types import *
+from cosmic.tools import trusted_serializer
 
 
 cookbook_spec = {
@@ -245,6 +246,48 @@ class TestAPI(TestCase):
         res = self.client.post('/spec.json')
         self.assertEqual(res.status_code, 404)
 
+    def test_freeze(self):
+        from cosmic.exceptions import SpecError
+
+        self.cookbook.freeze()
+        res = self.client.get('/spec.json')
+        self.assertEqual(json.loads(res.data), cookbook_spec)
+        with self.assertRaisesRegexp(SpecError, "frozen"):
+            @self.cookbook.action()
+            def boil():
+                pass
+        with self.assertRaisesRegexp(SpecError, "frozen"):
+            @self.cookbook.model
+            class Pot(BaseModel):
+                pass
+        self.assertNotIn(u"boil", self.cookbook.spec['actions'])
+
+    def test_freeze_checks_links(self):
+        from cosmic.exceptions import SpecError
+
+        @self.cookbook.model
+        class Step(BaseModel):
+            links = [
+                required_link(u"recipe", Model('cookbook.Recipe')),
+                optional_link(u"next", Model('cookbook.Stage')),
+            ]
+
+        with self.assertRaisesRegexp(SpecError, "cookbook.Stage"):
+            self.cookbook.freeze()
+
+        @self.cookbook.model
+        class Stage(BaseModel):
+            pass
+
+        self.cookbook.freeze()
+
+    def test_invalid_model(self):
+        with self.assertRaisesRegexp(ValidationError, "reserved"):
+            @self.cookbook.model
+            class Ingredient(BaseModel):
+                properties = [required(u"id", String)]
+        self.assertNotIn(u"Ingredient", self.cookbook.spec['models'])
+
     def test_wrong_content_type(self):
         res = self.client.post('/actions/cabbage', data="1", content_type="application/xml")
         self.assertEqual(res.status_code, 400)
@@ -264,3 +307,246 @@ class TestAPI(TestCase):
     def test_schema(self):
         APISpec.from_json(APISpec.to_json(self.cookbook.spec))
 
+    def test_trusted_output(self):
+        server = Server(self.cookbook, trusted_output=True)
+        client = TestClient(server.wsgi_app, response_wrapper=Response)
+        data = json.dumps({"spicy": False, "capitalize": True})
+        res = client.post('/actions/cabbage', data=data, content_type="application/json")
+        self.assertEqual(res.data, '"Sauerkraut"')
+        rep = (u"1", {u"name": u"pancake"})
+        self.assertEqual(
+            trusted_serializer(Representation(Model('cookbook.Recipe')))(rep),
+            Representation(Model('cookbook.Recipe')).to_json(rep))
+
+    def test_trusted_output_forward_reference(self):
+        with cosmos.swap({}):
+            zoo = API(u'zoo')
+
+            # Registered before the model it returns
+            @zoo.action(returns=Representation(Model('zoo.Animal')))
+            def mascot():
+                return (u"0", {u"name": u"Koala"})
+
+            @zoo.model
+            class Animal(BaseModel):
+                properties = [required(u"name", String)]
+
+            client = TestClient(Server(zoo, trusted_output=True).wsgi_app,
+                                response_wrapper=Response)
+            res = client.post('/actions/mascot', data='')
+        self.assertEqual(json.loads(res.data), {
+            u"_links": {u"self": {u"href": u"/Animal/0"}},
+            u"name": u"Koala",
+        })
+
+    def test_trusted_output_overrides(self):
+        self.cookbook.action_options['cabbage']['trusted_output'] = False
+        self.assertFalse(Server(self.cookbook, trusted_output=True).is_trusted(False))
+        self.assertTrue(Server(self.cookbook).is_trusted(True))
+        self.assertFalse(Server(self.cookbook, debug=True).is_trusted(True))
+
+    def test_trusted_output_sampling(self):
+        mismatches = []
+
+        class SamplingServer(Server):
+            def build_response(self, endpoint, func_input, func_output):
+                if endpoint.trusted_output:
+                    func_output = func_output.upper()
+                return super(SamplingServer, self).build_response(
+                    endpoint, func_input, func_output)
+
+            def trusted_output_mismatch_hook(self, endpoint, trusted, full):
+                mismatches.append((trusted.data, full.data))
+
+        server = SamplingServer(self.cookbook, trusted_output=True,
+                                output_sample_rate=2)
+        client = TestClient(server.wsgi_app, response_wrapper=Response)
+        data = json.dumps({"spicy": True})
+        res = client.post('/actions/cabbage', data=data, content_type="application/json")
+        self.assertEqual(res.data, '"KIMCHI"')
+        res = client.post('/actions/cabbage', data=data, content_type="application/json")
+        self.assertEqual(res.data, '"kimchi"')
+        self.assertEqual(mismatches, [('"KIMCHI"', '"kimchi"')])
+
+    def test_trusted_output_sampling_generator(self):
+        with cosmos.swap({}):
+            things = API(u'things')
+
+            @things.model
+            class Thing(BaseModel):
+                methods = ["get_list"]
+                properties = [required(u"name", String)]
+
+                @classmethod
+                def get_list(cls):
+                    return ((str(i), {u"name": u"x"}) for i in range(3))
+
+            server = Server(things, trusted_output=True, output_sample_rate=1)
+            client = TestClient(server.wsgi_app, response_wrapper=Response)
+            res = client.get('/Thing')
+        self.assertEqual(len(json.loads(res.data)[u"_embedded"][u"Thing"]), 3)
+
+
+
+class TestBinaryActions(TestCase):
+
+    def setUp(self):
+        from cosmic.client import WsgiAPIClient
+
+        self.cosmos = {}
+        with cosmos.swap(self.cosmos):
+            self.images = images = API(u'images')
+
+            @images.action(accepts=Binary, returns=Binary)
+            def invert(data):
+                return b"".join(chr(255 - ord(c)) for c in data)
+
+            self.received = received = []
+
+            @images.action(accepts=Stream, returns=Stream)
+            def reverse(data):
+                import tempfile
+                received.append(type(data).__name__)
+                f = tempfile.TemporaryFile()
+                f.write(data.read()[::-1])
+                f.seek(0)
+                return f
+
+            self.app = Server(images).wsgi_app
+
+        self.client = TestClient(self.app, response_wrapper=Response)
+
+        self.remote_cosmos = {}
+        with cosmos.swap(self.remote_cosmos):
+            class ImagesClient(WsgiAPIClient):
+                wsgi_app = self.app
+                server_cosmos = self.cosmos
+
+            self.remote = ImagesClient()
+
+    def test_raw_request_and_response(self):
+        res = self.client.post('/actions/invert', data=b"\x00\x10",
+                               content_type="application/octet-stream",
+                               headers={"Accept": "application/octet-stream"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/octet-stream")
+        self.assertEqual(res.data, b"\xff\xef")
+
+    def test_json_for_old_clients(self):
+        res = self.client.post('/actions/invert', data='"ABA="',
+                               content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/json")
+        self.assertEqual(res.data, '"/+8="')
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            request = self.remote.build_request(
+                self.remote.actions.invert.args[0], b"\x00\x10")
+            self.assertEqual(request.data, b"\x00\x10")
+            self.assertEqual(request.headers["Content-Type"], "application/octet-stream")
+            self.assertEqual(self.remote.actions.invert(b"\x00\x10"), b"\xff\xef")
+            self.assertEqual(self.remote.actions.invert(b""), b"")
+
+    def test_stream_raw(self):
+        res = self.client.post('/actions/reverse', data=b"abc",
+                               content_type="application/octet-stream",
+                               headers={"Accept": "application/octet-stream"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Content-Length"], "3")
+        self.assertEqual(res.data, b"cba")
+        self.assertEqual(self.received, ["MappedFile"])
+
+    def test_stream_json(self):
+        res = self.client.post('/actions/reverse', data='"YWJj"',
+                               content_type="application/json")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, '"Y2Jh"')
+
+    def test_stream_client(self):
+        import io
+        with cosmos.swap(self.remote_cosmos):
+            out = self.remote.actions.reverse(io.BytesIO(b"abc"))
+            self.assertEqual(out.read(), b"cba")
+            out = self.remote.actions.reverse(iter([b"ab", b"c"]))
+            self.assertEqual(out.read(), b"cba")
+
+    def test_spool_stream(self):
+        import io
+        from cosmic.http import spool_stream
+        data, size = spool_stream(io.BytesIO(b"x" * 100000))
+        self.assertEqual(size, 100000)
+        self.assertEqual(data[:3], b"xxx")
+        data, size = spool_stream(io.BytesIO(b""))
+        self.assertEqual((data.read(), size), (b"", 0))
+
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+@skipIf(msgpack is None, "msgpack is not installed")
+class TestWireFormats(TestCase):
+
+    def setUp(self):
+        from cosmic.client import WsgiAPIClient
+
+        self.cosmos = {}
+        with cosmos.swap(self.cosmos):
+            self.files = files = API(u'files')
+
+            schema = Struct([
+                required(u"name", String),
+                required(u"content", Binary),
+            ])
+
+            @files.action(accepts=schema, returns=schema)
+            def upper(name, content):
+                return {"name": name.upper(), "content": content.upper()}
+
+            self.app = Server(files).wsgi_app
+
+        self.client = TestClient(self.app, response_wrapper=Response)
+
+        self.remote_cosmos = {}
+        with cosmos.swap(self.remote_cosmos):
+            class FilesClient(WsgiAPIClient):
+                wsgi_app = self.app
+                server_cosmos = self.cosmos
+                wire_format = "application/msgpack"
+
+            self.remote = FilesClient()
+
+    def test_msgpack(self):
+        data = msgpack.packb({u"name": u"a", u"content": b"\x00b"},
+                             use_bin_type=True)
+        res = self.client.post('/actions/upper', data=data,
+                               content_type="application/msgpack",
+                               headers={"Accept": "application/msgpack"})
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "application/msgpack")
+        self.assertEqual(msgpack.unpackb(res.data, raw=False),
+                         {u"name": u"A", u"content": b"\x00B"})
+
+    def test_json_by_default(self):
+        data = msgpack.packb({u"name": u"a", u"content": b"b"},
+                             use_bin_type=True)
+        res = self.client.post('/actions/upper', data=data,
+                               content_type="application/msgpack")
+        self.assertEqual(res.mimetype, "application/json")
+        self.assertEqual(json.loads(res.data), {"name": "A", "content": "Qg=="})
+
+    def test_invalid_msgpack(self):
+        res = self.client.post('/actions/upper', data="\xc1",
+                               content_type="application/msgpack")
+        self.assertEqual(res.status_code, 400)
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            request = self.remote.build_request(
+                self.remote.actions.upper.args[0], name=u"a", content=b"\x00b")
+            self.assertEqual(request.headers["Content-Type"], "application/msgpack")
+            self.assertEqual(self.remote.actions.upper(name=u"a", content=b"\x00b"),
+                             {"name": u"A", "content": b"\x00B"})
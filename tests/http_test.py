@@ -1,9 +1,27 @@
+import io
+import json
+import time
+import threading
 from datetime import datetime
 
+import requests
 from unittest2 import TestCase
+from werkzeug.wrappers import Response
+from werkzeug.test import Client as TestClient
+from werkzeug.urls import url_decode, url_encode
 
+from cosmic.api import API
+from cosmic.http import Server, Admission, EmbeddedLink, StreamListEndpoint
+from cosmic.models import BaseModel
+from cosmic.client import WsgiAPIClient
+from cosmic.formats import iter_json_array
+from cosmic.globals import cosmos, deadline, time_remaining, ThreadLocalDict
+from cosmic.exceptions import HTTPError, NotFound, SpecError, \
+    DeadlineExceeded
 from cosmic.types import *
 
+from tests import ServerTestCase
+
 
 class TestURLParams(TestCase):
     def setUp(self):
@@ -41,4 +59,1049 @@ class TestURLParams(TestCase):
         with self.assertRaises(ValidationError):
             self.schema.from_json('foo=Wha&bars=[1]&foo=Bing')
 
+    def test_missing(self):
+        with self.assertRaisesRegexp(ValidationError, "Missing fields"):
+            self.schema.from_json('foo=Wha')
+
+    def test_cache(self):
+        schema = URLParams([
+            optional("name", String),
+            optional("age", Integer),
+        ])
+        first = schema.from_json('name=Bob&age=3')
+        first["name"] = "Alice"
+        self.assertEqual(schema.from_json('age=3&name=Bob'),
+                         {"name": "Bob", "age": 3})
+        self.assertEqual(len(schema._cache), 1)
+        with self.assertRaisesRegexp(ValidationError, "Invalid Integer"):
+            schema.from_json('age=true')
+
+    def test_no_cache_for_containers(self):
+        first = self.schema.from_json('bars=[1,2]')
+        first["bars"].append(3)
+        self.assertEqual(self.schema.from_json('bars=[1,2]'), {"bars": [1, 2]})
+        self.assertEqual(self.schema._cache, {})
+
+
+
+
+class TestDateTime(TestCase):
+
+    def test_fast_path_matches_isodate(self):
+        import isodate
+        for s in [u'2013-10-18T01:58:24',
+                  u'2013-10-18T01:58:24.904349',
+                  u'2013-10-18T01:58:24.5Z',
+                  u'2013-10-18T01:58:24-05:30',
+                  u'2013-10-18T01:58:24.1234567+01:00',
+                  u'20131018T015824Z']:
+            d = DateTime.from_json(s)
+            self.assertEqual(d, isodate.parse_datetime(s))
+            self.assertEqual(d.utcoffset(), isodate.parse_datetime(s).utcoffset())
+
+    def test_invalid(self):
+        with self.assertRaisesRegexp(ValidationError, "month"):
+            DateTime.from_json(u'2013-13-18T01:58:24')
+        with self.assertRaises(ValidationError):
+            DateTime.from_json(u'yesterday')
+
+    def test_cache(self):
+        s = u'2014-01-01T00:00:00Z'
+        self.assertIs(DateTime.from_json(s), DateTime.from_json(s))
+        old, DateTime.cache_size = DateTime.cache_size, 0
+        try:
+            DateTime._cache.clear()
+            self.assertIsNot(DateTime.from_json(s), DateTime.from_json(s))
+        finally:
+            DateTime.cache_size = old
+
+
+class TestSchemaHashing(TestCase):
+
+    def test_structural_equality(self):
+        a = Struct([required(u"x", Array(Integer)), optional(u"y", Map(String))])
+        b = Struct([required(u"x", Array(Integer)), optional(u"y", Map(String))])
+        self.assertEqual(a, b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertNotEqual(a, Struct([required(u"x", Array(Float))]))
+        self.assertNotEqual(Array(Integer), Map(Integer))
+        self.assertEqual(len(set([Link(Model("a.B")), Link(Model("a.B"))])), 1)
+
+    def test_from_json_interns(self):
+        j = {"type": "Array", "param": {"type": "Map", "param": {"type": "Integer"}}}
+        self.assertIs(Schema.from_json(j), Schema.from_json(j))
+
+    def test_from_json_cosmos_dependent(self):
+        j = {"type": "Array", "param": {
+            "type": "cosmic.Representation", "param": "t.Thing"}}
+        # Kept alive, so that they could be interned
+        schemas = []
+        for props, datum in [([required(u"a", String)], {u"a": u"x"}),
+                             ([required(u"b", Integer)], {u"b": 1})]:
+            with cosmos.swap({}):
+                t = API(u't')
+
+                @t.model
+                class Thing(BaseModel):
+                    properties = props
+
+                schemas.append(Schema.from_json(j))
+                self.assertEqual(schemas[-1].from_json([datum]),
+                                 [(None, datum)])
+
+    def test_box_hash(self):
+        self.assertEqual(hash(Box({"a": 1, "b": 2})), hash(Box({"b": 2, "a": 1})))
+
+
+class TestCoalescing(ServerTestCase):
+    server_options = {"coalesce": True}
+
+    def make_api(self):
+        self.calls = calls = []
+        quotes = API(u'quotes')
+
+        @quotes.action(accepts=String, returns=String, pure=True)
+        def quote(symbol):
+            calls.append(symbol)
+            time.sleep(0.2)
+            return symbol.lower()
+
+        @quotes.action(accepts=String, returns=String)
+        def buy(symbol):
+            calls.append(symbol)
+            time.sleep(0.2)
+            return symbol
+
+        @quotes.model
+        class Stock(BaseModel):
+            methods = ["get_by_id"]
+            properties = [
+                required(u"price", Integer),
+            ]
+
+            @classmethod
+            def get_by_id(cls, id):
+                calls.append(id)
+                time.sleep(0.2)
+                return {"price": 1}
+
+        return quotes
+
+    def request_concurrently(self, n, *args, **kwargs):
+        responses = []
+
+        def request():
+            client = TestClient(self.app, response_wrapper=Response)
+            with cosmos.swap(self.cosmos):
+                responses.append(client.open(*args, **kwargs))
+
+        threads = [threading.Thread(target=request) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return responses
+
+    def test_get_by_id(self):
+        responses = self.request_concurrently(5, '/Stock/1')
+        self.assertEqual(self.calls, ["1"])
+        self.assertEqual([r.status_code for r in responses], [200] * 5)
+        self.assertEqual(set(r.data for r in responses),
+                         set(['{"price": 1, "_links": {"self": {"href": "/Stock/1"}}}']))
+
+    def test_pure_action(self):
+        responses = self.request_concurrently(
+            5, '/actions/quote', method='POST', data='"ABC"',
+            content_type="application/json")
+        self.assertEqual(self.calls, ["ABC"])
+        self.assertEqual([r.data for r in responses], ['"abc"'] * 5)
+
+    def test_impure_action(self):
+        self.request_concurrently(
+            3, '/actions/buy', method='POST', data='"ABC"',
+            content_type="application/json")
+        self.assertEqual(self.calls, ["ABC"] * 3)
+
+
+class TestResponseCache(ServerTestCase):
+
+    def make_api(self):
+        self.calls = calls = []
+        words = API(u'words')
+
+        @words.action(accepts=String, returns=String, cache=True,
+                      cache_size=2)
+        def pluralize(word):
+            calls.append(word)
+            return word + "s"
+
+        @words.action(accepts=String, returns=String, cache=True,
+                      cache_ttl=0.05)
+        def upper(word):
+            calls.append(word)
+            return word.upper()
+
+        @words.action(accepts=Struct([
+            required(u"first", String),
+            required(u"second", String),
+        ]), returns=String, cache=True)
+        def join(first, second):
+            calls.append(first)
+            return first + second
+
+        return words
+
+    def make_server(self, api):
+        class AuthServer(Server):
+            def parse_request(self, endpoint, request, **url_args):
+                if request.headers.get('X-Secret') != "1":
+                    raise HTTPError(401, "Unauthorized")
+                return super(AuthServer, self).parse_request(
+                    endpoint, request, **url_args)
+
+        return AuthServer(api)
+
+    def call(self, action, word, secret="1"):
+        return self.client.post('/actions/%s' % action, data='"%s"' % word,
+                                content_type="application/json",
+                                headers={"X-Secret": secret})
+
+    def test_hits(self):
+        for i in range(3):
+            res = self.call('pluralize', 'cat')
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(res.data, '"cats"')
+            self.assertEqual(res.mimetype, "application/json")
+        self.call('pluralize', 'dog')
+        self.assertEqual(self.calls, ["cat", "dog"])
+        self.assertEqual(self.api.cache_stats()['pluralize'],
+                         {"hits": 2, "misses": 2, "evictions": 0, "size": 2})
+
+    def test_eviction_and_invalidation(self):
+        for word in ['a', 'b', 'c', 'a']:
+            self.call('pluralize', word)
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'a'])
+        self.api.invalidate_cache('pluralize')
+        self.call('pluralize', 'a')
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'a', 'a'])
+
+    def test_ttl(self):
+        self.call('upper', 'a')
+        self.call('upper', 'a')
+        time.sleep(0.1)
+        self.call('upper', 'a')
+        self.assertEqual(self.calls, ['a', 'a'])
+
+    def test_hooks_still_run(self):
+        self.call('pluralize', 'cat')
+        res = self.call('pluralize', 'cat', secret="2")
+        self.assertEqual(res.status_code, 401)
+
+    def test_canonical_key(self):
+        bodies = [
+            '{"first": "a", "second": "b"}',
+            '{"second":"b","first":"a"}',
+            ' {\n"first" : "a",  "second": "b"}\n',
+        ]
+        for body in bodies:
+            res = self.client.post('/actions/join', data=body,
+                                   content_type="application/json",
+                                   headers={"X-Secret": "1"})
+            self.assertEqual(res.data, '"ab"')
+        self.assertEqual(self.calls, ["a"])
+        self.assertEqual(len(self.api.response_caches['join']), 1)
+
+    def test_errors_not_cached(self):
+        self.client.post('/actions/pluralize', data='1',
+                         content_type="application/json",
+                         headers={"X-Secret": "1"})
+        self.assertEqual(len(self.api.response_caches['pluralize']), 0)
+
+
+class TestAdmission(ServerTestCase):
+    server_options = {"max_queue_time": 0.05, "retry_after": 3}
+
+    def make_api(self):
+        reports = API(u'reports')
+
+        @reports.action(returns=Integer, max_concurrency=1)
+        def export():
+            time.sleep(0.2)
+            return 1
+
+        @reports.action(returns=Integer)
+        def ping():
+            return 1
+
+        return reports
+
+    def post_concurrently(self, *urls):
+        responses = {}
+
+        def request(url):
+            client = TestClient(self.app, response_wrapper=Response)
+            with cosmos.swap(self.cosmos):
+                responses.setdefault(url, []).append(client.post(url))
+
+        threads = [threading.Thread(target=request, args=(url,)) for url in urls]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return responses
+
+    def test_bulkhead(self):
+        responses = self.post_concurrently(
+            '/actions/export', '/actions/export', '/actions/ping')
+        codes = sorted(r.status_code for r in responses['/actions/export'])
+        self.assertEqual(codes, [200, 503])
+        rejected = [r for r in responses['/actions/export'] if r.status_code == 503]
+        self.assertEqual(rejected[0].headers['Retry-After'], '3')
+        self.assertEqual(responses['/actions/ping'][0].status_code, 200)
+
+    def test_priority(self):
+        gate = Admission(1)
+        self.assertTrue(gate.acquire())
+        order = []
+
+        def wait(priority):
+            gate.acquire(priority)
+            order.append(priority)
+            gate.release()
+
+        low = threading.Thread(target=wait, args=(2,))
+        low.start()
+        time.sleep(0.05)
+        high = threading.Thread(target=wait, args=(0,))
+        high.start()
+        time.sleep(0.05)
+        gate.release()
+        low.join()
+        high.join()
+        self.assertEqual(order, [0, 2])
+        self.assertEqual(gate.stats, {"admitted": 3, "rejected": 0})
+        closed = Admission(0)
+        self.assertFalse(closed.acquire(timeout=0.01))
+        self.assertEqual(closed.stats, {"admitted": 0, "rejected": 1})
+
+
+class TestDeadlines(ServerTestCase):
+    uses_remote = True
+    client_options = {"timeout": 5}
+
+    def make_api(self):
+        self.calls = calls = []
+        quotes = API(u'quotes')
+
+        @quotes.action(returns=Float)
+        def budget():
+            calls.append(1)
+            remaining = time_remaining()
+            return -1.0 if remaining is None else remaining
+
+        return quotes
+
+    def test_budget_header(self):
+        res = self.client.post('/actions/budget',
+                               headers={"X-Request-Timeout": "2.5"})
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(0 < json.loads(res.data) <= 2.5)
+
+    def test_no_budget(self):
+        for headers in [{}, {"X-Request-Timeout": "soon"}]:
+            res = self.client.post('/actions/budget', headers=headers)
+            self.assertEqual(json.loads(res.data), -1.0)
+
+    def test_expired(self):
+        res = self.client.post('/actions/budget',
+                               headers={"X-Request-Timeout": "-0.1"})
+        self.assertEqual(res.status_code, 504)
+        self.assertEqual(self.calls, [])
+
+    def test_client_timeout(self):
+        with cosmos.swap(self.remote_cosmos):
+            self.assertTrue(0 < self.remote.actions.budget() <= 5)
+            with deadline(1):
+                self.assertTrue(0 < self.remote.actions.budget() <= 1)
+            with deadline(60):
+                self.assertTrue(self.remote.actions.budget() <= 5)
+
+    def test_client_expired(self):
+        with cosmos.swap(self.remote_cosmos):
+            with deadline(-1):
+                with self.assertRaises(DeadlineExceeded):
+                    self.remote.actions.budget()
+        self.assertEqual(self.calls, [])
+
+    def test_client_budget_rounds_to_zero(self):
+        sent = []
+        self.remote.make_request = lambda endpoint, request: sent.append(
+            request.headers["X-Request-Timeout"])
+        with cosmos.swap(self.remote_cosmos):
+            with deadline(0.0004):
+                with self.assertRaises(DeadlineExceeded):
+                    self.remote.actions.budget()
+        self.assertEqual(sent, [])
+
+
+class TestFieldProjection(ServerTestCase):
+    uses_remote = True
+
+    def make_api(self):
+        self.calls = calls = []
+        places = API(u'places')
+
+        @places.model
+        class Country(BaseModel):
+            methods = ["get_by_id"]
+            properties = [required(u"code", String)]
+
+        @places.model
+        class City(BaseModel):
+            methods = ["get_by_id", "get_list"]
+            properties = [
+                required(u"name", String),
+                required(u"population", Integer),
+                optional(u"founded", Integer),
+            ]
+            links = [
+                required_link(u"country", Model('places.Country')),
+            ]
+            query_fields = [
+                optional(u"country", String),
+            ]
+            accepts_fields = True
+
+            @classmethod
+            def get_by_id(cls, id, fields=None):
+                calls.append(fields)
+                return {u"name": u"Toronto", u"population": 2600000,
+                        u"country": u"0"}
+
+            @classmethod
+            def get_list(cls, fields=None, **query):
+                calls.append(fields)
+                return [("0", cls.get_by_id("0"))]
+
+        return places
+
+    def get(self, url):
+        with cosmos.swap(self.cosmos):
+            return self.client.get(url)
+
+    def test_get_by_id(self):
+        res = self.get('/City/0?fields=name,country')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), {
+            u"_links": {
+                u"self": {u"href": u"/City/0"},
+                u"country": {u"href": u"/Country/0"},
+            },
+            u"name": u"Toronto",
+        })
+        self.assertEqual(self.calls[-1], (u"country", u"name"))
+
+        res = self.get('/City/0')
+        self.assertEqual(set(json.loads(res.data).keys()),
+                         set([u"_links", u"name", u"population"]))
+        self.assertEqual(self.calls[-1], None)
+
+    def test_get_list(self):
+        res = self.get('/City?country=0&fields=population')
+        body = json.loads(res.data)
+        self.assertEqual(body[u"_links"][u"self"][u"href"],
+                         u"/City?country=0&fields=population")
+        self.assertEqual(body[u"_embedded"][u"City"], [{
+            u"_links": {u"self": {u"href": u"/City/0"}},
+            u"population": 2600000,
+        }])
+
+    def test_unknown_field(self):
+        res = self.get('/City/0?fields=name,mayor')
+        self.assertEqual(res.status_code, 400)
+
+    def test_trusted_output(self):
+        with cosmos.swap(self.cosmos):
+            client = TestClient(Server(self.api, trusted_output=True).wsgi_app,
+                                response_wrapper=Response)
+            res = client.get('/City/0?fields=name')
+        self.assertEqual(json.loads(res.data), {
+            u"_links": {u"self": {u"href": u"/City/0"}},
+            u"name": u"Toronto",
+        })
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            City = self.remote.models.City
+            self.assertEqual(City.get_by_id("0", fields=[u"name"]),
+                             {u"name": u"Toronto"})
+            self.assertEqual(City.get_list(country=u"0", fields=[u"population"]),
+                             [("0", {u"population": 2600000})])
+            self.assertEqual(City.get_list(fields=[u"name"]),
+                             [("0", {u"name": u"Toronto"})])
+            self.assertEqual(City.get_by_id("0")[u"population"], 2600000)
+
+    def test_client_old_server(self):
+        def old_app(environ, start_response):
+            # Answers as a server that doesn't know the fields parameter
+            args = url_decode(environ.get('QUERY_STRING', ''))
+            args.poplist('fields')
+            environ = dict(environ, QUERY_STRING=url_encode(args))
+            return self.app(environ, start_response)
+
+        with cosmos.swap({}):
+            City = self.make_remote(old_app).models.City
+            self.assertEqual(City.get_by_id("0", fields=[u"name"]),
+                             {u"name": u"Toronto"})
+            self.assertEqual(City.get_list(fields=[u"population"]),
+                             [("0", {u"population": 2600000})])
+        self.assertEqual(self.calls, [None, None, None])
+
+
+class TestEmbedding(ServerTestCase):
+    uses_remote = True
+
+    def make_api(self):
+        self.fetched = fetched = []
+        places = API(u'places')
+
+        countries = {"0": {u"code": u"CA"}, "1": {u"code": u"FR"}}
+        cities = [
+            ("0", {u"name": u"Toronto", u"country": u"0"}),
+            ("1", {u"name": u"Montreal", u"country": u"0"}),
+            ("2", {u"name": u"Paris", u"country": u"1"}),
+        ]
+
+        @places.model
+        class Country(BaseModel):
+            methods = ["get_by_id"]
+            properties = [required(u"code", String)]
+
+            @classmethod
+            def get_by_ids(cls, ids):
+                fetched.append(ids)
+                return [(id, countries[id]) for id in ids]
+
+        @places.model
+        class Mayor(BaseModel):
+            methods = []
+            properties = [required(u"name", String)]
+
+        @places.model
+        class City(BaseModel):
+            methods = ["get_by_id", "get_list"]
+            properties = [required(u"name", String)]
+            links = [
+                required_link(u"country", Model('places.Country')),
+                optional_link(u"mayor", Model('places.Mayor')),
+            ]
+
+            @classmethod
+            def get_by_id(cls, id):
+                return dict(cities)[id]
+
+            @classmethod
+            def get_list(cls):
+                return cities
+
+        return places
+
+    def get(self, url):
+        with cosmos.swap(self.cosmos):
+            return self.client.get(url)
+
+    def test_get_by_id(self):
+        res = self.get('/City/0?embed=country&fields=name')
+        self.assertEqual(json.loads(res.data), {
+            u"_links": {
+                u"self": {u"href": u"/City/0"},
+                u"country": {u"href": u"/Country/0"},
+            },
+            u"_embedded": {
+                u"country": {
+                    u"_links": {u"self": {u"href": u"/Country/0"}},
+                    u"code": u"CA",
+                },
+            },
+            u"name": u"Toronto",
+        })
+
+    def test_get_list(self):
+        res = self.get('/City?embed=country')
+        cities = json.loads(res.data)[u"_embedded"][u"City"]
+        self.assertEqual([c[u"_embedded"][u"country"][u"code"] for c in cities],
+                         [u"CA", u"CA", u"FR"])
+        # One bulk call for the distinct ids
+        self.assertEqual(self.fetched, [[u"0", u"1"]])
+
+    def test_invalid(self):
+        self.assertEqual(self.get('/City?embed=name').status_code, 400)
+        # Mayors can't be read by id
+        self.assertEqual(self.get('/City?embed=mayor').status_code, 400)
+
+    def test_default_get_by_ids(self):
+        with cosmos.swap(self.cosmos):
+            City = self.api.models.City
+            self.assertEqual(City.get_by_ids(["2", "0"]), [
+                ("2", {u"name": u"Paris", u"country": u"1"}),
+                ("0", {u"name": u"Toronto", u"country": u"0"}),
+            ])
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            City = self.remote.models.City
+            toronto = City.get_by_id("0", embed=[u"country"])
+            self.assertEqual(toronto[u"country"], u"0")
+            self.assertTrue(isinstance(toronto[u"country"], EmbeddedLink))
+            self.assertEqual(toronto[u"country"].rep, {u"code": u"CA"})
+
+            cities = City.get_list(embed=[u"country"], fields=[u"name"])
+            self.assertEqual([c[u"country"].rep[u"code"] for id, c in cities],
+                             [u"CA", u"CA", u"FR"])
+            self.assertFalse(isinstance(City.get_by_id("0")[u"country"],
+                                        EmbeddedLink))
+
+
+class TestLoader(ServerTestCase):
+    uses_remote = True
+
+    def setUp(self):
+        self.requests = []
+        super(TestLoader, self).setUp()
+
+        # Responds like servers without bulk reads
+        def old_app(environ, start_response):
+            if environ['PATH_INFO'].endswith('/_bulk'):
+                return Response("", 404)(environ, start_response)
+            return self.app(environ, start_response)
+
+        self.old_cosmos = {}
+        with cosmos.swap(self.old_cosmos):
+            self.old_remote = self.make_remote(old_app)
+        del self.requests[:]
+
+    def make_api(self):
+        places = API(u'places')
+
+        cities = {
+            "0": {u"name": u"Toronto"},
+            "1": {u"name": u"Montreal"},
+            "2": {u"name": u"Paris"},
+        }
+
+        @places.model
+        class City(BaseModel):
+            methods = ["get_by_id"]
+            properties = [required(u"name", String)]
+
+            @classmethod
+            def get_by_id(cls, id):
+                if id not in cities:
+                    raise NotFound
+                return cities[id]
+
+        return places
+
+    def make_remote(self, app):
+        requests = self.requests
+
+        class RecordingClient(WsgiAPIClient):
+            def make_request(self, endpoint, request):
+                requests.append(request.url)
+                return super(RecordingClient, self).make_request(
+                    endpoint, request)
+
+        return super(TestLoader, self).make_remote(app, base=RecordingClient)
+
+    def test_bulk(self):
+        with cosmos.swap(self.remote_cosmos):
+            City = self.remote.models.City
+            with self.remote.loader():
+                cities = [City.get_by_id(id) for id in ["0", "2", "0", "5"]]
+                self.assertEqual(self.requests, [])
+                self.assertEqual(cities[0][u"name"], u"Toronto")
+                self.assertEqual(dict(cities[1]), {u"name": u"Paris"})
+                self.assertEqual(cities[2], {u"name": u"Toronto"})
+                with self.assertRaises(NotFound):
+                    cities[3][u"name"]
+                # Cached for the rest of the block
+                self.assertEqual(City.get_by_id("2")[u"name"], u"Paris")
+            self.assertEqual(self.requests, ["/City/_bulk?id=0&id=2&id=5"])
+            self.assertEqual(City.get_by_id("1"), {u"name": u"Montreal"})
+
+    def test_batch_size(self):
+        with cosmos.swap(self.remote_cosmos):
+            self.remote.loader_batch_size = 2
+            City = self.remote.models.City
+            with self.remote.loader():
+                cities = [City.get_by_id(id) for id in ["0", "1", "2"]]
+                self.assertEqual([c[u"name"] for c in cities],
+                                 [u"Toronto", u"Montreal", u"Paris"])
+            self.assertEqual(len(self.requests), 2)
+
+    def test_fallback(self):
+        with cosmos.swap(self.old_cosmos):
+            City = self.old_remote.models.City
+            with self.old_remote.loader():
+                cities = [City.get_by_id(id) for id in ["0", "1", "5"]]
+                self.assertEqual(cities[1][u"name"], u"Montreal")
+                with self.assertRaises(NotFound):
+                    len(cities[2])
+            self.assertEqual(self.requests, [
+                "/City/_bulk?id=0&id=1&id=5", "/City/0", "/City/1", "/City/5"])
+            with self.old_remote.loader():
+                City.get_by_id("2")[u"name"]
+            # Bulk reads aren't tried again
+            self.assertEqual(self.requests[-1], "/City/2")
+
+
+class TestMinimalReturn(ServerTestCase):
+    uses_remote = True
+
+    def make_api(self):
+        places = API(u'places')
+
+        @places.model
+        class City(BaseModel):
+            methods = ["create", "update"]
+            properties = [required(u"name", String)]
+
+            @classmethod
+            def create(cls, **patch):
+                return "7", patch
+
+            @classmethod
+            def update(cls, id, **patch):
+                if id != "7":
+                    raise NotFound
+                return patch
+
+        return places
+
+    def request(self, method, url, **kwargs):
+        with cosmos.swap(self.cosmos):
+            return self.client.open(url, method=method,
+                                    data=json.dumps({"name": "Oslo"}),
+                                    content_type="application/json", **kwargs)
+
+    def test_create(self):
+        res = self.request("POST", "/City",
+                           headers={"Prefer": "respond-async, return=minimal"})
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data, "")
+        self.assertEqual(res.headers["Location"], "http://localhost/City/7")
+        self.assertEqual(res.headers["Preference-Applied"], "return=minimal")
+
+        res = self.request("POST", "/City", headers={"Prefer": "return=representation"})
+        self.assertEqual(json.loads(res.data)["name"], "Oslo")
+
+    def test_update(self):
+        res = self.request("PUT", "/City/7", headers={"Prefer": "return=minimal"})
+        self.assertEqual(res.status_code, 204)
+        self.assertEqual(res.data, "")
+        res = self.request("PUT", "/City/8", headers={"Prefer": "return=minimal"})
+        self.assertEqual(res.status_code, 404)
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            City = self.remote.models.City
+            self.assertEqual(City.create(name=u"Oslo", return_representation=False),
+                             ("7", None))
+            self.assertEqual(City.create(name=u"Oslo"), ("7", {u"name": u"Oslo"}))
+            self.assertEqual(City.update("7", name=u"Bergen",
+                                         return_representation=False), None)
+            self.assertEqual(City.update("7", name=u"Bergen"), {u"name": u"Bergen"})
+            with self.assertRaises(NotFound):
+                City.update("8", name=u"Bergen", return_representation=False)
+
+
+class TestCount(ServerTestCase):
+    uses_remote = True
+
+    def make_api(self):
+        places = API(u'places')
+
+        cities = [
+            ("0", {u"name": u"Toronto", u"country": u"CA"}),
+            ("1", {u"name": u"Montreal", u"country": u"CA"}),
+            ("2", {u"name": u"Paris", u"country": u"FR"}),
+        ]
+
+        @places.model
+        class City(BaseModel):
+            methods = ["get_list"]
+            properties = [
+                required(u"name", String),
+                required(u"country", String),
+            ]
+            query_fields = [optional(u"country", String)]
+            list_metadata = [optional(u"page", Integer)]
+
+            @classmethod
+            def get_list(cls, country=None):
+                l = [c for c in cities
+                     if country is None or c[1][u"country"] == country]
+                return l, {}
+
+        @places.model
+        class Country(BaseModel):
+            methods = ["get_list"]
+            properties = [required(u"code", String)]
+
+            @classmethod
+            def get_list(cls):
+                raise RuntimeError("Should not be called")
+
+            @classmethod
+            def count(cls):
+                return 195
+
+        return places
+
+    def test_count_only(self):
+        with cosmos.swap(self.cosmos):
+            res = self.client.get('/City?country=CA&count_only=true')
+        self.assertEqual(json.loads(res.data), {"count": 2})
+        self.assertEqual(res.headers["X-Total-Count"], "2")
+
+    def test_head(self):
+        with cosmos.swap(self.cosmos):
+            res = self.client.head('/Country')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.data, "")
+        self.assertEqual(res.headers["X-Total-Count"], "195")
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            self.assertEqual(self.remote.models.City.count(), 3)
+            self.assertEqual(self.remote.models.City.count(country=u"FR"), 1)
+            self.assertEqual(self.remote.models.Country.count(), 195)
+
+
+class TestNDJSON(ServerTestCase):
+    uses_remote = True
+
+    def make_api(self):
+        places = API(u'places')
+
+        @places.model
+        class City(BaseModel):
+            methods = ["get_list"]
+            properties = [required(u"name", String)]
+            list_metadata = [required(u"total", Integer)]
+
+            @classmethod
+            def get_list(cls):
+                names = [u"Toronto", u"Montreal", u"Paris"]
+                return [(str(i), {u"name": name})
+                        for i, name in enumerate(names)], {u"total": 3}
+
+        return places
+
+    def test_server(self):
+        with cosmos.swap(self.cosmos):
+            res = self.client.get('/City?fields=name',
+                                  headers={"Accept": "application/x-ndjson"})
+            lines = [json.loads(line) for line in res.data.splitlines()]
+        self.assertEqual(res.mimetype, "application/x-ndjson")
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0], {
+            u"_links": {u"self": {u"href": u"/City/0"}},
+            u"name": u"Toronto",
+        })
+        self.assertEqual(lines[-1], {
+            u"_links": {u"self": {u"href": u"/City?fields=name"}},
+            u"total": 3,
+        })
+
+    def test_json_by_default(self):
+        with cosmos.swap(self.cosmos):
+            res = self.client.get('/City', headers={"Accept": "*/*"})
+            self.assertEqual(res.mimetype, "application/json")
+            res = self.client.get('/City', headers={
+                "Accept": "application/json, application/x-ndjson;q=0.1"})
+            self.assertEqual(res.mimetype, "application/json")
+
+    def test_holds_admission(self):
+        with cosmos.swap(self.cosmos):
+            server = Server(self.api, max_concurrency=1)
+            client = TestClient(server.wsgi_app, response_wrapper=Response)
+            res = client.get('/City', buffered=False,
+                             headers={"Accept": "application/x-ndjson"})
+            # The lines haven't been sent yet
+            self.assertEqual(server._admission.active, 1)
+            self.assertEqual(len(list(res.response)), 4)
+            res.close()
+            self.assertEqual(server._admission.active, 0)
+
+    def test_generator(self):
+        g = ThreadLocalDict()
+        seen = []
+        with cosmos.swap({}):
+            places = API(u'places')
+
+            @places.model
+            class Country(BaseModel):
+                methods = ["get_by_id"]
+                properties = [required(u"code", String)]
+
+                @classmethod
+                def get_by_id(cls, id):
+                    return {u"code": u"CA"}
+
+            @places.model
+            class City(BaseModel):
+                methods = ["get_list"]
+                properties = [required(u"name", String)]
+                links = [required_link(u"country", Model('places.Country'))]
+
+                @classmethod
+                def get_list(cls):
+                    g['user'] = u"alice"
+
+                    def cities():
+                        for name in [u"Toronto", u"Montreal"]:
+                            # Runs while the response is being sent
+                            seen.append((g['user'], time_remaining() > 0))
+                            yield ("0", {u"name": name, u"country": u"0"})
+
+                    return cities()
+
+            client = TestClient(Server(places).wsgi_app,
+                                response_wrapper=Response)
+            res = client.get('/City', headers={
+                "Accept": "application/x-ndjson", "X-Request-Timeout": "10"})
+            lines = [json.loads(line) for line in res.data.splitlines()]
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(seen, [(u"alice", True), (u"alice", True)])
+
+            res = client.get('/City?embed=country',
+                             headers={"Accept": "application/x-ndjson"})
+            lines = [json.loads(line) for line in res.data.splitlines()]
+            self.assertEqual(len(lines), 3)
+            self.assertEqual(lines[1][u"_embedded"][u"country"][u"code"],
+                             u"CA")
+
+    def test_client(self):
+        with cosmos.swap(self.remote_cosmos):
+            stream = self.remote.models.City.get_list(stream=True)
+            self.assertEqual(next(stream), ("0", {u"name": u"Toronto"}))
+            self.assertEqual(stream.meta, None)
+            self.assertEqual([id for id, rep in stream], ["1", "2"])
+            self.assertEqual(stream.meta, {u"total": 3})
+
+    def test_incomplete(self):
+        with cosmos.swap(self.remote_cosmos):
+            endpoint = StreamListEndpoint(self.remote.spec, "City")
+            res = requests.Response()
+            res.status_code = 200
+            res.headers["Content-Type"] = "application/x-ndjson"
+            res._content = b'{"_links": {"self": {"href": "/City/0"}}, "name": "Oslo"}\n'
+            stream = endpoint.parse_response(res)
+            self.assertEqual(next(stream), ("0", {u"name": u"Oslo"}))
+            with self.assertRaises(SpecError):
+                next(stream)
+
+
+class TestStreamedItems(ServerTestCase):
+
+    def make_api(self):
+        points = API(u'points')
+        point = Struct([
+            required(u"x", Integer),
+            required(u"y", Integer),
+        ])
+        self.received = received = []
+
+        @points.action(accepts=Array(point), returns=Integer)
+        def total(points):
+            received.append(type(points))
+            return sum(p[u"x"] + p[u"y"] for p in points)
+
+        @points.action(accepts=Array(point), returns=Integer,
+                       stream_items=True)
+        def count(points):
+            received.append(type(points))
+            n = 0
+            for p in points:
+                n += 1
+            return n
+
+        @points.action(accepts=Array(Integer), returns=Integer, pure=True,
+                       cache=True)
+        def largest(numbers):
+            return max(numbers)
+
+        return points
+
+    def post(self, action, body):
+        stream = io.BytesIO(body)
+        res = self.client.post('/actions/%s' % action, input_stream=stream,
+                               content_length=len(body),
+                               content_type="application/json")
+        return res, stream.tell()
+
+    def test_list(self):
+        body = json.dumps([{"x": 1, "y": 2}, {"x": 3, "y": 4}])
+        res, read = self.post('total', body)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), 10)
+        self.assertEqual(self.received, [list])
+
+    def test_invalid_item_fails_fast(self):
+        tail = ", ".join('{"x": 1, "y": 1}' for i in range(100000))
+        body = '[{"x": 1, "y": 1}, {"x": "one", "y": 1}, %s]' % tail
+        for action in ['total', 'count']:
+            res, read = self.post(action, body)
+            self.assertEqual(res.status_code, 400)
+            self.assertIn("Invalid Integer", json.loads(res.data)['error'])
+            self.assertLess(read, len(body) / 10)
+
+    def test_malformed_item_fails_fast(self):
+        tail = ", ".join('{"x": 1, "y": 1}' for i in range(100000))
+        for item in ['{"x": 1 "y": 1}', '{"x": tru, "y": 1}', '"\\q"']:
+            body = '[{"x": 1, "y": 1}, %s, %s]' % (item, tail)
+            for action in ['total', 'count']:
+                res, read = self.post(action, body)
+                self.assertEqual(res.status_code, 400)
+                self.assertLess(read, len(body) / 10)
+
+    def test_split_values(self):
+        items = [u"caf\xe9 \\ \"x\"", -1.5e-3, None, True, False,
+                 {u"x": [1, u"\ud83d\ude00"]}]
+        body = json.dumps(items)
+        for size in range(1, 8):
+            self.assertEqual(
+                list(iter_json_array(io.BytesIO(body), chunk_size=size)),
+                json.loads(body))
+
+    def test_iterator(self):
+        body = json.dumps([{"x": 1, "y": 2}] * 1000)
+        res, read = self.post('count', body)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(json.loads(res.data), 1000)
+        self.assertNotEqual(self.received[0], list)
+
+    def test_invalid_json(self):
+        for body in ['[{"x": 1, "y": 2}', '[{"x": 1, "y": 2}] []', '{}']:
+            res, read = self.post('total', body)
+            self.assertEqual(res.status_code, 400)
+        self.assertEqual(self.received, [])
+
+    def test_empty(self):
+        res = self.client.post('/actions/total', data="",
+                               content_type="application/json")
+        self.assertEqual(res.status_code, 400)
+
+    def test_cached(self):
+        for i in range(2):
+            res, read = self.post('largest', "[3, 12, 5]")
+            self.assertEqual(res.status_code, 200)
+            self.assertEqual(json.loads(res.data), 12)
+        self.assertEqual(self.api.cache_stats()[u'largest']['hits'], 1)
 
+    def test_requires_array(self):
+        with self.assertRaises(SpecError):
+            @self.api.action(accepts=Integer, stream_items=True)
+            def double(n):
+                return n * 2
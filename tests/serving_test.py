@@ -0,0 +1,136 @@
+import os
+import socket
+import shutil
+import tempfile
+import resource
+import threading
+import signal
+from multiprocessing import Process
+from unittest2 import TestCase
+
+import requests
+
+from cosmic.api import API
+from cosmic.globals import cosmos
+from cosmic.serving import serve, bind_socket, import_api, memory_usage, \
+    PooledWSGIServer, warm_up
+from cosmic.types import *
+
+
+class TestServe(TestCase):
+
+    def setUp(self):
+        with cosmos.swap({}):
+            self.words = words = API(u'words')
+
+            @words.action(accepts=String, returns=Integer)
+            def pid(word):
+                return os.getpid()
+
+        self.sock = bind_socket()
+        self.url = 'http://%s:%s' % self.sock.getsockname()
+        self.master = Process(target=serve, args=(words,), kwargs={
+            "sock": self.sock,
+            "workers": 2,
+            "max_requests": 3,
+            "graceful_timeout": 5,
+        })
+        self.master.start()
+
+    def tearDown(self):
+        if self.master.is_alive():
+            os.kill(self.master.pid, signal.SIGKILL)
+        self.sock.close()
+
+    def test_serve(self):
+        session = requests.Session()
+        pids = set()
+        for i in range(12):
+            res = session.post(self.url + '/actions/pid', data='"x"',
+                               headers={"Content-Type": "application/json"})
+            self.assertEqual(res.status_code, 200)
+            pids.add(res.json())
+        # Workers are recycled after three requests
+        self.assertGreaterEqual(len(pids), 3)
+
+        session.close()
+        os.kill(self.master.pid, signal.SIGTERM)
+        self.master.join(10)
+        self.assertEqual(self.master.exitcode, 0)
+
+    def test_import_api(self):
+        self.assertIs(import_api('cosmic.serving:serve'), serve)
+        with self.assertRaises(ValueError):
+            import_api('cosmic.serving')
+
+
+class TestBindSocket(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.host = 'unix://' + os.path.join(self.dir, 'api.sock')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_socket_in_use(self):
+        sock = bind_socket(self.host)
+        try:
+            with self.assertRaises(socket.error):
+                bind_socket(self.host)
+        finally:
+            sock.close()
+
+    def test_stale_socket(self):
+        bind_socket(self.host).close()
+        bind_socket(self.host).close()
+
+
+class TestWorker(TestCase):
+
+    def test_memory_usage(self):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        self.assertGreater(memory_usage(), 0)
+        self.assertLessEqual(memory_usage(), peak)
+
+    def test_count_request(self):
+        sock = bind_socket()
+        try:
+            httpd = PooledWSGIServer('127.0.0.1', None, sock.fileno(),
+                                     threads=1, max_requests=4000)
+
+            def count():
+                for i in range(1000):
+                    httpd.count_request()
+            threads = [threading.Thread(target=count) for i in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(httpd.requests, 4000)
+            self.assertTrue(httpd.stopping)
+            httpd.server_close()
+        finally:
+            sock.close()
+
+    def test_warm_up(self):
+        from cosmic.http import Server, _query_schemas
+        from cosmic.models import BaseModel
+
+        with cosmos.swap({}):
+            zoo = API(u'zoo')
+
+            @zoo.action(returns=Representation(Model('zoo.Animal')))
+            def mascot():
+                return (u"0", {u"name": u"Koala"})
+
+            @zoo.model
+            class Animal(BaseModel):
+                properties = [required(u"name", String)]
+                query_fields = [optional(u"name", String)]
+
+            warm_up(Server(zoo))
+            self.assertIsNotNone(zoo.spec_json)
+            self.assertIsNotNone(zoo.action_plans[u'mascot']._trusted)
+            query_fields = zoo.spec['models'][u'Animal']['query_fields']
+            self.assertIn(id(query_fields), _query_schemas)
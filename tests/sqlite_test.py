@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from unittest2 import TestCase
+
+from cosmic.sqlite import SQLiteModel
+from cosmic.exceptions import NotFound, SpecError
+from cosmic.types import *
+
+
+class TestSQLiteModel(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        class Sphere(SQLiteModel):
+            database = os.path.join(self.dir, "test.db")
+            properties = [
+                required(u"name", String),
+                optional(u"temperature", Float),
+                optional(u"visible", Boolean),
+                optional(u"discovered", DateTime),
+            ]
+            links = [
+                optional_link(u"revolves_around", Model('planetarium.Sphere')),
+            ]
+            query_fields = [
+                optional(u"name", String),
+                optional(u"revolves_around", String),
+            ]
+
+        self.Sphere = Sphere
+        self.sun, _ = Sphere.create(name=u"Sun", visible=True)
+        self.earth, _ = Sphere.create(name=u"Earth", revolves_around=self.sun)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_get_by_id(self):
+        self.assertEqual(self.Sphere.get_by_id(self.sun),
+                         {u"name": u"Sun", u"visible": True})
+        with self.assertRaises(NotFound):
+            self.Sphere.get_by_id("100")
+        with self.assertRaises(NotFound):
+            self.Sphere.get_by_id("x")
+
+    def test_get_list(self):
+        moon, _ = self.Sphere.create(name=u"Moon", revolves_around=self.earth,
+                                     discovered=datetime(1600, 1, 1))
+        self.assertEqual([id for id, rep in self.Sphere.get_list()],
+                         [self.sun, self.earth, moon])
+        self.assertEqual(self.Sphere.get_list(revolves_around=self.earth),
+                         [(moon, {u"name": u"Moon",
+                                  u"revolves_around": self.earth,
+                                  u"discovered": datetime(1600, 1, 1)})])
+        self.assertEqual(self.Sphere.get_list(name=u"Pluto"), [])
+
+    def test_fields(self):
+        self.assertEqual(self.Sphere.get_by_id(self.earth, fields=(u"name",)),
+                         {u"name": u"Earth"})
+        self.assertEqual(
+            self.Sphere.get_list(name=u"Earth",
+                                 fields=(u"revolves_around", u"visible")),
+            [(self.earth, {u"revolves_around": self.sun})])
+
+    def test_get_by_ids(self):
+        self.Sphere.batch_size = 1
+        self.assertEqual(self.Sphere.get_by_ids([self.earth, "x", "100", self.sun]), [
+            (self.earth, {u"name": u"Earth", u"revolves_around": self.sun}),
+            (self.sun, {u"name": u"Sun", u"visible": True}),
+        ])
+
+    def test_count(self):
+        self.assertEqual(self.Sphere.count(), 2)
+        self.assertEqual(self.Sphere.count(revolves_around=self.sun), 1)
+        self.assertEqual(self.Sphere.count(name=u"Pluto"), 0)
+
+    def test_update_and_delete(self):
+        rep = self.Sphere.update(self.earth, temperature=30.0)
+        self.assertEqual(rep[u"temperature"], 30.0)
+        self.assertEqual(rep[u"revolves_around"], self.sun)
+        self.Sphere.delete(self.earth)
+        with self.assertRaises(NotFound):
+            self.Sphere.delete(self.earth)
+        with self.assertRaises(NotFound):
+            self.Sphere.update(self.earth, temperature=1.0)
+
+    def test_threads(self):
+        def create():
+            for i in range(10):
+                self.Sphere.create(name=u"Asteroid")
+        threads = [threading.Thread(target=create) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(self.Sphere.get_list(name=u"Asteroid")), 40)
+
+    def test_memory_database(self):
+        # Every thread would get a database of its own
+        with self.assertRaises(SpecError):
+            class Note(SQLiteModel):
+                database = ":memory:"
+                properties = [required(u"text", String)]
+
+        class Draft(SQLiteModel):
+            properties = [required(u"text", String)]
+
+        Draft.database = ":memory:"
+        with self.assertRaises(SpecError):
+            Draft.create(text=u"main")
+
+    def test_fork(self):
+        conn = self.Sphere._connection()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if self.Sphere._connection() is not conn else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertIs(self.Sphere._connection(), conn)
+
+    def test_unknown_query_field(self):
+        with self.assertRaisesRegexp(SpecError, "weight"):
+            class Sphere(SQLiteModel):
+                properties = [required(u"name", String)]
+                query_fields = [optional(u"weight", Float)]
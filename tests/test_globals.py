@@ -3,7 +3,8 @@ from unittest2 import TestCase
 from threading import Thread
 
 from cosmic.globals import *
-from cosmic.globals import storage
+from cosmic.globals import storage, ensure_thread_local, IdentContextVar
+from cosmic.exceptions import ThreadLocalMissing
 
 class TestSwappableDict(TestCase):
 
@@ -54,3 +55,40 @@ class TestThreadLocalDict(TestCase):
             thread.join()
 
         self.assertEqual(storage, {})
+
+    def test_nested(self):
+        s = ThreadLocalDict()
+        with thread_local():
+            s['a'] = 1
+            with thread_local():
+                self.assertEqual(dict(s), {})
+                s['b'] = 2
+            self.assertEqual(dict(s), {'a': 1})
+        with self.assertRaises(ThreadLocalMissing):
+            s['a']
+
+    def test_ensure_thread_local(self):
+        s = ThreadLocalDict()
+        with thread_local():
+            s['a'] = 1
+            with ensure_thread_local():
+                self.assertEqual(dict(s), {'a': 1})
+        with ensure_thread_local():
+            self.assertEqual(dict(s), {})
+
+
+class TestContextVar(TestCase):
+
+    def test_fallback(self):
+        var = IdentContextVar('test')
+        self.assertEqual(var.get(None), None)
+        with self.assertRaises(LookupError):
+            var.get()
+        token = var.set(1)
+        inner = var.set(2)
+        self.assertEqual(var.get(), 2)
+        var.reset(inner)
+        self.assertEqual(var.get(), 1)
+        var.reset(token)
+        self.assertEqual(var.get(None), None)
+        self.assertEqual(storage, {})
@@ -0,0 +1,82 @@
+import copy
+from unittest2 import TestCase
+
+from cosmic.testing import Table, DBModel, db
+from cosmic.types import *
+
+
+class TestTable(TestCase):
+
+    def setUp(self):
+        self.table = Table({
+            "0": {"name": u"Sun"},
+            "1": {"name": u"Earth", "revolves_around": "0"},
+            "2": {"name": u"Moon", "revolves_around": "1"},
+        }, index_fields=["revolves_around"])
+
+    def test_select(self):
+        self.assertEqual([id for id, rep in self.table.select()], ["0", "1", "2"])
+        self.assertEqual(self.table.select(revolves_around="0"),
+                         [("1", {"name": u"Earth", "revolves_around": "0"})])
+        self.assertEqual(self.table.select(name=u"Moon", revolves_around="1"),
+                         [("2", {"name": u"Moon", "revolves_around": "1"})])
+        self.assertEqual(self.table.select(revolves_around="5"), [])
+
+    def test_update_reindexes(self):
+        self.table.update_row("2", {"revolves_around": "0"})
+        self.assertEqual([id for id, rep in self.table.select(revolves_around="0")],
+                         ["1", "2"])
+        self.assertEqual(self.table.select(revolves_around="1"), [])
+
+    def test_ids_are_monotonic(self):
+        del self.table["2"]
+        self.assertEqual(self.table.insert({"name": u"Mars"}), "3")
+        self.assertEqual(self.table.insert({"name": u"Venus"}), "4")
+        self.assertEqual(list(self.table), ["0", "1", "3", "4"])
+
+    def test_deepcopy(self):
+        other = copy.deepcopy(self.table)
+        other.update_row("1", {"name": u"Terra"})
+        self.assertEqual(self.table["1"]["name"], u"Earth")
+        self.assertEqual(len(other.select(revolves_around="0")), 1)
+
+    def test_non_string_ids(self):
+        table = Table({1: {"name": u"Sun"}})
+        table[(2, 3)] = {"name": u"Earth"}
+        self.assertEqual(table.insert({"name": u"Moon"}), "0")
+
+    def test_unhashable_values(self):
+        table = Table({
+            "0": {"tags": [u"hot"]},
+            "1": {"tags": u"cold"},
+        }, index_fields=["tags"])
+        self.assertEqual(table.select(tags=[u"hot"]), [("0", {"tags": [u"hot"]})])
+        self.assertEqual(table.select(tags=u"cold"), [("1", {"tags": u"cold"})])
+        table.update_row("0", {"tags": [u"warm"]})
+        self.assertEqual(table.select(tags=[u"warm"]), [("0", {"tags": [u"warm"]})])
+
+
+class TestDatabase(TestCase):
+
+    def test_swap_leaves_rows_alone(self):
+        rows = {"0": {"name": u"Sun"}}
+        data = {"Sphere": rows}
+        with db.swap(data):
+            table = db.table("Sphere")
+            table.update_row("0", {"name": u"Sol"})
+            table.insert({"name": u"Earth"})
+            self.assertIs(db.table("Sphere"), table)
+            self.assertIs(db["Sphere"], table)
+        self.assertIs(data["Sphere"], rows)
+        self.assertEqual(rows, {"0": {"name": u"Sun"}})
+        with db.swap(data):
+            self.assertEqual(len(db.table("Sphere")), 1)
+
+    def test_unhashable_query_field(self):
+        class Star(DBModel):
+            table_name = "Star"
+            query_fields = [optional(u"tags", Array(String))]
+
+        with db.swap({"Star": {"0": {u"tags": [u"red"]}}}):
+            self.assertEqual(Star.get_list(tags=[u"red"]),
+                             [("0", {u"tags": [u"red"]})])
@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from unittest2 import TestCase
 
 from cosmic.tools import *
@@ -105,6 +107,59 @@ class TestAssertIsCompatible(TestCase):
             assert_is_compatible(s, ("a",), ("b",))
 
 
+class TestActionPlan(TestCase):
+    def test_one_arg(self):
+        def f(a=None): pass
+
+        plan = ActionPlan(f, Array(Integer), Integer)
+        self.assertEqual(plan.bind([1, 2]), {"a": [1, 2]})
+        self.assertEqual(plan.bind(None), {})
+
+    def test_multiple_args(self):
+        def f(a, b=None): pass
+
+        accepts = Struct([
+            required("a", Integer),
+            optional("b", Integer),
+        ])
+        plan = ActionPlan(f, accepts)
+        self.assertEqual(plan.bind({"a": 1}), {"a": 1})
+        self.assertEqual(plan.deserialize(Box({"a": 1, "b": 2})),
+                         {"a": 1, "b": 2})
+        with self.assertRaisesRegexp(ValidationError, "Expected Box"):
+            plan.deserialize(None)
+
+    def test_incompatible(self):
+        def f(a, b): pass
+
+        with self.assertRaisesRegexp(SpecError, "Struct"):
+            ActionPlan(f, Integer)
+
+    def test_serialize(self):
+        def f(): pass
+
+        plan = ActionPlan(f, returns=Array(DateTime))
+        d = datetime(2013, 10, 18)
+        for trusted in [False, True]:
+            self.assertEqual(plan.serialize([d], trusted=trusted).datum,
+                             ["2013-10-18T00:00:00"])
+            with self.assertRaisesRegexp(ValidationError, "found None"):
+                plan.serialize(None, trusted=trusted)
+
+    def test_unresolved_model(self):
+        def f(): pass
+
+        # Models may be registered after actions that return them
+        plan = ActionPlan(f, returns=Representation(Model('zoo.Animal')))
+        self.assertEqual(plan.argument, None)
+
+    def test_without_func(self):
+        plan = ActionPlan(accepts=Binary, returns=Stream)
+        self.assertTrue(plan.raw_request)
+        self.assertTrue(plan.stream_response)
+        self.assertEqual(plan.bind(b"x"), b"x")
+
+
 class TestSchemaHelpers(TestCase):
     def test_deserialize_json(self):
         with self.assertRaisesRegexp(ValidationError, "Expected Box, found None"):
@@ -160,3 +215,25 @@ class TestSerializeJSON(TestCase):
 
 
 
+
+class TestTrustedSerializer(TestCase):
+    def test_matches_to_json(self):
+        from datetime import datetime
+        s = Struct([
+            required("a", Array(Integer)),
+            optional("b", Map(DateTime)),
+            optional("c", JSON),
+            optional("d", String),
+        ])
+        datum = {
+            "a": (1, 2),
+            "b": {u"x": datetime(2014, 1, 1)},
+            "c": Box({"y": None}),
+            "d": None,
+        }
+        self.assertEqual(trusted_serializer(s)(datum), s.to_json(datum))
+
+    def test_cached(self):
+        s = Array(Struct([required("a", Integer)]))
+        self.assertIs(trusted_serializer(s), trusted_serializer(s))
+        self.assertEqual(trusted_serializer(String)(u"x"), u"x")